@@ -0,0 +1,27 @@
+from functools import wraps
+
+from flask import current_app, jsonify
+from flask_login import current_user, login_required
+
+
+def is_admin(user=None):
+    """True when the user's email is listed in ADMIN_EMAILS."""
+    user = user or current_user
+    if not getattr(user, "is_authenticated", False):
+        return False
+    email = (getattr(user, "email", "") or "").lower()
+    return bool(email) and email in current_app.config.get("ADMIN_EMAILS", ())
+
+
+def admin_required(view):
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({"ok": False, "error": "Admins only"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def parse_admin_emails(value):
+    return frozenset(e.strip().lower() for e in (value or "").split(",") if e.strip())
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from flask import g, jsonify, request
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_REJECTED
+
+
+class WeightedLimiter:
+    """Per-process concurrency limit counted in weight units.
+
+    A request of weight w may start while no more than capacity - w units are
+    in use; otherwise it waits up to its deadline and is then refused.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, weight, timeout):
+        # a route heavier than the whole limit still gets to run on its own
+        weight = min(weight, self.capacity)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_use + weight > self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.in_use += weight
+        return True
+
+    def release(self, weight):
+        weight = min(weight, self.capacity)
+        with self._cond:
+            self.in_use -= weight
+            self._cond.notify_all()
+
+
+def parse_weights(spec):
+    """"api_community=4,my_forums=2" -> {"api_community": 4, "my_forums": 2}."""
+    weights = {}
+    for item in (spec or "").split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() and weight.strip():
+            weights[name.strip()] = int(weight)
+    return weights
+
+
+def init_admission(app):
+    """Shed load on the weighted endpoints once ADMISSION_CAPACITY is in use.
+
+    Only endpoints listed in ADMISSION_WEIGHTS are limited, so cheap routes
+    (get_thread, static files) keep being served while the expensive ones get a
+    fast 503 with Retry-After instead of queueing until the worker is stuck.
+    """
+    capacity = app.config["ADMISSION_CAPACITY"]
+    if capacity <= 0:
+        return None
+    limiter = WeightedLimiter(capacity)
+    app.extensions["admission"] = limiter
+
+    @app.before_request
+    def admit_request():
+        weight = app.config["ADMISSION_WEIGHTS"].get(request.endpoint)
+        if not weight:
+            return None
+        if not limiter.acquire(weight, app.config["ADMISSION_QUEUE_MS"] / 1000):
+            ADMISSION_REJECTED.inc(endpoint=request.endpoint)
+            app.logger.warning("Shed %s: %d/%d admission units in use",
+                               request.endpoint, limiter.in_use, capacity)
+            response = jsonify({"ok": False, "error": "Server is busy, please retry shortly"})
+            response.status_code = 503
+            response.headers["Retry-After"] = str(app.config["ADMISSION_RETRY_AFTER"])
+            return response
+        g._admission_weight = weight
+        ADMISSION_IN_FLIGHT.set(limiter.in_use)
+
+    @app.teardown_request
+    def release_admission(exc):
+        weight = g.pop("_admission_weight", None)
+        if weight:
+            limiter.release(weight)
+            ADMISSION_IN_FLIGHT.set(limiter.in_use)
+
+    return limiter
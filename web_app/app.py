@@ -1,17 +1,48 @@
 import os
+import re
+import time
+import logging
+import click
 from bson import ObjectId
 from bson.errors import InvalidId
 from json import JSONEncoder
 import json
-from flask import Flask, redirect, render_template, request, url_for, flash, jsonify
-from pymongo import MongoClient
+from flask import Flask, Response, redirect, render_template, request, url_for, flash, jsonify
+from flask.json.provider import DefaultJSONProvider
+from markupsafe import Markup
+from pymongo import MongoClient, ReturnDocument
 from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 from models import User
+from authors import fan_out_author_username, backfill_author_usernames
+from instrumentation import init_instrumentation, parse_time_budgets
+from metrics import init_metrics
+from admin import admin_required, parse_admin_emails
+from slowlog import SlowQueryRecorder, recent_slow_queries
+from profiling import init_profiling
+from admission import init_admission, parse_weights
+from logconfig import configure_logging, parse_levels
+from cache import LRUCache, TieredCache
+from resp import RespClient
+from warmup import CacheWarmer
+from viewcounts import ViewCounter
+from transactions import write_together
+from tasks import TaskRunner, ensure_task_indexes, HIGH_PRIORITY
+from migrations import drop_user_threads, compact_thread_posts
+from ingest import PayloadError, read_json_object
+from snapshots import DEFAULT_PIC, character_snapshot, compact_post, expand_posts
+from feed import (FEED_CARD_FIELDS, sync_feed_item, remove_feed_item, ensure_feed_indexes, rebuild_feed,
+                  rank_feed, TrendingRanker)
+from httpcache import (COMMUNITY_KEY, PUBLISHED_FORUMS_KEY, SurrogatePurger, author_key, cache_publicly,
+                       thread_key, thread_surrogate_keys)
+from livefeed import LiveFeed, record_removal, ensure_live_feed_indexes
 from dotenv import load_dotenv
 from datetime import datetime
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 login_manager = LoginManager()
+# /api/community?sort= values and the feed_items field each orders by
+FEED_SORT_KEYS = {"recent": "published_at", "trending": "trending_score"}
 class MongoJSONEncoder(JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ObjectId):
@@ -21,12 +52,211 @@ class MongoJSONEncoder(JSONEncoder):
             return obj.isoformat()
         return super().default(obj)
 
+class MongoJSONProvider(DefaultJSONProvider):
+    # Flask >= 2.3 ignores app.json_encoder; jsonify goes through this instead
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, (ObjectId, datetime)):
+            return MongoJSONEncoder().default(obj)
+        return DefaultJSONProvider.default(obj)
+
+def _running_cli_command():
+    """True while `flask <command>` builds the app; only `flask run` goes on to serve."""
+    ctx = click.get_current_context(silent=True)
+    return ctx is not None and ctx.info_name != "run"
+
+
+def ensure_indexes(db, feed_horizon_days):
+    # register relies on this to keep concurrent sign-ups with one email apart
+    db.users.create_index("email", unique=True)
+    # listings read author_username off the thread, so these are the only lookups.
+    # (user_id, updated_at) also answers "which threads are this user's"; users
+    # keep no list of their thread ids.
+    db.forums.create_index([("user_id", 1), ("updated_at", -1)])
+    db.forums.create_index([("status", 1), ("published_at", -1)])
+    ensure_feed_indexes(db, feed_horizon_days)
+    ensure_task_indexes(db)
+    ensure_live_feed_indexes(db)
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+def search_clause(q):
+    regex = {"$regex": q, "$options": "i"}
+    return [
+        {"title": regex},
+        {"characters.name": regex},
+        {"characters.nickname": regex},
+        {"characters.fandom": regex},
+    ]
+
+# Serializers shared by the JSON APIs and the pages that inline their first load
+def my_forum_summary(doc):
+    return {
+        "id": str(doc.get("_id")),
+        "title": doc.get("title", ""),
+        "status": doc.get("status", "draft"),
+        "post_count": len(doc.get("posts", [])),
+        "characters": doc.get("characters", []),
+        "author_username": doc.get("author_username", "Anonymous"),
+        "updated_at": _isoformat(doc.get("updated_at")),
+        "created_at": _isoformat(doc.get("created_at")),
+    }
+
+def published_forum_summary(doc):
+    return {
+        "id": str(doc["_id"]),
+        "title": doc.get("title", "Untitled"),
+        "post_count": len(doc.get("posts", [])),
+        "characters": doc.get("characters", []),
+        "author_username": doc.get("author_username", "Anonymous"),
+        "created_at": _isoformat(doc.get("created_at")),
+        "published_at": _isoformat(doc.get("published_at")),
+    }
+
+def thread_detail(doc):
+    # views is the stored count; callers add the unflushed views
+    return {
+        "id": str(doc.get("_id")),
+        "title": doc.get("title", ""),
+        "status": doc.get("status", "draft"),
+        "posts": doc.get("posts", []),
+        "characters": doc.get("characters", []),
+        "views": doc.get("views") or 0,
+        "updated_at": _isoformat(doc.get("updated_at")),
+        "created_at": _isoformat(doc.get("created_at")),
+    }
+
+def db_character_summary(char):
+    return {
+        "_id": str(char.get("_id")),
+        "name": char.get("name", ""),
+        "nickname": char.get("nickname", ""),
+        "fandom": char.get("fandom", ""),
+        "pic": char.get("pic", "/static/images/default.png"),
+    }
+
 def create_app(testing=False):
+    if not testing:
+        # JSON lines written from a background thread; e.g. LOG_LEVELS="app=DEBUG,slowlog=WARNING"
+        configure_logging(
+            level=os.getenv("LOG_LEVEL", "INFO"),
+            module_levels=parse_levels(os.getenv("LOG_LEVELS")),
+            debug_sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1.0)),
+        )
     app = Flask(__name__, static_folder='static', static_url_path='/static')
     app.secret_key = os.getenv("SECRET_KEY")
-    app.json_encoder = MongoJSONEncoder
+    app.json = MongoJSONProvider(app)
     login_manager.init_app(app)
     login_manager.login_view = "login" 
+    # published threads older than this drop out of the community feed
+    app.config["FEED_HORIZON_DAYS"] = int(os.getenv("FEED_HORIZON_DAYS", 90))
+    # requests issuing more Mongo commands / DB time than this get logged
+    app.config["QUERY_BUDGET_COUNT"] = int(os.getenv("QUERY_BUDGET_COUNT", 20))
+    app.config["QUERY_BUDGET_MS"] = float(os.getenv("QUERY_BUDGET_MS", 200))
+    # Mongo deadline (maxTimeMS) per request, overridable per endpoint; 0 disables it
+    app.config["QUERY_TIMEOUT_MS"] = float(os.getenv("QUERY_TIMEOUT_MS", 5000))
+    app.config["QUERY_TIMEOUTS"] = parse_time_budgets(os.getenv(
+        "QUERY_TIMEOUTS", "api_published_forums=1000,my_forums=1000,api_community=1000"))
+    db_listener = init_instrumentation(app)
+    # per-worker snapshots are merged from here when running several gunicorn workers
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR")
+    metrics_listeners = init_metrics(app)
+    app.config["ADMIN_EMAILS"] = parse_admin_emails(os.getenv("ADMIN_EMAILS"))
+    # reads slower than SLOW_QUERY_MS are logged; this fraction of them gets explain()ed
+    app.config["SLOW_QUERY_MS"] = float(os.getenv("SLOW_QUERY_MS", 100))
+    app.config["SLOW_QUERY_EXPLAIN_RATE"] = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", 1.0))
+    app.config["SLOW_QUERY_LOG_SIZE"] = int(os.getenv("SLOW_QUERY_LOG_SIZE", 500))
+    slow_queries = SlowQueryRecorder(app.config["SLOW_QUERY_MS"], app.config["SLOW_QUERY_EXPLAIN_RATE"])
+    # profiles are only taken when PROFILE_DIR is set: on admin request (X-Profile header
+    # or ?__profile=1) or for 1 in PROFILE_SAMPLE_EVERY requests
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR")
+    app.config["PROFILE_SAMPLE_EVERY"] = int(os.getenv("PROFILE_SAMPLE_EVERY", 0))
+    app.config["PROFILE_MODE"] = os.getenv("PROFILE_MODE", "cprofile")
+    init_profiling(app)
+    # expensive endpoints share ADMISSION_CAPACITY weight units per process; requests
+    # that cannot start within ADMISSION_QUEUE_MS get a 503 (0 disables the limiter)
+    app.config["ADMISSION_CAPACITY"] = int(os.getenv("ADMISSION_CAPACITY", 8))
+    app.config["ADMISSION_WEIGHTS"] = parse_weights(os.getenv(
+        "ADMISSION_WEIGHTS", "api_community=4,my_forums=2,api_published_forums=2"))
+    app.config["ADMISSION_QUEUE_MS"] = float(os.getenv("ADMISSION_QUEUE_MS", 250))
+    app.config["ADMISSION_RETRY_AFTER"] = int(os.getenv("ADMISSION_RETRY_AFTER", 1))
+    init_admission(app)
+    # rendered posts of published threads, keyed by thread id and checked against updated_at
+    app.config["THREAD_HTML_CACHE_SIZE"] = int(os.getenv("THREAD_HTML_CACHE_SIZE", 512))
+    # createforum limits: request body bytes, posts per thread, characters per post
+    app.config["THREAD_MAX_BYTES"] = int(os.getenv("THREAD_MAX_BYTES", 4 * 1024 * 1024))
+    app.config["THREAD_MAX_POSTS"] = int(os.getenv("THREAD_MAX_POSTS", 2000))
+    app.config["POST_MAX_CHARS"] = int(os.getenv("POST_MAX_CHARS", 20000))
+    thread_html_cache = LRUCache(app.config["THREAD_HTML_CACHE_SIZE"], name="thread_html")
+    # feed and thread data: per-worker LRU (entries live CACHE_L1_TTL_SECONDS at most) over
+    # an optional Redis-protocol server shared by all workers
+    app.config["CACHE_REDIS_URL"] = os.getenv("CACHE_REDIS_URL", "")
+    app.config["CACHE_L1_SIZE"] = int(os.getenv("CACHE_L1_SIZE", 1024))
+    app.config["CACHE_L1_TTL_SECONDS"] = float(os.getenv("CACHE_L1_TTL_SECONDS", 5))
+    app.config["CACHE_FEED_TTL_SECONDS"] = float(os.getenv("CACHE_FEED_TTL_SECONDS", 30))
+    app.config["CACHE_THREAD_TTL_SECONDS"] = float(os.getenv("CACHE_THREAD_TTL_SECONDS", 300))
+    data_cache = TieredCache(
+        LRUCache(app.config["CACHE_L1_SIZE"], name="data"),
+        RespClient(app.config["CACHE_REDIS_URL"]) if app.config["CACHE_REDIS_URL"] else None,
+        l1_ttl=app.config["CACHE_L1_TTL_SECONDS"],
+    )
+    app.extensions["data_cache"] = data_cache
+    # a new worker fills those caches (feed pages, the CACHE_WARMUP_THREADS top trending
+    # threads) on a background thread for at most CACHE_WARMUP_SECONDS (0: no warm-up);
+    # the data cache only with an L2 to keep it, L1 would drop it within CACHE_L1_TTL_SECONDS
+    app.config["CACHE_WARMUP_SECONDS"] = float(os.getenv("CACHE_WARMUP_SECONDS", 10))
+    app.config["CACHE_WARMUP_THREADS"] = int(os.getenv("CACHE_WARMUP_THREADS", 50))
+    cache_warmer = CacheWarmer(app.config["CACHE_WARMUP_SECONDS"])
+    app.extensions["cache_warmer"] = cache_warmer
+    # thread views are counted in memory and $inc'ed into forums.views this often
+    app.config["VIEW_FLUSH_SECONDS"] = float(os.getenv("VIEW_FLUSH_SECONDS", 10))
+    # a flush changes the stored count the cached thread data carries
+    view_counter = ViewCounter(app.config["VIEW_FLUSH_SECONDS"],
+                               on_flush=lambda ids: data_cache.invalidate(*map(thread_key, ids)))
+    app.extensions["view_counter"] = view_counter
+    # side effects of writes (feed cards, author/character copies) run on a pool of
+    # TASK_WORKERS threads, persisted in the tasks collection; tests run them by hand
+    app.config["TASK_WORKERS"] = int(os.getenv("TASK_WORKERS", 2))
+    app.config["TASK_QUEUE_SIZE"] = int(os.getenv("TASK_QUEUE_SIZE", 1000))
+    app.config["TASK_MAX_ATTEMPTS"] = int(os.getenv("TASK_MAX_ATTEMPTS", 5))
+    app.config["TASK_BACKOFF_SECONDS"] = float(os.getenv("TASK_BACKOFF_SECONDS", 1))
+    tasks = TaskRunner(
+        lambda: app.db,
+        workers=0 if testing else app.config["TASK_WORKERS"],
+        max_queue=app.config["TASK_QUEUE_SIZE"],
+        max_attempts=app.config["TASK_MAX_ATTEMPTS"],
+        backoff=app.config["TASK_BACKOFF_SECONDS"],
+    )
+    app.extensions["tasks"] = tasks
+    # feed_items.trending_score is recomputed this often (0: only via `flask rank-feed`)
+    app.config["TRENDING_INTERVAL_SECONDS"] = float(os.getenv("TRENDING_INTERVAL_SECONDS", 300))
+    app.config["TRENDING_HALF_LIFE_HOURS"] = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 24))
+    # /api/community/stream: open streams per worker (each holds a thread), poll
+    # interval when there is no change stream, keep-alive comment interval
+    app.config["LIVE_FEED_MAX_CONNECTIONS"] = int(os.getenv("LIVE_FEED_MAX_CONNECTIONS", 8))
+    app.config["LIVE_FEED_POLL_SECONDS"] = float(os.getenv("LIVE_FEED_POLL_SECONDS", 2))
+    app.config["LIVE_FEED_HEARTBEAT_SECONDS"] = float(os.getenv("LIVE_FEED_HEARTBEAT_SECONDS", 15))
+    live_feed = LiveFeed(
+        lambda: app.db,
+        poll_interval=app.config["LIVE_FEED_POLL_SECONDS"],
+        max_subscribers=app.config["LIVE_FEED_MAX_CONNECTIONS"],
+        autostart=not testing,
+    )
+    app.extensions["live_feed"] = live_feed
+    # how long proxies/CDNs may serve public reads (0: not at all), and serve them stale
+    # while refetching; a changed thread is purged by surrogate key from HTTP_CACHE_PURGE_URLS
+    app.config["HTTP_CACHE_MAX_AGE"] = int(os.getenv("HTTP_CACHE_MAX_AGE", 30))
+    app.config["HTTP_CACHE_STALE_SECONDS"] = int(os.getenv("HTTP_CACHE_STALE_SECONDS", 60))
+    app.config["HTTP_CACHE_PURGE_URLS"] = [
+        url.strip() for url in os.getenv("HTTP_CACHE_PURGE_URLS", "").split(",") if url.strip()]
+    purger = SurrogatePurger(app.config["HTTP_CACHE_PURGE_URLS"])
+    app.extensions["surrogate_purger"] = purger
+
+
+    def cache_public(response, *keys):
+        return cache_publicly(response, keys, app.config["HTTP_CACHE_MAX_AGE"],
+                              app.config["HTTP_CACHE_STALE_SECONDS"])
 
     if testing:
         app.config["TESTING"] = True
@@ -34,22 +264,46 @@ def create_app(testing=False):
     else:
         # client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
         MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-        print("MONGO URI I AM USING:", MONGO_URI)
-        client = MongoClient(MONGO_URI)
+        logger.info("Connecting to MongoDB at %s", re.sub(r"//[^@/]+@", "//***@", MONGO_URI))
+        client = MongoClient(MONGO_URI, event_listeners=[db_listener, *metrics_listeners, slow_queries])
         db_name = os.getenv("DB_NAME", "forum_db")
         app.db = client[db_name]
 
         try:
             client.admin.command("ping")
-            print(" * Connected to MongoDB!")
-            print(" * Using DB:", app.db.name)
-            print(" * Users count:", app.db.users.count_documents({}))
+            logger.info("Connected to MongoDB, using DB %s", app.db.name)
+            ensure_indexes(app.db, app.config["FEED_HORIZON_DAYS"])
+            slow_queries.bind(app.db, app.config["SLOW_QUERY_LOG_SIZE"])
         except Exception as e:
-            print(" * MongoDB connection error:", e)
+            logger.error("MongoDB connection error: %s", e)
+
+    @tasks.task("feed.sync", priority=HIGH_PRIORITY)
+    def sync_feed_task(thread_id):
+        # reads the thread as it is now, so a late or repeated run is harmless
+        thread = app.db.forums.find_one({"_id": thread_id})
+        if thread is None or thread.get("status") != "published":
+            # deleted or unpublished; a thread that had a card was public, so tell live feed pollers
+            listed = remove_feed_item(app.db, thread_id)
+            if listed:
+                record_removal(app.db, thread_id)
+        else:
+            listed = sync_feed_item(app.db, thread_id, thread)
+        # after the card, so a proxy that refetches at once sees the new feed; a failed
+        # purge retries the whole (idempotent) task. The listings are purged only when the
+        # card changed, so draft saves leave them cached (as does a retry after a dropped
+        # card: they then age out within their max-age)
+        keys = thread_surrogate_keys(thread_id) if listed else [thread_key(thread_id)]
+        data_cache.invalidate(*keys)
+        purger.purge(keys)
+
+    @tasks.task("authors.fan_out")
+    def author_fan_out_task(user_id, username):
+        fan_out_author_username(app.db, user_id, username)
+        data_cache.invalidate(author_key(user_id), COMMUNITY_KEY, PUBLISHED_FORUMS_KEY)
 
     @login_manager.user_loader
     def load_user(user_id):
-        db_user = app.db.users.find_one({"_id": ObjectId(user_id)})
+        db_user = app.db.users.find_one({"_id": ObjectId(user_id)}, User.USER_FIELDS)
         return User(db_user) if db_user else None
     
     @app.route("/")
@@ -66,7 +320,7 @@ def create_app(testing=False):
                 flash("Please fill in both fields!")
                 return redirect(url_for("login"))
             
-            db_email = app.db.users.find_one({"email": email})
+            db_email = app.db.users.find_one({"email": email}, {**User.USER_FIELDS, "password": 1})
             # no such user
             if not db_email:
                 flash("Email not registered.")
@@ -104,21 +358,25 @@ def create_app(testing=False):
                 flash("Passwords do not match!")
                 return redirect(url_for("register"))
             
-            db_email = app.db.users.find_one({"email": email})
-            if db_email:
+            # one round trip: insert unless the email exists, and get the stored user back.
+            # The _id is chosen here, so an _id that isn't ours means the email was taken.
+            new_id = ObjectId()
+            user_doc = app.db.users.find_one_and_update(
+                {"email": email},
+                {"$setOnInsert": {
+                    "_id": new_id,
+                    "username": username,
+                    "password": password,
+                    "characters": [],
+                }},
+                projection=User.USER_FIELDS,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            if user_doc["_id"] != new_id:
                 flash("Email already registered!")
                 return redirect(url_for("register"))
-        
-            new_user = ({
-                "username": username,
-                "email": email,
-                "password": password,
-                "characters": [],
-                "threads": [],
-            })
-            doc = app.db.users.insert_one(new_user)
 
-            user_doc = app.db.users.find_one({"_id": doc.inserted_id})
             user = User(user_doc)
             login_user(user)
 
@@ -128,17 +386,63 @@ def create_app(testing=False):
     @app.route("/profile")
     @login_required
     def profile():
-        userdata = app.db.users.find_one({"_id": ObjectId(current_user.id)})
+        userdata = app.db.users.find_one({"_id": ObjectId(current_user.id)}, User.USER_FIELDS)
         return render_template("profile.html", user = userdata)
     
+    @app.route("/profile/username", methods=["POST"])
+    @login_required
+    def update_username():
+        username = (request.form.get("username") or "").strip()
+        if not username:
+            flash("Username cannot be empty!")
+            return redirect(url_for("profile"))
+
+        user_oid = ObjectId(current_user.id)
+        app.db.users.update_one({"_id": user_oid}, {"$set": {"username": username}})
+        # threads keep a copy of the author's name; rewrite them off the request thread
+        tasks.enqueue("authors.fan_out", {"user_id": user_oid, "username": username})
+        flash("Username updated!")
+        return redirect(url_for("profile"))
+
     @app.route("/forum")
     @login_required
     def forum():
-        return render_template("forum.html")
+        return render_template("forum.html", initial_data=my_forums_payload())
     
     @app.route("/viewthread/<thread_id>")
     def viewthread(thread_id):
-        return render_template("viewthread.html")
+        try:
+            thread_oid = ObjectId(thread_id)
+        except InvalidId:
+            return render_template("viewthread.html", thread=None)
+
+        head = app.db.forums.find_one({"_id": thread_oid}, {"status": 1, "updated_at": 1, "views": 1})
+        if not head or head.get("status") != "published":
+            # drafts (and errors) are loaded client-side from /api/thread/<id>
+            return render_template("viewthread.html", thread=None)
+        view_counter.record(thread_oid)
+        views = view_counter.count(thread_oid, head.get("views"))
+
+        cached = thread_html_cache.get(str(thread_oid))
+        if cached is None or cached["updated_at"] != head.get("updated_at"):
+            thread = app.db.forums.find_one({"_id": thread_oid})
+            if not thread:
+                return render_template("viewthread.html", thread=None)
+            cached = render_thread_page(thread)
+        return render_template("viewthread.html", thread=cached, views=views)
+
+    def render_thread_page(thread):
+        """Render a thread's posts once and keep them in thread_html_cache."""
+        posts = expand_posts(thread.get("posts", []), thread.get("characters"))
+        cached = {
+            "updated_at": thread.get("updated_at"),
+            "title": thread.get("title", ""),
+            "reply_count": max(len(posts) - 1, 0),
+            "posts_html": Markup(render_template(
+                "_thread_posts.html", posts=posts, created_at=thread.get("created_at"))),
+        }
+        thread_html_cache.set(str(thread["_id"]), cached)
+        return cached
     
     @app.route("/api/thread/<thread_id>")
     def get_thread(thread_id):
@@ -147,7 +451,20 @@ def create_app(testing=False):
         except InvalidId:
             return jsonify({"ok": False, "error": "Invalid thread id"}), 400
         
-        thread = app.db.forums.find_one({"_id": thread_oid})
+        loaded = []
+
+        def load():
+            loaded.append(app.db.forums.find_one({"_id": thread_oid}))
+            return loaded[0]
+
+        cached = cached_thread(thread_oid, load)
+        if cached is not None:
+            thread_data = dict(cached["thread"])
+            thread_data["views"] = view_counter.count(thread_oid, thread_data["views"])
+            return cache_public(jsonify({"ok": True, "thread": thread_data}), thread_key(thread_oid))
+
+        # a draft, or a thread another request failed to load
+        thread = loaded[0] if loaded else app.db.forums.find_one({"_id": thread_oid})
         if not thread:
             return jsonify({"ok": False, "error": "Thread not found"}), 404
         
@@ -158,17 +475,22 @@ def create_app(testing=False):
             if not current_user.is_authenticated or owner != ObjectId(current_user.id):
                 return jsonify({"ok": False, "error": "Thread not visible to you"}), 403
         
-        thread_data = {
-            "id": str(thread.get("_id")),
-            "title": thread.get("title", ""),
-            "status": status,
-            "posts": thread.get("posts", []),
-            "characters": thread.get("characters", []),
-            "updated_at": thread.get("updated_at").isoformat() if thread.get("updated_at") else None,
-            "created_at": thread.get("created_at").isoformat() if thread.get("created_at") else None,
-        }
-        
+        thread_data = thread_detail(thread)
+        thread_data["views"] = view_counter.count(thread_oid, thread_data["views"])
         return jsonify({"ok": True, "thread": thread_data})
+
+    def cached_thread(thread_oid, load):
+        """The data cache entry of a published thread, calling load() for the document on a miss."""
+        def load_published():
+            thread = load()
+            if not thread or thread.get("status") != "published":
+                return None     # drafts are private, so only published threads are cached
+            return {"author_id": str(thread.get("user_id")), "thread": thread_detail(thread)}
+
+        return data_cache.get_or_load(
+            f"thread:{thread_oid}", load_published, app.config["CACHE_THREAD_TTL_SECONDS"],
+            lambda entry: [thread_key(thread_oid), author_key(entry["author_id"])],
+        )
     
     #character routes
     @app.route("/characters")
@@ -203,12 +525,11 @@ def create_app(testing=False):
                         if user and "characters" in user:
                             character = user["characters"][0]
                     except Exception as e:
-                        print(f"ERROR loading character {char_id}: {e}", flush=True)
-                # Pass db_characters to template (empty list since JS fetches from API)
-                db_characters = []
-                return render_template("addcharacter.html", character=character, db_characters=db_characters)
+                        logger.error("Error loading character %s: %s", char_id, e)
+                return render_template("addcharacter.html", character=character,
+                                       initial_data=db_characters_payload())
             except Exception as e:
-                print(f"ERROR in addcharacter GET: {e}", flush=True)
+                logger.exception("Error in addcharacter GET")
                 flash("An error occurred loading the page.")
                 return redirect(url_for("characters"))
         char_id = request.form.get("id")
@@ -246,18 +567,12 @@ def create_app(testing=False):
     @app.route("/api/db_characters")
     @login_required
     def api_db_characters():
-        user = app.db.users.find_one({"_id": ObjectId(current_user.id)})
-        char_doc = user.get("characters", [])
-        characters = []
-        for char in char_doc:
-            characters.append({
-                "_id": str(char.get("_id")),
-                "name": char.get("name", ""),
-                "nickname": char.get("nickname", ""),
-                "fandom": char.get("fandom", ""),
-                "pic": char.get("pic", "/static/images/default.png")
-            })
-        return jsonify({"ok": True, "characters": characters})
+        return jsonify(db_characters_payload())
+
+    def db_characters_payload():
+        user = app.db.users.find_one({"_id": ObjectId(current_user.id)}, {"characters": 1})
+        characters = (user or {}).get("characters") or []
+        return {"ok": True, "characters": [db_character_summary(c) for c in characters]}
 
     @app.route("/deletecharacter/<char_id>", methods=['POST'])
     @login_required
@@ -277,20 +592,11 @@ def create_app(testing=False):
     @login_required
     def createforum():
         if request.method == 'POST':
-            data = request.get_json()
-            if not data:
+            if not request.is_json:
                 return jsonify({"ok": False, "error": "Expected JSON body"}), 400
-            
-            title = (data.get("title", "Untitled")).strip()
-            status = data.get("status", "draft")
-            posts_data = data.get("posts", [])
-            thread_id = data.get("id")
-            if not title:
-                return jsonify({"ok": False, "error": "Title is required"}), 400
-            if not posts_data:
-                return jsonify({"ok": False, "error": "At least one post is required"}), 400
-            
-            now = datetime.utcnow()
+            max_bytes = app.config["THREAD_MAX_BYTES"]
+            if request.content_length is not None and request.content_length > max_bytes:
+                return jsonify({"ok": False, "error": f"Request body is larger than {max_bytes} bytes"}), 413
 
             # Validate posts against user characters and build character snapshot
             user_doc = app.db.users.find_one({"_id": ObjectId(current_user.id)})
@@ -298,50 +604,70 @@ def create_app(testing=False):
             if not user_characters:
                 return jsonify({"ok": False, "error": "You have no characters; add one first."}), 400
 
-            character_lookup = {str(c.get("_id")): c for c in user_characters}
             sanitized_posts = []
             unique_chars = {}
-            for idx, post in enumerate(posts_data):
+            max_post_chars = app.config["POST_MAX_CHARS"]
+
+            def add_post(idx, post):
+                # called for each post as it is parsed; raising stops reading the body
+                if not isinstance(post, dict):
+                    raise PayloadError(f"Post {idx+1} must be an object")
                 char_index = post.get("characterIndex")
                 try:
                     char_index = int(char_index)
                 except Exception:
-                    return jsonify({"ok": False, "error": f"Invalid character index in post {idx+1}"}), 400
+                    raise PayloadError(f"Invalid character index in post {idx+1}")
                 if char_index < 0 or char_index >= len(user_characters):
-                    return jsonify({"ok": False, "error": f"Character index out of range in post {idx+1}"}), 400
+                    raise PayloadError(f"Character index out of range in post {idx+1}")
                 char_info = user_characters[char_index]
 
                 nickname = (post.get("nickname") or char_info.get("nickname") or "").strip()
-                avatar = post.get("avatar") or char_info.get("pic") or "/static/images/default.png"
+                avatar = post.get("avatar") or char_info.get("pic") or DEFAULT_PIC
                 content = (post.get("content") or "").strip()
                 floor = post.get("floor") or (idx + 1)
 
                 if not content:
-                    return jsonify({"ok": False, "error": f"Content required for post {idx+1}"}), 400
+                    raise PayloadError(f"Content required for post {idx+1}")
+                if len(content) > max_post_chars:
+                    raise PayloadError(f"Post {idx+1} is longer than {max_post_chars} characters")
 
-                sanitized_posts.append({
+                char_key = str(char_info.get("_id"))
+                if char_key not in unique_chars:
+                    unique_chars[char_key] = character_snapshot(char_info)
+                # the snapshot holds the character's name and fandom; the post keeps overrides only
+                sanitized_posts.append(compact_post({
                     "characterIndex": char_index,
-                    "character_id": str(char_info.get("_id")),
-                    "character_name": char_info.get("name", ""),
-                    "character_fandom": char_info.get("fandom", ""),
                     "nickname": nickname,
                     "avatar": avatar,
                     "content": content,
                     "floor": floor
-                })
+                }, unique_chars[char_key]))
 
-                char_key = str(char_info.get("_id"))
-                if char_key not in unique_chars:
-                    unique_chars[char_key] = {
-                        "_id": char_key,
-                        "name": char_info.get("name", ""),
-                        "nickname": char_info.get("nickname", ""),
-                        "fandom": char_info.get("fandom", ""),
-                        "pic": char_info.get("pic", "/static/images/default.png")
-                    }
+            # posts are parsed one at a time off the request stream, never as one big document
+            try:
+                data, _ = read_json_object(
+                    request.stream, "posts", add_post,
+                    max_bytes=max_bytes,
+                    max_items=app.config["THREAD_MAX_POSTS"],
+                    # room for a post of POST_MAX_CHARS even if every character is \u-escaped
+                    max_item_chars=6 * max_post_chars + 4096,
+                )
+            except PayloadError as e:
+                return jsonify({"ok": False, "error": str(e)}), e.status
+
+            title = (data.get("title", "Untitled")).strip()
+            status = data.get("status", "draft")
+            thread_id = data.get("id")
+            if not title:
+                return jsonify({"ok": False, "error": "Title is required"}), 400
+            if not sanitized_posts:
+                return jsonify({"ok": False, "error": "At least one post is required"}), 400
+
+            now = datetime.utcnow()
 
             thread = {
                 "user_id": ObjectId(current_user.id),
+                "author_username": user_doc.get("username", "Anonymous"),
                 "title": title,
                 "status": status,
                 "posts": sanitized_posts,
@@ -356,22 +682,35 @@ def create_app(testing=False):
                 except Exception:
                     return jsonify({"ok": False, "error": "Invalid thread id"}), 400
                 
-                result = app.db.forums.update_one(
-                    {"_id": thread_oid, "user_id": ObjectId(current_user.id)},
-                    {"$set": thread}
-                )
-                if result.matched_count == 0:
+                # the feed task is committed with the thread and run once it is
+                def update_thread(session):
+                    result = app.db.forums.update_one(
+                        {"_id": thread_oid, "user_id": ObjectId(current_user.id)},
+                        {"$set": thread},
+                        session=session,
+                    )
+                    if not result.matched_count:
+                        return None
+                    return tasks.create("feed.sync", {"thread_id": thread_oid}, session=session)
+
+                feed_task = write_together(app.db, update_thread)
+                if feed_task is None:
                     return jsonify({"ok": False, "error": "Thread not found"}), 404
+                tasks.dispatch(feed_task)
+                thread_html_cache.pop(str(thread_oid))
+                data_cache.invalidate(thread_key(thread_oid))   # the listings follow with the feed task
                 
                 return jsonify({"ok": True, "id": str(thread_oid)})
             
             thread["created_at"] = now
-            thread = app.db.forums.insert_one(thread)
-            app.db.users.update_one(
-                {"_id": ObjectId(current_user.id)},
-                {"$push": {"threads": thread.inserted_id}}
-            )
-            return jsonify({"ok": True, "id": str(thread.inserted_id)})
+
+            def insert_thread(session):
+                result = app.db.forums.insert_one(thread, session=session)
+                return tasks.create("feed.sync", {"thread_id": result.inserted_id}, session=session)
+
+            feed_task = write_together(app.db, insert_thread)
+            tasks.dispatch(feed_task)
+            return jsonify({"ok": True, "id": str(feed_task["payload"]["thread_id"])})
                 
         else:
             try:
@@ -384,68 +723,39 @@ def create_app(testing=False):
                 if characters is None:
                     characters = []
 
-                # --- DEBUGGING LINES ---
-                print(f"DEBUG: Current User ID: {current_user.id}", flush=True)
-                print(f"DEBUG: Raw Characters found in DB: {len(characters)}", flush=True)
-                print(f"DEBUG: First character data: {characters[0] if characters else 'None'}", flush=True)
+                logger.debug("createforum GET for user %s: %d characters, first: %s",
+                             current_user.id, len(characters), characters[0] if characters else None)
 
                 try:
                     characters_json_string = json.dumps(characters, cls=MongoJSONEncoder)
                 except Exception as e:
-                    print(f"ERROR: Failed to encode characters to JSON: {e}", flush=True)
+                    logger.error("Failed to encode characters to JSON: %s", e)
                     characters_json_string = "[]"
                 
-                app.logger.info(f"Generated JSON string length: {len(characters_json_string)}")
+                logger.debug("Generated JSON string length: %d", len(characters_json_string))
 
                 return render_template("createforum.html", characters=characters, characters_json=characters_json_string)
             except Exception as e:
-                print(f"ERROR in createforum GET: {e}", flush=True)
+                logger.exception("Error in createforum GET")
                 flash("An error occurred loading the page.")
                 return redirect(url_for("index"))
     
     @app.route("/api/my_forums")
     @login_required
     def my_forums():
-        status = request.args.get("status")
-        q = request.args.get("q")
-        
+        return jsonify(my_forums_payload(request.args.get("status"), request.args.get("q")))
+
+    def my_forums_payload(status=None, q=None):
         query = {"user_id": ObjectId(current_user.id)}
 
         if status in ["draft", "published"]:
             query["status"] = status
 
         if q:
-            regex = {"$regex": q, "$options": "i"}
-            query["$or"] = [
-                {"title": regex},
-                {"characters.name": regex},
-                {"characters.nickname": regex},
-                {"characters.fandom": regex},
-            ]
+            query["$or"] = search_clause(q)
 
         cursor = app.db.forums.find(query).sort("updated_at", -1)
-        forums = []
-        for doc in cursor:
-            # Get user info for consistency
-            user_id = doc.get("user_id")
-            author_username = "Anonymous"
-            
-            if user_id:
-                user = app.db.users.find_one({"_id": user_id})
-                if user:
-                    author_username = user.get("username", "Anonymous")
-
-            forums.append({
-                "id": str(doc.get("_id")),
-                "title": doc.get("title", ""),
-                "status": doc.get("status", "draft"),
-                "post_count": len(doc.get("posts", [])),
-                "characters": doc.get("characters", []),
-                "author_username": author_username,  # Add this field
-                "updated_at": doc.get("updated_at").isoformat() if doc.get("updated_at") else None,
-                "created_at": doc.get("created_at").isoformat() if doc.get("created_at") else None,
-            })
-        return jsonify({"ok": True, "forums": forums})
+        return {"ok": True, "forums": [my_forum_summary(doc) for doc in cursor]}
     
     @app.route("/api/my_forums/<thread_id>", methods=["GET", "DELETE"])
     @login_required
@@ -456,16 +766,21 @@ def create_app(testing=False):
             return jsonify({"ok": False, "error": "Invalid thread id"}), 400
 
         if request.method == "DELETE":
-            result = app.db.forums.delete_one({
-                "_id": thread_oid,
-                "user_id": ObjectId(current_user.id)
-            })
-            if result.deleted_count == 0:
+            def delete_thread(session):
+                result = app.db.forums.delete_one(
+                    {"_id": thread_oid, "user_id": ObjectId(current_user.id)},
+                    session=session,
+                )
+                if not result.deleted_count:
+                    return None
+                return tasks.create("feed.sync", {"thread_id": thread_oid}, session=session)
+
+            feed_task = write_together(app.db, delete_thread)
+            if feed_task is None:
                 return jsonify({"ok": False, "error": "Thread not found"}), 404
-            app.db.users.update_one(
-                {"_id": ObjectId(current_user.id)},
-                {"$pull": {"threads": thread_oid}}
-            )
+            tasks.dispatch(feed_task)
+            thread_html_cache.pop(str(thread_oid))
+            data_cache.invalidate(thread_key(thread_oid))
             return jsonify({"ok": True})
 
         thread = app.db.forums.find_one({"_id": thread_oid, "user_id": ObjectId(current_user.id)})
@@ -493,73 +808,157 @@ def create_app(testing=False):
     
     @app.route("/api/published_forums")
     def api_published_forums():
-        q = request.args.get("q")
+        return cache_public(jsonify(published_forums_payload(request.args.get("q"))), PUBLISHED_FORUMS_KEY)
 
+    def published_forums_payload(q=None):
         query = {"status": "published"}
 
         if q:
-            regex = {"$regex": q, "$options": "i"}
-            query["$or"] = [
-                {"title": regex},
-                {"characters.name": regex},
-                {"characters.nickname": regex},
-                {"characters.fandom": regex},
-            ]
-
-        cursor = app.db.forums.find(query).sort("published_at", -1)
-
-        forums = []
-        for t in cursor:
-            # Get user info from the user_id
-            user_id = t.get("user_id")
-            author_username = "Anonymous"
-            
-            if user_id:
-                user = app.db.users.find_one({"_id": user_id})
-                if user:
-                    author_username = user.get("username", "Anonymous")
-
-            forums.append({
-                "id": str(t["_id"]),
-                "title": t.get("title", "Untitled"),
-                "post_count": len(t.get("posts", [])),
-                "characters": t.get("characters", []),
-                "author_username": author_username,  # Add this field
-                "created_at": t.get("created_at").isoformat() if t.get("created_at") else None,
-                "published_at": t.get("published_at").isoformat() if t.get("published_at") else None,
-            })
+            query["$or"] = search_clause(q)
+
+        def load():
+            cursor = app.db.forums.find(query).sort("published_at", -1)
+            return {"ok": True, "forums": [published_forum_summary(t) for t in cursor]}
 
-        return jsonify({"ok": True, "forums": forums})
+        if q:
+            return load()   # searches are too varied to be worth caching
+        return data_cache.get_or_load("published-forums", load,
+                                      app.config["CACHE_FEED_TTL_SECONDS"], [PUBLISHED_FORUMS_KEY])
     
     @app.route("/community")
     def community():
-        return render_template("community.html")
+        return render_template("community.html", initial_data=published_forums_payload())
     
     @app.route("/api/community")
     def api_community():
-        cursor = app.db.forums.find({"status": "published"}).sort("published_at", -1)
-        forums = []
-        for doc in cursor:
-            # Get user info
-            user_id = doc.get("user_id")
-            author_username = "Anonymous"
-            
-            if user_id:
-                user = app.db.users.find_one({"_id": user_id})
-                if user:
-                    author_username = user.get("username", "Anonymous")
-                    
-            forums.append({
-                "id": str(doc.get("_id")),
-                "title": doc.get("title", ""),
-                "status": doc.get("status", "draft"),
-                "characters": doc.get("characters", []),
-                "author_username": author_username,  # Add this field
-                "updated_at": doc.get("updated_at").isoformat() if doc.get("updated_at") else None,
-                "created_at": doc.get("created_at").isoformat() if doc.get("created_at") else None,
-            })
-        return jsonify({"ok": True, "forums": forums})
+        # trending reads the ranks precomputed by TrendingRanker, nothing is scored here
+        sort = request.args.get("sort", "recent")
+        if sort not in FEED_SORT_KEYS:
+            return jsonify({"ok": False, "error": "sort must be one of: recent, trending"}), 400
+        return cache_public(jsonify({"ok": True, "forums": community_feed(sort)}), COMMUNITY_KEY)
+
+    def community_feed(sort):
+        def load_feed():
+            cursor = app.db.feed_items.find({}, FEED_CARD_FIELDS).sort(FEED_SORT_KEYS[sort], -1)
+            forums = []
+            for doc in cursor:
+                forums.append({
+                    "id": str(doc.get("_id")),
+                    "title": doc.get("title", ""),
+                    "status": "published",
+                    "post_count": doc.get("post_count", 0),
+                    "characters": doc.get("characters", []),
+                    "author_username": doc.get("author_username", "Anonymous"),
+                    "updated_at": doc.get("updated_at").isoformat() if doc.get("updated_at") else None,
+                    "created_at": doc.get("created_at").isoformat() if doc.get("created_at") else None,
+                })
+            return forums
+
+        return data_cache.get_or_load(f"community:{sort}", load_feed,
+                                      app.config["CACHE_FEED_TTL_SECONDS"], [COMMUNITY_KEY])
+
+    @cache_warmer.add
+    def warm_feed(deadline):
+        # the /community page and both first feed pages; only data-cache entries, so only with L2
+        if data_cache.l2 is None:
+            return 0
+        published_forums_payload()
+        for sort in FEED_SORT_KEYS:
+            community_feed(sort)
+        return 1 + len(FEED_SORT_KEYS)
+
+    @cache_warmer.add
+    def warm_top_threads(deadline):
+        # rendered posts (kept until the thread changes) of the most visited threads, trending
+        # first, and their thread data when L2 will hold it
+        top = (app.db.feed_items.find({}, {"_id": 1}).sort("trending_score", -1)
+               .limit(app.config["CACHE_WARMUP_THREADS"]))
+        warmed = 0
+        with app.app_context():
+            for card in top:
+                if time.monotonic() >= deadline:
+                    break
+                thread = app.db.forums.find_one({"_id": card["_id"]})
+                if thread is None or thread.get("status") != "published":
+                    continue
+                if data_cache.l2 is not None:
+                    cached_thread(thread["_id"], lambda: thread)
+                render_thread_page(thread)
+                warmed += 1
+        return warmed
     
+    @app.route("/api/community/stream")
+    def api_community_stream():
+        subscription = live_feed.subscribe()
+        if subscription is None:
+            response = jsonify({"ok": False, "error": "Too many live feed connections, please retry"})
+            response.status_code = 503
+            response.headers["Retry-After"] = "30"
+            return response
+        return Response(
+            live_feed.stream(subscription, app.config["LIVE_FEED_HEARTBEAT_SECONDS"]),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.route("/admin/slow_queries")
+    @admin_required
+    def admin_slow_queries():
+        limit = request.args.get("limit", 100, type=int)
+        return jsonify({"ok": True, "entries": recent_slow_queries(app.db, limit)})
+
+    @app.cli.command("slow-queries")
+    @click.option("--limit", default=50, help="Number of entries to print, newest first.")
+    def slow_queries_command(limit):
+        """Print the slow-query log as JSON lines."""
+        for entry in recent_slow_queries(app.db, limit):
+            click.echo(json.dumps(entry, cls=MongoJSONEncoder))
+
+    @app.cli.command("backfill-authors")
+    def backfill_authors_command():
+        """Stamp author_username onto threads written before it was denormalized."""
+        click.echo(f"Updated {backfill_author_usernames(app.db)} threads.")
+
+    @app.cli.command("rebuild-feed")
+    def rebuild_feed_command():
+        """Repopulate the feed_items collection from published threads."""
+        click.echo(f"Feed rebuilt with {rebuild_feed(app.db)} items.")
+
+    @app.cli.command("drop-user-threads")
+    def drop_user_threads_command():
+        """Remove the old users.threads id arrays; threads are found by forums.user_id."""
+        click.echo(f"Cleared threads from {drop_user_threads(app.db)} users.")
+
+    @app.cli.command("compact-posts")
+    def compact_posts_command():
+        """Make posts reference their thread's character snapshots instead of copying them."""
+        changed, before, after = compact_thread_posts(app.db)
+        saved = 100 * (before - after) / before if before else 0
+        click.echo(f"Compacted {changed} threads: posts went from {before} to {after} bytes ({saved:.0f}% saved).")
+
+    @app.cli.command("run-tasks")
+    def run_tasks_command():
+        """Run every pending background task now, on this process."""
+        tasks.recover()
+        click.echo(f"Ran {tasks.run_pending()} tasks.")
+
+    @app.cli.command("rank-feed")
+    def rank_feed_command():
+        """Recompute the trending scores of the community feed once."""
+        count = rank_feed(app.db, half_life_hours=app.config["TRENDING_HALF_LIFE_HOURS"])
+        click.echo(f"Ranked {count} feed items.")
+
+    if not testing and not _running_cli_command():
+        # background work starts last (recovered tasks need their handlers registered, the
+        # warm-up its steps), and even if Mongo did not answer at boot: each part retries
+        view_counter.start(app.db)
+        tasks.start()
+        if app.config["TRENDING_INTERVAL_SECONDS"] > 0:
+            TrendingRanker(app.config["TRENDING_INTERVAL_SECONDS"],
+                           app.config["TRENDING_HALF_LIFE_HOURS"]).start(app.db)
+        if app.config["CACHE_WARMUP_SECONDS"] > 0:
+            cache_warmer.start()    # the worker serves requests meanwhile
+
     return app
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+# Threads carry a copy of their author's username (forums.author_username), as do
+# their feed cards (feed_items, keyed by the thread's _id), so listings never have
+# to look the author up. When a username changes, the copies are rewritten here in
+# batches.
+FANOUT_BATCH_SIZE = 500
+
+
+def fan_out_author_username(db, user_id, username, batch_size=FANOUT_BATCH_SIZE):
+    """Rewrite author_username on every thread owned by user_id, and on their feed cards.
+
+    Works in batches of batch_size ids with update_many so a prolific author
+    never holds a long-running write. Stops early if the username changes
+    again mid-way; the newer rename runs its own fan-out.
+    Returns the number of threads updated.
+    """
+    updated = 0
+    while True:
+        user = db.users.find_one({"_id": user_id}, {"username": 1})
+        if not user or user.get("username") != username:
+            break
+
+        cursor = db.forums.find(
+            {"user_id": user_id, "author_username": {"$ne": username}},
+            {"_id": 1},
+        ).limit(batch_size)
+        ids = [doc["_id"] for doc in cursor]
+        if not ids:
+            break
+
+        # cards first: a fan-out cut short here leaves the threads to select next time
+        db.feed_items.update_many({"_id": {"$in": ids}}, {"$set": {"author_username": username}})
+        result = db.forums.update_many(
+            {"_id": {"$in": ids}, "user_id": user_id},
+            {"$set": {"author_username": username}},
+        )
+        updated += result.modified_count
+        if len(ids) < batch_size:
+            break
+    return updated
+
+
+def backfill_author_usernames(db):
+    """One-off migration: stamp author_username onto threads created before it existed."""
+    updated = 0
+    owners = db.forums.distinct("user_id", {"author_username": {"$exists": False}})
+    for user_id in owners:
+        user = db.users.find_one({"_id": user_id}, {"username": 1})
+        username = user.get("username", "Anonymous") if user else "Anonymous"
+        result = db.forums.update_many(
+            {"user_id": user_id, "author_username": {"$exists": False}},
+            {"$set": {"author_username": username}},
+        )
+        updated += result.modified_count
+    return updated
@@ -0,0 +1,53 @@
+"""Compare two benchmark result files route by route.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Exits non-zero when any route's p95 regressed by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(baseline, candidate, threshold):
+    rows, regressed = [], []
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            rows.append((name, None, new["p95_ms"], None))
+            continue
+        change = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        rows.append((name, old["p95_ms"], new["p95_ms"], change))
+        if change > threshold:
+            regressed.append(name)
+    return rows, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed p95 regression in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+    if baseline.get("dataset") != candidate.get("dataset"):
+        print("warning: the two runs used different datasets", file=sys.stderr)
+
+    rows, regressed = compare(baseline, candidate, args.threshold)
+    print(f"{'route':32s} {'old p95':>10s} {'new p95':>10s} {'change':>8s}")
+    for name, old, new, change in rows:
+        old_s = f"{old:.2f}" if old is not None else "-"
+        change_s = f"{change:+.1f}%" if change is not None else "new"
+        print(f"{name:32s} {old_s:>10s} {new:10.2f} {change_s:>8s}")
+    if regressed:
+        print(f"p95 regressed by more than {args.threshold}%: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
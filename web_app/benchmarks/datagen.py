@@ -0,0 +1,107 @@
+"""Deterministic synthetic data for the endpoint benchmarks.
+
+The same seed and sizes always produce the same users, characters and
+threads (ids included), so results from different commits are comparable.
+"""
+import random
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from feed import feed_card
+from snapshots import character_snapshot, compact_post
+
+BASE_TIME = datetime(2025, 1, 1)
+FANDOMS = ["Harry Potter", "Sherlock Holmes", "Star Wars", "Pride and Prejudice",
+           "The Lord of the Rings", "Original character"]
+WORDS = ("the quick brown fox jumps over lazy dog tea castle dragon letter storm "
+         "window promise river secret lantern garden midnight").split()
+
+
+@dataclass
+class DatasetSpec:
+    users: int = 50
+    characters_per_user: int = 4
+    threads: int = 500
+    posts_per_thread: int = 20
+    published_ratio: float = 0.7
+    seed: int = 1234
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _oid(rng):
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def generate(spec):
+    """Return {"users": [...], "forums": [...], "feed_items": [...]} documents."""
+    rng = random.Random(spec.seed)
+    users = []
+    for u in range(spec.users):
+        characters = []
+        for c in range(spec.characters_per_user):
+            fandom = rng.choice(FANDOMS)
+            characters.append({
+                "_id": _oid(rng),
+                "name": f"Character {u}-{c}",
+                "nickname": f"nick{u}_{c}",
+                "fandom": fandom,
+                "pic": "/static/images/default.png",
+            })
+        users.append({
+            "_id": _oid(rng),
+            "username": f"user{u}",
+            "email": f"user{u}@bench.example",
+            "password": "bench",
+            "characters": characters,
+        })
+
+    forums, feed_items = [], []
+    for t in range(spec.threads):
+        author = users[rng.randrange(len(users))]
+        created = BASE_TIME + timedelta(minutes=t * 7)
+        published = rng.random() < spec.published_ratio
+        posts, snapshot = [], {}
+        for floor in range(1, spec.posts_per_thread + 1):
+            index = rng.randrange(len(author["characters"]))
+            char = author["characters"][index]
+            snapshot.setdefault(str(char["_id"]), character_snapshot(char))
+            posts.append(compact_post({
+                "characterIndex": index,
+                "nickname": char["nickname"],
+                "avatar": char["pic"],
+                "content": _sentence(rng, rng.randint(8, 60)),
+                "floor": floor,
+            }, snapshot[str(char["_id"])]))
+        thread = {
+            "_id": _oid(rng),
+            "user_id": author["_id"],
+            "author_username": author["username"],
+            "title": f"{_sentence(rng, 4)[:-1]} #{t}",
+            "status": "published" if published else "draft",
+            "posts": posts,
+            "characters": list(snapshot.values()),
+            "created_at": created,
+            "updated_at": created + timedelta(minutes=rng.randint(0, 600)),
+            "published_at": created + timedelta(minutes=5) if published else None,
+        }
+        forums.append(thread)
+        if published:
+            feed_items.append({"_id": thread["_id"], **feed_card(thread)})
+
+    return {"users": users, "forums": forums, "feed_items": feed_items}
+
+
+def load(db, data):
+    """Replace the benchmark collections in db with data."""
+    for name, docs in data.items():
+        db[name].delete_many({})
+        if docs:
+            db[name].insert_many(docs)
@@ -0,0 +1,172 @@
+"""Endpoint benchmarks through the Flask test client.
+
+    cd web_app
+    python -m benchmarks.run --engine memory --threads 500 --output bench.json
+    python -m benchmarks.run --engine mongo --mongo-uri mongodb://localhost:27017
+
+--engine mongo loads the data into a throwaway database on a real mongod
+(with the app's indexes). --engine memory uses mongomock (a test
+dependency in requirements.txt), which says nothing about index use, but it
+does sort and filter correctly. Results are written as JSON; compare two runs
+with `python -m benchmarks.compare old.json new.json`.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from benchmarks.datagen import DatasetSpec, generate, load  # noqa: E402
+
+
+def open_db(engine, mongo_uri, db_name):
+    if engine == "mongo":
+        from pymongo import MongoClient
+        return MongoClient(mongo_uri)[db_name]
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("--engine memory needs mongomock: pip install mongomock")
+    return mongomock.MongoClient()[db_name]
+
+
+def routes(data):
+    """(name, method, url, body, login) for each benchmarked request."""
+    published = next(t for t in data["forums"] if t["status"] == "published")
+    owner = data["users"][0]
+    own = next((t for t in data["forums"] if t["user_id"] == owner["_id"]), published)
+    new_thread = {
+        "title": "Benchmark thread",
+        "status": "draft",
+        "posts": [{"characterIndex": 0, "content": "benchmark post"}],
+    }
+    return [
+        ("api_community", "GET", "/api/community", None, False),
+        ("api_published_forums", "GET", "/api/published_forums", None, False),
+        ("api_published_forums_search", "GET", "/api/published_forums?q=dragon", None, False),
+        ("get_thread", "GET", f"/api/thread/{published['_id']}", None, False),
+        ("viewthread", "GET", f"/viewthread/{published['_id']}", None, False),
+        ("my_forums", "GET", "/api/my_forums", None, True),
+        ("my_forums_search", "GET", "/api/my_forums?q=storm", None, True),
+        ("api_my_forum", "GET", f"/api/my_forums/{own['_id']}", None, True),
+        ("api_my_characters", "GET", "/api/my_characters", None, True),
+        ("createforum", "POST", "/createforum", new_thread, True),
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def measure(client, method, url, body, iterations, warmup):
+    kwargs = {"json": body} if body is not None else {}
+    for _ in range(warmup):
+        client.open(url, method=method, **kwargs)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        resp = client.open(url, method=method, **kwargs)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if resp.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "iterations": iterations,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "throughput_rps": round(iterations / elapsed, 1) if elapsed else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(spec, engine="memory", mongo_uri="mongodb://localhost:27017", db_name="forum_bench",
+        iterations=200, warmup=20, only=None):
+    data = generate(spec)
+    db = open_db(engine, mongo_uri, db_name)
+    load(db, data)
+    app_module.ensure_indexes(db, 36500)
+
+    app = app_module.create_app(testing=True)
+    app.db = db
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(data["users"][0]["_id"])
+        sess["_fresh"] = True
+
+    results = {}
+    for name, method, url, body, login in routes(data):
+        if only and name not in only:
+            continue
+        results[name] = measure(client, method, url, body, iterations, warmup)
+        results[name]["authenticated"] = login
+
+    if engine == "mongo":
+        db.client.drop_database(db_name)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "engine": engine,
+        "python": platform.python_version(),
+        "dataset": spec.to_dict(),
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engine", choices=("memory", "mongo"), default="memory")
+    parser.add_argument("--mongo-uri", default=os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="forum_bench")
+    parser.add_argument("--users", type=int, default=DatasetSpec.users)
+    parser.add_argument("--characters-per-user", type=int, default=DatasetSpec.characters_per_user)
+    parser.add_argument("--threads", type=int, default=DatasetSpec.threads)
+    parser.add_argument("--posts-per-thread", type=int, default=DatasetSpec.posts_per_thread)
+    parser.add_argument("--published-ratio", type=float, default=DatasetSpec.published_ratio)
+    parser.add_argument("--seed", type=int, default=DatasetSpec.seed)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--route", action="append", help="only run these routes (repeatable)")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    args = parser.parse_args(argv)
+
+    spec = DatasetSpec(args.users, args.characters_per_user, args.threads,
+                       args.posts_per_thread, args.published_ratio, args.seed)
+    report = run(spec, args.engine, args.mongo_uri, args.db_name,
+                 args.iterations, args.warmup, args.route)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+    for name, r in report["results"].items():
+        print(f"{name:32s} p50 {r['p50_ms']:8.2f}ms  p95 {r['p95_ms']:8.2f}ms  "
+              f"p99 {r['p99_ms']:8.2f}ms  {r['throughput_rps']:8.1f} req/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+
+from metrics import record_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A bounded, thread-safe least-recently-used cache.
+
+    Entries set with a ttl (seconds) are dropped once it has passed.
+    Lookups are counted in the cache_requests_total metric under name.
+    """
+
+    def __init__(self, maxsize=256, name="lru"):
+        self.maxsize = maxsize
+        self.name = name
+        self._data = OrderedDict()  # key -> (value, monotonic expiry or None)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires = self._data.get(key, (_MISSING, None))
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                value = _MISSING
+            if value is not _MISSING:
+                self._data.move_to_end(key)
+        record_cache_lookup(self.name, value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, (None, None))[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class _Flight:
+    __slots__ = ("done", "value", "ok")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.ok = False
+
+
+class TieredCache:
+    """Read-through cache: this process's LRUCache (L1) over an optional shared
+    Redis-protocol server (L2, a resp.RespClient) that every worker sees.
+
+    get_or_load(key, load, ttl, tags) returns the cached value, or calls load()
+    and caches what it returns (None is never cached); tags may also be a
+    function of the loaded value. Concurrent misses on a
+    key in one process wait for a single load; across processes, the worker
+    that wins an L2 lock (SET NX) loads while the others poll L2 for up to
+    lock_ttl seconds before loading themselves.
+
+    invalidate(*tags) drops every entry set with one of the tags from this
+    process's L1 and from L2. Other processes' L1 copies are not reachable,
+    so L1 keeps entries at most l1_ttl seconds: that bounds how stale another
+    worker can be. Values go to L2 BSON-encoded, so dicts, lists, str,
+    numbers, datetimes and ObjectIds round-trip. L2 errors are logged and
+    treated as misses, and L2 is skipped for retry_after seconds.
+    """
+
+    def __init__(self, l1, l2=None, l1_ttl=5.0, lock_ttl=2.0, retry_after=5.0, prefix="cache:"):
+        self.l1 = l1
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+        self.lock_ttl = lock_ttl
+        self.retry_after = retry_after
+        self.prefix = prefix
+        self._tags = {}         # tag -> keys set with it in L1
+        self._inflight = {}     # key -> _Flight
+        self._generation = 0    # bumped by invalidate(), so a load that raced one is not cached
+        self._lock = threading.Lock()
+        self._l2_down_until = 0.0
+
+    def get_or_load(self, key, load, ttl, tags=()):
+        value = self.l1.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+        if not leader:
+            if flight.done.wait(self.lock_ttl) and flight.ok:
+                return flight.value
+            return load()   # the leader failed or is stuck; do not pile onto it
+        try:
+            flight.value = self._load(key, load, ttl, tags)
+            flight.ok = True
+            return flight.value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def invalidate(self, *tags):
+        if not tags:
+            return
+        with self._lock:
+            self._generation += 1
+            keys = set().union(*(self._tags.pop(tag, ()) for tag in tags))
+        for key in keys:
+            self.l1.pop(key)
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        members = self._l2([("SMEMBERS", tag_key) for tag_key in tag_keys])
+        if members is not None:
+            stale = [m for reply in members for m in reply or ()]
+            self._l2([("DEL", *stale, *tag_keys)])
+
+    def _load(self, key, load, ttl, tags):
+        generation = self._generation
+        value = self._l2_get(key)
+        if value is _MISSING:
+            value = self._load_once(key, load, ttl, tags, generation)
+        if value is not None and generation == self._generation:
+            self._l1_set(key, value, ttl, tags(value) if callable(tags) else tags)
+        return value
+
+    def _load_once(self, key, load, ttl, tags, generation):
+        lock_key = self.prefix + "lock:" + key
+        replies = self._l2([("SET", lock_key, "1", "NX", "PX", int(self.lock_ttl * 1000))])
+        locked = replies is not None and replies[0] is not None
+        if replies is not None and not locked:
+            # another worker is loading it: wait for its result rather than query too
+            deadline = time.monotonic() + self.lock_ttl
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                value = self._l2_get(key)
+                if value is not _MISSING:
+                    return value
+        value = load()
+        if value is not None and generation == self._generation:
+            full_key = self.prefix + key
+            commands = [("SET", full_key, bson.encode({"v": value}), "PX", int(ttl * 1000))]
+            for tag in tags(value) if callable(tags) else tags:
+                tag_key = self.prefix + "tag:" + tag
+                commands += [("SADD", tag_key, full_key), ("PEXPIRE", tag_key, int(ttl * 1000))]
+            self._l2(commands + ([("DEL", lock_key)] if locked else []))
+        elif locked:
+            self._l2([("DEL", lock_key)])
+        return value
+
+    def _l1_set(self, key, value, ttl, tags):
+        self.l1.set(key, value, min(ttl, self.l1_ttl))
+        with self._lock:
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+    def _l2_get(self, key):
+        replies = self._l2([("GET", self.prefix + key)])
+        hit = bool(replies) and replies[0] is not None
+        if self.l2 is not None:
+            record_cache_lookup(f"{self.l1.name}_l2", hit)
+        return bson.decode(replies[0])["v"] if hit else _MISSING
+
+    def _l2(self, commands):
+        """Run commands on L2 in one round trip; None without L2 or when it fails."""
+        if self.l2 is None or time.monotonic() < self._l2_down_until:
+            return None
+        try:
+            return self.l2.pipeline(commands)
+        except Exception as exc:
+            logger.warning("Shared cache unavailable, using L1 only for %.0fs: %r", self.retry_after, exc)
+            self._l2_down_until = time.monotonic() + self.retry_after
+            return None
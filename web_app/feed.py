@@ -0,0 +1,167 @@
+import atexit
+import logging
+import math
+import threading
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# feed_items is a materialized copy of the community feed: one small card per
+# published thread, keyed by the thread's _id. createforum and the delete route
+# keep it in sync; api_community reads only from here. trending_score is
+# written by the TrendingRanker below, never at request time.
+FEED_CARD_FIELDS = (
+    "title",
+    "author_username",
+    "post_count",
+    "characters",
+    "created_at",
+    "updated_at",
+    "published_at",
+)
+
+
+def feed_card(thread):
+    """Build the card fields for a thread document (without _id)."""
+    return {
+        "title": thread.get("title", ""),
+        "author_username": thread.get("author_username", "Anonymous"),
+        "post_count": len(thread.get("posts", [])),
+        "characters": thread.get("characters", []),
+        "created_at": thread.get("created_at"),
+        "updated_at": thread.get("updated_at"),
+        "published_at": thread.get("published_at"),
+    }
+
+
+def sync_feed_item(db, thread_id, thread):
+    """Upsert the card for a published thread, or drop it if the thread is not published.
+
+    Returns True if the feed changed: a card was written or dropped.
+    """
+    if thread.get("status") != "published":
+        return remove_feed_item(db, thread_id)
+
+    card = feed_card(thread)
+    # edits don't carry created_at, so only set it the first time the card is written
+    created_at = card.pop("created_at") or thread.get("published_at")
+    # new cards start with the score of a fresh thread until the next ranking pass
+    db.feed_items.update_one(
+        {"_id": thread_id},
+        {"$set": card, "$setOnInsert": {
+            "created_at": created_at,
+            "trending_score": trending_score(card["post_count"], 0, 0),
+        }},
+        upsert=True,
+    )
+    return True
+
+
+def remove_feed_item(db, thread_id):
+    """Drop the thread's card; True if it had one."""
+    return db.feed_items.delete_one({"_id": thread_id}).deleted_count > 0
+
+
+def ensure_feed_indexes(db, horizon_days):
+    """TTL index on published_at: serves the feed sort and trims cards past the horizon.
+
+    trending_score gets its own index for /api/community?sort=trending.
+    """
+    db.feed_items.create_index([("trending_score", -1)])
+    expire = int(horizon_days * 86400)
+    try:
+        db.feed_items.create_index("published_at", expireAfterSeconds=expire)
+    except OperationFailure:
+        # index exists with an older horizon; update it in place
+        db.command(
+            "collMod",
+            "feed_items",
+            index={"keyPattern": {"published_at": 1}, "expireAfterSeconds": expire},
+        )
+
+
+def rebuild_feed(db):
+    """Repopulate feed_items from every published thread. Returns the card count."""
+    db.feed_items.delete_many({})
+    count = 0
+    for thread in db.forums.find({"status": "published"}):
+        sync_feed_item(db, thread["_id"], thread)
+        count += 1
+    return count
+
+
+TRENDING_HALF_LIFE_HOURS = 24.0
+RANK_BATCH_SIZE = 1000
+
+
+def trending_score(post_count, views, age_hours, half_life_hours=TRENDING_HALF_LIFE_HOURS):
+    """Engagement (log-damped posts and views) halved every half_life_hours of age."""
+    engagement = 1 + 2 * math.log1p(post_count) + math.log1p(views)
+    return engagement * 0.5 ** (max(age_hours, 0) / half_life_hours)
+
+
+def rank_feed(db, now=None, half_life_hours=TRENDING_HALF_LIFE_HOURS, batch_size=RANK_BATCH_SIZE):
+    """Recompute trending_score for every feed card. Returns the number of cards scored.
+
+    Views live on the thread (see viewcounts), so they are fetched per batch
+    of cards with one $in query and written back as one unordered bulk_write.
+    """
+    now = now or datetime.utcnow()
+    cursor = db.feed_items.find({}, {"post_count": 1, "published_at": 1})
+    scored = 0
+    batch = []
+    for card in cursor:
+        batch.append(card)
+        if len(batch) >= batch_size:
+            scored += _rank_batch(db, batch, now, half_life_hours)
+            batch = []
+    if batch:
+        scored += _rank_batch(db, batch, now, half_life_hours)
+    return scored
+
+
+def _rank_batch(db, cards, now, half_life_hours):
+    ids = [card["_id"] for card in cards]
+    views = {doc["_id"]: doc.get("views", 0) for doc in db.forums.find({"_id": {"$in": ids}}, {"views": 1})}
+    updates = []
+    for card in cards:
+        published_at = card.get("published_at") or now
+        age_hours = (now - published_at).total_seconds() / 3600
+        score = trending_score(card.get("post_count", 0), views.get(card["_id"], 0), age_hours, half_life_hours)
+        updates.append(UpdateOne({"_id": card["_id"]}, {"$set": {"trending_score": score}}))
+    db.feed_items.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+class TrendingRanker:
+    """Runs rank_feed every interval seconds on a background thread."""
+
+    def __init__(self, interval=300.0, half_life_hours=TRENDING_HALF_LIFE_HOURS):
+        self.interval = interval
+        self.half_life_hours = half_life_hours
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, db):
+        self._thread = threading.Thread(target=self._run, args=(db,), name="trending-ranker", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, db):
+        while True:
+            try:
+                rank_feed(db, half_life_hours=self.half_life_hours)
+            except Exception:
+                logger.exception("Trending ranking pass failed")
+            if self._stop.wait(self.interval):
+                break
+
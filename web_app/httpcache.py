@@ -0,0 +1,62 @@
+import logging
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+# Surrogate keys: every cacheable public response is tagged with the keys of
+# what it shows, and a change purges the keys it affects from the proxy. The
+# in-app data cache (cache.TieredCache) uses the same keys as its tags.
+COMMUNITY_KEY = "community"
+PUBLISHED_FORUMS_KEY = "published-forums"
+
+
+def thread_key(thread_id):
+    return f"thread-{thread_id}"
+
+
+def author_key(user_id):
+    """Tags data-cache entries that copy something of the author's (name, characters)."""
+    return f"author-{user_id}"
+
+
+def thread_surrogate_keys(thread_id):
+    """Everything that can show the thread: its own API response and the two listings."""
+    return [thread_key(thread_id), COMMUNITY_KEY, PUBLISHED_FORUMS_KEY]
+
+
+def cache_publicly(response, keys, max_age, stale_while_revalidate):
+    """Let shared caches keep response for max_age seconds, tagged with keys.
+
+    Past max_age a proxy may serve the stale copy for stale_while_revalidate
+    more seconds while it refetches in the background. max_age 0 leaves the
+    response uncached.
+    """
+    if max_age <= 0:
+        return response
+    response.headers["Cache-Control"] = (
+        f"public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}")
+    response.headers["Surrogate-Key"] = " ".join(keys)
+    return response
+
+
+class SurrogatePurger:
+    """Purges surrogate keys from Varnish-compatible proxies.
+
+    Sends `PURGE /` with the keys space-separated in a Surrogate-Key header
+    to every URL in urls, the convention of Varnish's xkey vmod and of
+    Fastly. Raises if a proxy cannot be reached or refuses, so the caller's
+    task is retried. With no urls it does nothing.
+    """
+
+    def __init__(self, urls, timeout=2.0):
+        self.urls = list(urls)
+        self.timeout = timeout
+
+    def purge(self, keys):
+        """Purge keys everywhere; returns the number of proxies purged."""
+        for url in self.urls:
+            request = urllib.request.Request(url, method="PURGE", headers={"Surrogate-Key": " ".join(keys)})
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass    # urlopen raises HTTPError on a 4xx/5xx answer
+            logger.debug("Purged %s from %s", keys, url)
+        return len(self.urls)
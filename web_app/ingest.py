@@ -0,0 +1,145 @@
+import codecs
+import json
+
+# JSON request bodies are read in pieces of this many bytes
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\n\r"
+# what may follow a number's prefix and still belong to it ("1" of "1.5e-3")
+_NUMBER_CHARS = "0123456789.eE+-"
+_decoder = json.JSONDecoder()
+
+
+class PayloadError(Exception):
+    """The request body is not acceptable; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _Reader:
+    """A window over a request body stream, decoded as UTF-8 and refilled on demand."""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.bytes_read = 0
+        self.eof = False
+
+    def fill(self):
+        """Append the next chunk, dropping what was already parsed; False at the end of the body."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(CHUNK_SIZE)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.max_bytes:
+            raise PayloadError(f"Request body is larger than {self.max_bytes} bytes", 413)
+        try:
+            text = self.decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError:
+            raise PayloadError("Request body is not valid UTF-8")
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        self.eof = not chunk
+        return True
+
+    def peek(self):
+        """The next character that is not whitespace, or "" at the end of the body."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char, error):
+        if self.peek() != char:
+            raise PayloadError(error)
+        self.pos += 1
+
+    def value(self, max_chars):
+        """Decode one complete JSON value of at most max_chars characters."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as exc:
+                if not self._truncated(exc):
+                    raise PayloadError(f"Invalid JSON: {exc.msg}")
+                value, end = None, None
+            if end is not None and (self.eof or isinstance(value, (str, list, dict)) or self._delimited(end)):
+                break
+            # incomplete, or a number that may go on in the next chunk
+            if len(self.buffer) - self.pos > max_chars:
+                raise PayloadError(f"A JSON value is longer than {max_chars} characters", 413)
+            if not self.fill():
+                raise PayloadError("Invalid JSON: the body ends in the middle of a value")
+        if end - self.pos > max_chars:
+            raise PayloadError(f"A JSON value is longer than {max_chars} characters", 413)
+        self.pos = end
+        return value
+
+    def _delimited(self, end):
+        # a scalar is whole once something that cannot continue it is buffered after it
+        return self.buffer[end:].strip(_NUMBER_CHARS) != ""
+
+    def _truncated(self, exc):
+        # the decoder ran out of input rather than hit a bad character: more data may complete it
+        if self.eof:
+            return False
+        return exc.msg.startswith("Unterminated string") or exc.pos >= len(self.buffer) - len("false")
+
+
+def read_json_object(stream, array_key, on_item, max_bytes, max_items, max_item_chars):
+    """Parse a JSON object from stream, handing the elements of its array_key array to on_item.
+
+    Only one array element (or other top-level value) is decoded at a time,
+    so memory stays around max_item_chars no matter how long the array is.
+    on_item(index, value) can raise PayloadError to stop reading at the
+    first bad element. Bodies over max_bytes, arrays over max_items and
+    values over max_item_chars raise PayloadError with status 413, invalid
+    JSON with status 400, as soon as they are seen.
+    Returns (the other top-level fields, the number of array elements).
+    """
+    reader = _Reader(stream, max_bytes)
+    fields, count = {}, 0
+    reader.expect("{", "Expected a JSON object")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value(max_item_chars)
+            if not isinstance(key, str):
+                raise PayloadError("Invalid JSON: object keys must be strings")
+            reader.expect(":", "Invalid JSON: expected ':'")
+            if key == array_key:
+                reader.expect("[", f"{array_key} must be a list")
+                if reader.peek() == "]":
+                    reader.pos += 1
+                else:
+                    while True:
+                        if count >= max_items:
+                            raise PayloadError(f"At most {max_items} {array_key} are allowed", 413)
+                        on_item(count, reader.value(max_item_chars))
+                        count += 1
+                        separator = reader.peek()
+                        reader.pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise PayloadError("Invalid JSON: expected ',' or ']'")
+            else:
+                fields[key] = reader.value(max_item_chars)
+            separator = reader.peek()
+            reader.pos += 1
+            if separator == "}":
+                break
+            if separator != ",":
+                raise PayloadError("Invalid JSON: expected ',' or '}'")
+    if reader.peek() != "":
+        raise PayloadError("Invalid JSON: extra data after the object")
+    return fields, count
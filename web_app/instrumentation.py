@@ -0,0 +1,159 @@
+import time
+from contextlib import contextmanager
+
+import pymongo
+from flask import g, has_request_context, jsonify, request, request_finished
+from pymongo import monitoring
+from pymongo.errors import ExecutionTimeout, NetworkTimeout
+
+
+# only these requests get a deadline: the others upload a body and write, and a
+# slow upload must not leave the write too little time to be sent at all
+READ_METHODS = ("GET", "HEAD")
+
+
+class DbStats:
+    """Mongo commands issued while serving one request."""
+
+    __slots__ = ("count", "duration_ms", "failed", "commands", "budget_ms")
+
+    def __init__(self, budget_ms=None):
+        self.count = 0
+        self.duration_ms = 0.0
+        self.failed = 0
+        self.commands = {}
+        self.budget_ms = budget_ms
+
+    def add(self, command_name, duration_ms, failed=False):
+        self.count += 1
+        self.duration_ms += duration_ms
+        if failed:
+            self.failed += 1
+        self.commands[command_name] = self.commands.get(command_name, 0) + 1
+
+
+def current_db_stats():
+    """Stats for the request being served, or None outside a request."""
+    if not has_request_context():
+        return None
+    return g.get("_db_stats")
+
+
+class RequestCommandListener(monitoring.CommandListener):
+    """Attributes every Mongo command to the Flask request that issued it.
+
+    pymongo publishes started/succeeded/failed on the thread running the
+    command, so the request context (and g) is still available here. Commands
+    from background threads or startup have no request and are ignored.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed):
+        stats = current_db_stats()
+        if stats is not None:
+            stats.add(event.command_name, event.duration_micros / 1000.0, failed)
+
+
+def parse_time_budgets(spec):
+    """"api_published_forums=1000,my_forums=500" -> {"api_published_forums": 1000.0, ...}."""
+    budgets = {}
+    for item in (spec or "").split(","):
+        name, _, budget = item.partition("=")
+        if name.strip() and budget.strip():
+            budgets[name.strip()] = float(budget)
+    return budgets
+
+
+def init_instrumentation(app):
+    """Wire per-request DB accounting into app and return the listener for MongoClient.
+
+    Each read request (GET, HEAD) also runs under a pymongo.timeout() deadline
+    of its endpoint's budget (QUERY_TIMEOUTS, else QUERY_TIMEOUT_MS), so every
+    command it issues carries maxTimeMS for the time left. A budget of 0 means
+    no deadline; writes never get one.
+    """
+    listener = RequestCommandListener()
+    app.extensions["db_listener"] = listener
+
+    @app.before_request
+    def start_db_stats():
+        budget_ms = 0
+        if request.method in READ_METHODS:
+            budget_ms = app.config["QUERY_TIMEOUTS"].get(request.endpoint, app.config["QUERY_TIMEOUT_MS"])
+        g._db_stats = DbStats(budget_ms or None)
+        g._request_started = time.perf_counter()
+        if budget_ms:
+            g._db_deadline = pymongo.timeout(budget_ms / 1000)
+            g._db_deadline.__enter__()
+
+    @app.teardown_request
+    def end_db_deadline(exc):
+        deadline = g.pop("_db_deadline", None)
+        if deadline is not None:
+            deadline.__exit__(None, None, None)
+
+    @app.errorhandler(ExecutionTimeout)
+    @app.errorhandler(NetworkTimeout)
+    def db_timeout(exc):
+        stats = current_db_stats()
+        app.logger.warning(
+            "Mongo time budget of %sms exhausted on %s %s: %s",
+            stats.budget_ms if stats else None, request.method, request.path, exc,
+        )
+        response = jsonify({"ok": False, "error": "The database took too long to answer, please retry"})
+        response.status_code = 504
+        return response
+
+    @app.after_request
+    def report_db_stats(response):
+        stats = current_db_stats()
+        if stats is None:
+            return response
+        total_ms = (time.perf_counter() - g._request_started) * 1000
+        response.headers["Server-Timing"] = (
+            f'db;dur={stats.duration_ms:.1f};desc="{stats.count} queries", '
+            f"app;dur={total_ms:.1f}"
+        )
+        if stats.budget_ms:
+            response.headers["Server-Timing"] += f", db-budget;dur={stats.budget_ms:.0f}"
+
+        if (stats.count > app.config["QUERY_BUDGET_COUNT"]
+                or stats.duration_ms > app.config["QUERY_BUDGET_MS"]):
+            app.logger.warning(
+                "DB budget exceeded on %s %s (%s): %d queries, %.1fms db time (deadline %sms), commands=%s",
+                request.method, request.path, response.status_code,
+                stats.count, stats.duration_ms, stats.budget_ms, stats.commands,
+            )
+        return response
+
+    return listener
+
+
+@contextmanager
+def count_queries(app):
+    """Collect the DbStats of every request app finishes inside the block.
+
+    Works with anything that reports to the app's command listener, i.e. a
+    real MongoClient created by create_app or a test double that publishes
+    the same events.
+    """
+    collected = []
+
+    def record(sender, response, **extra):
+        stats = current_db_stats()
+        if stats is not None:
+            collected.append(stats)
+
+    request_finished.connect(record, app)
+    try:
+        yield collected
+    finally:
+        request_finished.disconnect(record, app)
@@ -0,0 +1,250 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from transactions import supports_transactions
+
+logger = logging.getLogger(__name__)
+
+# what an event carries besides its type and id: enough to draw a community row
+EVENT_FIELDS = {"title": 1, "status": 1, "author_username": 1, "published_at": 1, "updated_at": 1,
+                "created_at": 1}
+# the poller re-reads this far back, so a write committed a little after a later
+# one (or stamped by a worker with a slower clock) is still seen
+POLL_OVERLAP = timedelta(seconds=5)
+POLL_BATCH_SIZE = 500
+# how long a hard delete stays visible to polling workers
+REMOVAL_TTL_SECONDS = 3600
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def thread_event(kind, thread_id, doc=None):
+    """A compact "published", "updated" or "removed" event for one thread."""
+    event = {"type": kind, "id": str(thread_id)}
+    if doc is not None and kind != "removed":
+        event.update({
+            "title": doc.get("title", ""),
+            "author_username": doc.get("author_username", "Anonymous"),
+            "published_at": _isoformat(doc.get("published_at")),
+            "updated_at": _isoformat(doc.get("updated_at")),
+        })
+    return event
+
+
+def change_event(change):
+    """Map a change stream document on forums or feed_removals to an event, or None when
+    nobody needs to hear. Removals come only from tombstones, which feed.sync leaves when
+    it drops a card, so a draft deleted or saved again never shows up as removed."""
+    if change["ns"]["coll"] == "feed_removals":
+        doc = change.get("fullDocument")
+        return thread_event("removed", doc["thread_id"]) if change["operationType"] == "insert" and doc else None
+    doc = change.get("fullDocument")
+    if doc is None or doc.get("status") != "published":
+        return None     # a delete, a draft, or deleted before the lookup; tombstones cover removals
+    thread_id = change["documentKey"]["_id"]
+    if change["operationType"] == "update":
+        if "status" not in change.get("updateDescription", {}).get("updatedFields", {}):
+            return thread_event("updated", thread_id, doc)
+    return thread_event("published", thread_id, doc)
+
+
+def poll_event(doc):
+    """Map a published thread found by the poller; removals come from the tombstones."""
+    first_save = doc.get("created_at") is not None and doc.get("created_at") == doc.get("updated_at")
+    return thread_event("published" if first_save else "updated", doc["_id"], doc)
+
+
+def sse_message(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+def record_removal(db, thread_id):
+    """Leave a tombstone for a thread whose feed card was dropped (deleted or unpublished); both
+    live feed sources report removals from these alone."""
+    db.feed_removals.insert_one({"thread_id": thread_id, "at": datetime.utcnow()})
+
+
+def ensure_live_feed_indexes(db):
+    # the poller's only reads: threads saved since the last poll, and recent tombstones
+    db.forums.create_index("updated_at")
+    db.feed_removals.create_index("at", expireAfterSeconds=REMOVAL_TTL_SECONDS)
+
+
+class Subscription:
+    """One client's bounded event queue. A client that falls queue_size events
+    behind is closed rather than allowed to hold up the others; it reconnects
+    and reloads the list."""
+
+    def __init__(self, queue_size):
+        self._events = queue.Queue(queue_size)
+        self.closed = False
+
+    def put(self, event):
+        try:
+            self._events.put_nowait(event)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+    def get(self, timeout):
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LiveFeed:
+    """Fans thread published/updated/removed events out to this worker's SSE clients.
+
+    One source feeds every subscriber of the process, so N open streams cost
+    what one does. On a replica set or mongos the source is a change stream on
+    forums and feed_removals, resumed from its last token after an error. A
+    standalone server has no change streams, so instead one thread polls forums
+    on the indexed updated_at (and feed_removals for removals) every
+    poll_interval seconds, skipping the queries while nobody listens. Either
+    way a removal is reported only from a tombstone. The source starts with the
+    first subscriber, or never when autostart is off; poll_once() runs a
+    polling pass on the calling thread.
+    """
+
+    def __init__(self, get_db, poll_interval=2.0, queue_size=100, max_subscribers=8, autostart=True):
+        self.get_db = get_db
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.autostart = autostart
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._since = datetime.utcnow()
+        self._seen = {}     # (collection, id) -> timestamp, for re-read overlap
+
+    # -- subscribers
+
+    def subscribe(self):
+        """A new Subscription, or None when the worker already serves max_subscribers."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscribers.add(subscription)
+            start = self.autostart and self._thread is None
+            if start:
+                self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+        if start:
+            self._thread.start()
+            atexit.register(self.stop)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.put(event):
+                logger.info("Live feed client fell %d events behind, closing it", self.queue_size)
+                self.unsubscribe(subscription)
+
+    def stream(self, subscription, heartbeat=15.0):
+        """SSE text for one subscription, with a comment line every heartbeat seconds
+        so proxies keep the connection open; unsubscribes when the client goes away."""
+        try:
+            yield "retry: 5000\n\n"
+            while not subscription.closed and not self._stop.is_set():
+                event = subscription.get(heartbeat)
+                yield ": keep-alive\n\n" if event is None else sse_message(event)
+        finally:
+            self.unsubscribe(subscription)
+
+    # -- sources
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        db = self.get_db()
+        if supports_transactions(db.client):    # change streams need the same replica set or mongos
+            self._watch(db)
+        else:
+            self._poll()
+
+    def _watch(self, db):
+        pipeline = [
+            # view counts and author fan-outs do not touch updated_at; only saves do. Removals
+            # are the tombstone inserts, not forums deletes (a deleted draft was never listed)
+            {"$match": {"$or": [
+                {"ns.coll": "forums", "$or": [
+                    {"operationType": {"$in": ["insert", "replace"]}},
+                    {"updateDescription.updatedFields.updated_at": {"$exists": True}},
+                ]},
+                {"ns.coll": "feed_removals", "operationType": "insert"},
+            ]}},
+            {"$project": {"operationType": 1, "ns": 1, "documentKey": 1, "updateDescription.updatedFields.status": 1,
+                          "fullDocument.thread_id": 1, **{f"fullDocument.{field}": 1 for field in EVENT_FIELDS}}},
+        ]
+        resume_token = None
+        while not self._stop.is_set():
+            try:
+                with db.watch(pipeline, full_document="updateLookup",
+                                     resume_after=resume_token, max_await_time_ms=1000) as stream:
+                    while stream.alive and not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            event = change_event(change)
+                            if event is not None:
+                                self.publish(event)
+                        resume_token = stream.resume_token
+            except Exception:
+                logger.exception("Live feed change stream failed, reopening")
+                self._stop.wait(self.poll_interval)
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                listening = bool(self._subscribers)
+            if not listening:
+                self._since = datetime.utcnow()
+                continue
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception("Live feed poll failed")
+
+    def poll_once(self):
+        """Publish what changed since the last poll; returns the number of events."""
+        db = self.get_db()
+        since = self._since - POLL_OVERLAP
+        cursor = (db.forums.find({"updated_at": {"$gt": since}}, EVENT_FIELDS)
+                  .sort("updated_at", 1).limit(POLL_BATCH_SIZE))
+        # a thread leaving the feed is reported from its tombstone, below, like on the change stream
+        events = [poll_event(doc) for doc in cursor
+                  if self._fresh("forums", doc["_id"], doc["updated_at"]) and doc.get("status") == "published"]
+        cursor = db.feed_removals.find({"at": {"$gt": since}}).sort("at", 1).limit(POLL_BATCH_SIZE)
+        events += [thread_event("removed", doc["thread_id"]) for doc in cursor
+                   if self._fresh("feed_removals", doc["_id"], doc["at"])]
+        self._seen = {key: stamp for key, stamp in self._seen.items() if stamp > since}
+        for event in events:
+            self.publish(event)
+        return len(events)
+
+    def _fresh(self, collection, doc_id, stamp):
+        key = (collection, doc_id)
+        if self._seen.get(key) == stamp:
+            return False
+        self._seen[key] = stamp
+        self._since = max(self._since, stamp)
+        return True
@@ -0,0 +1,115 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+# attributes every LogRecord has; anything else was passed via extra= and is logged as a field
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request and any extra= fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request they were logged from (runs on the request thread)."""
+
+    def filter(self, record):
+        if has_request_context() and not hasattr(record, "path"):
+            record.method = request.method
+            record.path = request.path
+            record.endpoint = request.endpoint
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Let through only a fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class _PreformattedQueueHandler(QueueHandler):
+    # QueueHandler.prepare() formats the message on the request thread; keep the
+    # record's fields intact instead so JsonFormatter can read them on the listener thread
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+
+def parse_levels(spec):
+    """"app=INFO,slowlog=WARNING" -> {"app": "INFO", "slowlog": "WARNING"}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(level="INFO", module_levels=None, debug_sample_rate=1.0,
+                      stream=None, root=None):
+    """Route all logging through a queue to a JSON-lines handler on a background thread.
+
+    Request threads only enqueue records; formatting and writing to the
+    (possibly slow) stream happens in the QueueListener's thread. Returns the
+    listener, which is stopped (and drained) at exit.
+    """
+    root = root or logging.getLogger()
+    log_queue = queue.SimpleQueue()
+
+    sink = logging.StreamHandler(stream or sys.stdout)
+    sink.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, sink, respect_handler_level=True)
+
+    handler = _PreformattedQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    listener.start()
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener):
+    """Drain and stop a listener; safe to call more than once."""
+    if listener._thread is not None:
+        listener.stop()
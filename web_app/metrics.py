@@ -0,0 +1,351 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+# A small Prometheus-compatible metrics registry.
+#
+# Each process keeps its own counters in memory. When METRICS_DIR is set
+# (gunicorn with several workers) every process also dumps a snapshot to
+# METRICS_DIR/metrics_<pid>.json, and /metrics merges all snapshots so any
+# worker answering the scrape reports totals for the whole server.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.directory = None
+        self._last_flush = 0.0
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self._lock:
+            return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    def flush(self):
+        """Write this process's snapshot into the shared directory."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"metrics_{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp, path)
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self, interval=1.0):
+        if self.directory and time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def collect(self):
+        """Snapshot for this process, merged with every other worker's when shared."""
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.json")):
+            pid = _pid_from_path(path)
+            try:
+                with open(path) as fh:
+                    snapshot = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for name, data in snapshot.items():
+                # gauges describe live state; a dead worker's values no longer apply
+                if data["kind"] == "gauge" and not _pid_alive(pid):
+                    continue
+                _merge(merged, name, data)
+        return merged
+
+    def render(self):
+        return render_text(self.collect())
+
+
+def _pid_from_path(path):
+    try:
+        return int(os.path.basename(path)[len("metrics_"):-len(".json")])
+    except ValueError:
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _merge(merged, name, data):
+    target = merged.setdefault(name, {**data, "values": []})
+    index = {tuple(labels): i for i, (labels, _) in enumerate(target["values"])}
+    for labels, value in data["values"]:
+        i = index.get(tuple(labels))
+        if i is None:
+            index[tuple(labels)] = len(target["values"])
+            target["values"].append([labels, value])
+        elif data["kind"] == "histogram":
+            old = target["values"][i][1]
+            target["values"][i][1] = {
+                "buckets": [a + b for a, b in zip(old["buckets"], value["buckets"])],
+                "sum": old["sum"] + value["sum"],
+                "count": old["count"] + value["count"],
+            }
+        else:
+            target["values"][i][1] += value
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry = registry or REGISTRY
+        self._lock = registry._lock
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _export(self, value):
+        return value
+
+    def snapshot(self):
+        return {
+            "kind": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "values": [[list(k), self._export(v)] for k, v in self._values.items()],
+        }
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels))
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, amount, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += amount
+            state["count"] += 1
+
+    def _export(self, state):
+        return {"buckets": list(state["buckets"]), "sum": state["sum"], "count": state["count"]}
+
+    def snapshot(self):
+        data = super().snapshot()
+        data["bounds"] = list(self.buckets)
+        return data
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _num(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def render_text(snapshot):
+    """Render a snapshot in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for name in sorted(snapshot):
+        data = snapshot[name]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['kind']}")
+        names = data["labelnames"]
+        for labels, value in sorted(data["values"], key=lambda item: item[0]):
+            if data["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, labels)} {_num(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(data["bounds"], value["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, labels, [('le', _num(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(names, labels, [('le', '+Inf')])} {value['count']}")
+            lines.append(f"{name}_sum{_labels(names, labels)} {_num(value['sum'])}")
+            lines.append(f"{name}_count{_labels(names, labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by endpoint.", ["endpoint", "method"])
+REQUESTS = Counter(
+    "http_requests_total", "Requests served by endpoint and status.", ["endpoint", "method", "status"])
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size by endpoint.", ["endpoint"], buckets=SIZE_BUCKETS)
+MONGO_COMMANDS = Counter(
+    "mongo_commands_total", "Mongo commands issued, by command and outcome.", ["command", "outcome"])
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency.", ["command"], buckets=DB_BUCKETS)
+POOL_CHECKOUTS = Counter(
+    "mongo_pool_checkouts_total", "Connection pool checkouts, by outcome.", ["outcome"])
+POOL_CHECKED_OUT = Gauge(
+    "mongo_pool_checked_out", "Connections currently checked out of the pool.")
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache name and result (hit/miss).", ["cache", "result"])
+TASK_QUEUE_DEPTH = Gauge(
+    "task_queue_depth", "Background tasks queued in this process.")
+TASKS_PROCESSED = Counter(
+    "tasks_processed_total", "Background task runs by task and outcome (ok/retry/failed).", ["task", "outcome"])
+TASK_LATENCY = Histogram(
+    "task_latency_seconds", "Time from enqueueing a background task to its completion.", ["task"])
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests shed with a 503 by the admission limiter.", ["endpoint"])
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_units_in_use", "Admission weight units held by running requests.")
+
+
+def record_cache_lookup(cache, hit):
+    """Count a cache lookup; the hit ratio is hit / (hit + miss) per cache."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class MetricsCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMANDS.inc(command=event.command_name, outcome="ok")
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMANDS.inc(command=event.command_name, outcome="error")
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name)
+
+
+class MetricsPoolListener(monitoring.ConnectionPoolListener):
+    def connection_checked_out(self, event):
+        POOL_CHECKOUTS.inc(outcome="ok")
+        POOL_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        POOL_CHECKED_OUT.dec()
+
+    def connection_check_out_failed(self, event):
+        POOL_CHECKOUTS.inc(outcome="failed")
+
+    # the remaining pool events are not tracked
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def init_metrics(app):
+    """Record request metrics for app, serve /metrics, and return the pymongo listeners."""
+    REGISTRY.directory = app.config.get("METRICS_DIR") or None
+    if REGISTRY.directory:
+        atexit.register(REGISTRY.flush)
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get("_metrics_started")
+        if started is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        if not response.is_streamed:
+            RESPONSE_SIZE.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+        REGISTRY.maybe_flush()
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+    return [MetricsCommandListener(), MetricsPoolListener()]
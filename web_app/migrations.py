@@ -0,0 +1,44 @@
+# One-off data migrations, run through the flask CLI commands in app.py.
+import bson
+from pymongo import UpdateOne
+
+from snapshots import compact_posts
+
+
+def drop_user_threads(db):
+    """$unset users.threads, the thread-id array createforum used to $push onto.
+
+    A user's threads are found with forums.find({"user_id": ...}) on the
+    (user_id, updated_at) index instead. Returns the number of users changed.
+    """
+    result = db.users.update_many({"threads": {"$exists": True}}, {"$unset": {"threads": ""}})
+    return result.modified_count
+
+
+def compact_thread_posts(db, batch_size=200):
+    """Rewrite posts to reference the thread's character snapshots (see snapshots.py).
+
+    Threads are read with only posts and characters, and written back in
+    unordered bulk_writes of batch_size; a thread saved in between (its
+    updated_at moved) is left for the next run. Returns (threads changed,
+    BSON bytes of their posts before, after), the storage the migration saved.
+    """
+    changed = before = after = 0
+    updates = []
+    cursor = db.forums.find({"posts.character_name": {"$exists": True}},
+                            {"posts": 1, "characters": 1, "updated_at": 1})
+    for thread in cursor:
+        posts = compact_posts(thread.get("posts", []), thread.get("characters"))
+        if posts == thread.get("posts"):
+            continue
+        changed += 1
+        before += len(bson.encode({"posts": thread["posts"]}))
+        after += len(bson.encode({"posts": posts}))
+        updates.append(UpdateOne({"_id": thread["_id"], "updated_at": thread.get("updated_at")},
+                                 {"$set": {"posts": posts}}))
+        if len(updates) >= batch_size:
+            db.forums.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        db.forums.bulk_write(updates, ordered=False)
+    return changed, before, after
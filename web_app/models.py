@@ -1,10 +1,65 @@
-from flask_login import UserMixin
+from bson import ObjectId
+from flask import current_app
+
+_UNLOADED = object()
+
+
+class User:
+    """The logged-in user as Flask-Login sees it: id, username and email only.
+
+    load_user builds one of these on every authenticated request, so it is
+    fetched with USER_FIELDS and kept in __slots__ (no per-instance __dict__).
+    characters and threads are read from Mongo the first time they are used.
+    Implements the UserMixin interface without inheriting from it, since
+    UserMixin has no __slots__ and would bring the __dict__ back.
+    """
+
+    __slots__ = ("id", "username", "email", "_characters", "_threads")
+
+    # projection for documents that only need to become a User
+    USER_FIELDS = {"username": 1, "email": 1}
 
-class User(UserMixin):
     def __init__(self, doc):
         self.id = str(doc.get("_id"))
         self.username = doc.get("username", "")
         self.email = doc.get("email", "")
-        self.password = doc.get("password", "")
-        self.characters = doc.get("characters", []) 
-        self.threads = doc.get("threads", [])
\ No newline at end of file
+        self._characters = doc.get("characters", _UNLOADED)
+        self._threads = _UNLOADED
+
+    @property
+    def characters(self):
+        if self._characters is _UNLOADED:
+            doc = current_app.db.users.find_one({"_id": ObjectId(self.id)}, {"characters": 1})
+            self._characters = (doc or {}).get("characters") or []
+        return self._characters
+
+    @property
+    def threads(self):
+        """Ids of the user's threads, most recently updated first."""
+        if self._threads is _UNLOADED:
+            cursor = current_app.db.forums.find({"user_id": ObjectId(self.id)}, {"_id": 1}).sort("updated_at", -1)
+            self._threads = [doc["_id"] for doc in cursor]
+        return self._threads
+
+    # Flask-Login's UserMixin interface
+    __hash__ = object.__hash__
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
@@ -0,0 +1,115 @@
+import cProfile
+import itertools
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from flask import g, request, session
+
+from admin import is_admin
+from instrumentation import current_db_stats
+
+try:  # optional: a sampling profiler with much lower overhead than cProfile
+    from pyinstrument import Profiler as SamplingProfiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    SamplingProfiler = None
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ARG = "__profile"
+
+
+class _CProfileSession:
+    extension = "pstats"
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, path):
+        self._profile.disable()
+        self._profile.dump_stats(path)
+
+
+class _SamplingSession:
+    extension = "speedscope.json"
+
+    def __init__(self):
+        self._profiler = SamplingProfiler()
+        self._profiler.start()
+
+    def stop(self, path):
+        self._profiler.stop()
+        with open(path, "w") as fh:
+            fh.write(self._profiler.output(renderer=SpeedscopeRenderer()))
+
+
+def _profile_requested():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    return flag not in (None, "", "0") and is_admin()
+
+
+def init_profiling(app):
+    """Profile single requests on demand (admins) or 1 in PROFILE_SAMPLE_EVERY automatically.
+
+    Profiles land in PROFILE_DIR as <timestamp>_<endpoint>_<user>.pstats (or
+    .speedscope.json with the sampling profiler), next to a .json file with
+    the route, user, status, timings and Mongo command counts.
+    """
+    sample_counter = itertools.count(1)
+
+    @app.before_request
+    def start_profile():
+        directory = app.config.get("PROFILE_DIR")
+        if not directory:
+            return
+        every = app.config.get("PROFILE_SAMPLE_EVERY") or 0
+        sampled = every > 0 and next(sample_counter) % every == 0
+        requested = _profile_requested()
+        if not (sampled or requested):
+            return
+
+        use_sampling = app.config.get("PROFILE_MODE") == "sampling" and SamplingProfiler is not None
+        g._profile_requested = requested
+        g._profile_started = time.perf_counter()
+        g._profile = _SamplingSession() if use_sampling else _CProfileSession()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return response
+        duration_ms = (time.perf_counter() - g._profile_started) * 1000
+
+        endpoint = request.endpoint or "unmatched"
+        user = session.get("_user_id") or "anonymous"
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{stamp}_{endpoint}_{user}")
+        directory = app.config["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.{profile.extension}")
+        profile.stop(path)
+
+        stats = current_db_stats()
+        tags = {
+            "endpoint": endpoint,
+            "method": request.method,
+            "path": request.path,
+            "user": user,
+            "status": response.status_code,
+            "duration_ms": round(duration_ms, 2),
+            "db_queries": stats.count if stats else None,
+            "db_ms": round(stats.duration_ms, 2) if stats else None,
+            "db_commands": stats.commands if stats else None,
+            "db_budget_ms": stats.budget_ms if stats else None,
+            "trigger": "request" if g.pop("_profile_requested", False) else "sample",
+            "profile": os.path.basename(path),
+        }
+        with open(os.path.join(directory, f"{name}.json"), "w") as fh:
+            json.dump(tags, fh, indent=2)
+
+        if tags["trigger"] == "request":
+            response.headers["X-Profile-File"] = os.path.basename(path)
+        return response
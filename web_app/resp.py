@@ -0,0 +1,124 @@
+import socket
+import threading
+from urllib.parse import unquote, urlparse
+
+
+class RespError(Exception):
+    """An error reply (-ERR ...) from the server."""
+
+
+class RespClient:
+    """A small client for servers speaking the Redis protocol (RESP2).
+
+    Enough for the shared cache: commands are sent as arrays of bulk strings
+    and replies decoded into bytes, ints, lists or None. Connections are
+    pooled (up to max_connections kept idle) and dropped after any socket
+    error, so the next command reconnects. url is redis://[:password@]host[:port][/db].
+    """
+
+    def __init__(self, url, timeout=0.5, max_connections=8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """Send commands in one write and read their replies in order, in one round trip.
+
+        Raises the first error reply after all replies are read.
+        """
+        conn = self._borrow()
+        try:
+            conn[0].sendall(b"".join(_encode(args) for args in commands))
+            replies = [_read_reply(conn[1]) for _ in commands]
+        except (OSError, ValueError):
+            _close(conn)
+            raise
+        self._give_back(conn)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            _close(conn)
+
+    def _borrow(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        conn = (sock, sock.makefile("rb"))
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            sock.sendall(b"".join(_encode(args) for args in setup))
+            for _ in setup:
+                reply = _read_reply(conn[1])
+                if isinstance(reply, RespError):
+                    _close(conn)
+                    raise reply
+        return conn
+
+    def _give_back(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append(conn)
+                return
+        _close(conn)
+
+
+def _encode(args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(f):
+    line = f.readline()
+    if not line.endswith(b"\r\n"):
+        raise ValueError("connection closed mid-reply")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest
+    if kind == b"-":
+        return RespError(rest.decode(errors="replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = f.read(size + 2)
+        if len(data) != size + 2:
+            raise ValueError("connection closed mid-reply")
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [_read_reply(f) for _ in range(size)]
+    raise ValueError(f"unexpected RESP reply {line!r}")
+
+
+def _close(conn):
+    for part in (conn[1], conn[0]):
+        try:
+            part.close()
+        except OSError:
+            pass
@@ -0,0 +1,153 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import json_util
+from flask import has_request_context, request
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+# Read commands we know how to explain, and the parts of each worth keeping.
+EXPLAINABLE = {
+    "find": ("filter", "sort", "projection", "limit", "skip", "hint", "collation"),
+    "aggregate": ("pipeline", "hint", "collation"),
+    "count": ("query", "limit", "skip", "hint", "collation"),
+    "distinct": ("key", "query", "collation"),
+}
+# explains still waiting to run; beyond this new slow ops are logged without a plan
+MAX_PENDING_EXPLAINS = 50
+
+
+def summarize_plan(explain):
+    """Reduce explain("executionStats") output to the fields worth reading."""
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    plan = plan.get("queryPlan", plan)  # slot-based engine nests the classic plan
+
+    stages, indexes = [], []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if node.get("stage"):
+            stages.append(node["stage"])
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        pending.extend(node.get("inputStages", []))
+        if "inputStage" in node:
+            pending.append(node["inputStage"])
+
+    stats = explain.get("executionStats", {})
+    if "COLLSCAN" in stages:
+        scan = "COLLSCAN"
+    elif "IXSCAN" in stages:
+        scan = "IXSCAN"
+    else:
+        scan = stages[-1] if stages else None
+    return {
+        "scan": scan,
+        "stages": stages,
+        "indexes": indexes,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "execution_ms": stats.get("executionTimeMillis"),
+    }
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    """Logs Mongo reads slower than a threshold into the capped slow_queries collection.
+
+    A sample of them is re-run with explain("executionStats") on a background
+    thread so the log shows which plan Mongo chose. The capped collection is the
+    ring buffer: old entries are overwritten, and every worker (and the CLI)
+    sees the same log.
+    """
+
+    def __init__(self, threshold_ms=100, explain_rate=1.0, run_async=True):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.db = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slowlog") if run_async else None
+
+    def bind(self, db, size=500):
+        """Attach the database and make sure the capped log collection exists."""
+        self.db = db
+        try:
+            db.create_collection("slow_queries", capped=True, size=size * 4096, max=size)
+        except CollectionInvalid:
+            pass  # already there
+
+    def started(self, event):
+        keep = EXPLAINABLE.get(event.command_name)
+        if keep is None:
+            return
+        command = {event.command_name: event.command.get(event.command_name)}
+        command.update({k: event.command[k] for k in keep if k in event.command})
+        endpoint = request.endpoint if has_request_context() else None
+        with self._lock:
+            self._inflight[(event.connection_id, event.request_id)] = (event.database_name, command, endpoint)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            inflight = self._inflight.pop((event.connection_id, event.request_id), None)
+        if inflight is None or self.db is None:
+            return
+        duration_ms = event.duration_micros / 1000.0
+        if duration_ms < self.threshold_ms:
+            return
+
+        database_name, command, endpoint = inflight
+        explain = random.random() < self.explain_rate
+        with self._lock:
+            if explain and self._pending >= MAX_PENDING_EXPLAINS:
+                explain = False
+            self._pending += 1
+        args = (database_name, command, endpoint, duration_ms, explain)
+        if self._executor is None:
+            self._record(*args)
+        else:
+            self._executor.submit(self._record, *args)
+
+    def _record(self, database_name, command, endpoint, duration_ms, explain):
+        try:
+            name = next(iter(command))
+            entry = {
+                "at": datetime.utcnow(),
+                "endpoint": endpoint,
+                "command": name,
+                "collection": command[name],
+                "duration_ms": round(duration_ms, 2),
+                # stored as extended JSON: filters contain $-operators Mongo won't accept as keys
+                "filter": json_util.dumps(command.get("filter", command.get("query", command.get("pipeline")))),
+                "sort": json_util.dumps(command.get("sort")),
+                "projection": json_util.dumps(command.get("projection")),
+                "plan": None,
+            }
+            if explain:
+                result = self.db.client[database_name].command(
+                    {"explain": command, "verbosity": "executionStats"})
+                entry["plan"] = summarize_plan(result)
+            self.db.slow_queries.insert_one(entry)
+        except PyMongoError:
+            pass  # the log is best-effort; never let it take a worker down
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+def recent_slow_queries(db, limit=100):
+    """Most recent slow-query log entries first."""
+    cursor = db.slow_queries.find({}, {"_id": 0}).sort("$natural", -1).limit(limit)
+    return list(cursor)
@@ -0,0 +1,51 @@
+# A thread keeps one snapshot per character it uses in its `characters` array
+# (`_id` is the character id as a string). Each post stores the character_id of
+# its snapshot and only the nickname or avatar it overrides, not a copy of the
+# character's name, fandom, nickname and avatar. expand_posts() puts the copies
+# back for renderers; posts written before this layout keep their own fields.
+# Snapshots are only written with the thread's posts (createforum), never when a
+# character is edited later, so a post never loses the values it was written with.
+
+DEFAULT_PIC = "/static/images/default.png"
+# fields a stored post may leave to its snapshot, and the snapshot field each comes from
+SNAPSHOT_FIELDS = {"character_name": "name", "character_fandom": "fandom", "nickname": "nickname",
+                   "avatar": "pic"}
+
+
+def character_snapshot(char):
+    return {
+        "_id": str(char.get("_id")),
+        "name": char.get("name", ""),
+        "nickname": char.get("nickname", ""),
+        "fandom": char.get("fandom", ""),
+        "pic": char.get("pic", DEFAULT_PIC),
+    }
+
+
+def compact_post(post, snapshot):
+    """post without the fields that repeat its character snapshot."""
+    compact = {k: v for k, v in post.items() if k not in SNAPSHOT_FIELDS}
+    compact["character_id"] = snapshot["_id"]
+    for field, source in SNAPSHOT_FIELDS.items():
+        if field in post and post[field] != snapshot.get(source):
+            compact[field] = post[field]
+    return compact
+
+
+def expand_posts(posts, characters):
+    """Posts with character_name, character_fandom, nickname and avatar filled in from characters."""
+    by_id = {c.get("_id"): c for c in characters or []}
+    expanded = []
+    for post in posts:
+        snapshot = by_id.get(post.get("character_id"), {})
+        full = {field: snapshot.get(source, "") for field, source in SNAPSHOT_FIELDS.items()}
+        full.update(post)
+        expanded.append(full)
+    return expanded
+
+
+def compact_posts(posts, characters):
+    """Compact every post that has a snapshot; a post whose character is missing is kept whole."""
+    by_id = {c.get("_id"): c for c in characters or []}
+    return [compact_post(p, by_id[p.get("character_id")]) if p.get("character_id") in by_id else p
+            for p in posts]
@@ -9,6 +9,29 @@ function $(id) {
     return document.getElementById(id);
 }
 
+// The first page of a listing is inlined by the server as
+// <script type="application/json" id="initial-data">, in the same shape the
+// matching API returns. It is consumed once; later loads go to the API.
+function takeInitialData() {
+    const el = $('initial-data');
+    if (!el) return null;
+    el.remove();
+    try {
+        return JSON.parse(el.textContent);
+    } catch (e) {
+        console.error('Failed to parse initial data:', e);
+        return null;
+    }
+}
+
+function fetchJSONOrInitial(url, useInitial) {
+    const initial = takeInitialData();
+    if (initial && useInitial) {
+        return Promise.resolve(initial);
+    }
+    return fetch(url).then(res => res.json());
+}
+
 function showElement(id) {
     const el = $(id);
     if (el) el.style.display = '';
@@ -755,6 +778,9 @@ function loadForumForEdit(forumId) {
             }
 
             const forum = data.thread;
+            // posts keep only what differs from the thread's own snapshot; fill them back in
+            // from it, not from the characters as they are now
+            forum.posts = expandPosts(forum.posts || [], forum.characters);
 
             document.querySelector('.auth-box-header h2').textContent = 'Edit Forum';
             document.querySelector('.auth-box-header p').textContent = 'Edit your forum dialogue';
@@ -1122,8 +1148,7 @@ function loadForums() {
     const params = new URLSearchParams();
     if (currentFilter !== 'all') params.set('status', currentFilter);
     if (currentSearchTerm) params.set('q', currentSearchTerm);
-    fetch('/api/my_forums?' + params.toString())
-        .then(res => res.json())
+    fetchJSONOrInitial('/api/my_forums?' + params.toString(), params.toString() === '')
         .then(data => {
             if (!data.ok) {
                 alert('Error loading forums: ' + (data.error || 'Unknown error'));
@@ -1282,8 +1307,7 @@ function loadPublishedForums() {
         params.set('q', searchTerm);
     }
 
-    fetch('/api/published_forums?' + params.toString())
-        .then(res => res.json())
+    fetchJSONOrInitial('/api/published_forums?' + params.toString(), params.toString() === '')
         .then(data => {
             if (!data.ok) {
                 console.error(data.error || 'Failed to load community threads');
@@ -1314,43 +1338,112 @@ function loadPublishedForums() {
         
             tbody.innerHTML = '';
             publishedForums.reverse().forEach(forum => {
-                const postCount = forum.post_count || 0;
-                const publishedDate = forum.published_at 
-                    ? new Date(forum.published_at).toLocaleDateString()
-                    : forum.created_at
-                        ? new Date(forum.created_at).toLocaleDateString()
-                        : '';
-                
-                // Get author username
-                const authorName = forum.author_username || 'Anonymous';
-                
-                // Get OP character (first character or first post character)
-                let opCharacter = 'N/A';
-                if (Array.isArray(forum.characters) && forum.characters.length > 0) {
-                    opCharacter = forum.characters[0]?.nickname || forum.characters[0]?.name || 'N/A';
-                }
-                
-                
-                
-                const row = document.createElement('tr');
-                row.className = 'thread-row';
-                row.innerHTML = `
-                    <td class="col-icon">📁</td>
-                    <td class="col-title">
-                        <a href="/viewthread/${forum.id}">${escapeHtml(forum.title)}</a>
-                    </td>
-                    <td class="col-author">${escapeHtml(authorName)}</td>
-                    <td class="col-op">${escapeHtml(opCharacter)}</td>
-                    <td class="col-replies">${postCount}</td>
-                    <td class="col-last">
-                        <div>${publishedDate}</div>
-                    </td>
-                `;
-                tbody.appendChild(row);
+                tbody.appendChild(publishedForumRow(forum));
             });
         });
 }
 
+function publishedForumRow(forum) {
+    const postCount = forum.post_count || 0;
+    const publishedDate = forum.published_at 
+        ? new Date(forum.published_at).toLocaleDateString()
+        : forum.created_at
+            ? new Date(forum.created_at).toLocaleDateString()
+            : '';
+    
+    // Get author username
+    const authorName = forum.author_username || 'Anonymous';
+    
+    // Get OP character (first character or first post character)
+    let opCharacter = 'N/A';
+    if (Array.isArray(forum.characters) && forum.characters.length > 0) {
+        opCharacter = forum.characters[0]?.nickname || forum.characters[0]?.name || 'N/A';
+    }
+
+    const row = document.createElement('tr');
+    row.className = 'thread-row';
+    row.dataset.id = forum.id;
+    row.innerHTML = `
+        <td class="col-icon">📁</td>
+        <td class="col-title">
+            <a href="/viewthread/${forum.id}">${escapeHtml(forum.title)}</a>
+        </td>
+        <td class="col-author">${escapeHtml(authorName)}</td>
+        <td class="col-op">${escapeHtml(opCharacter)}</td>
+        <td class="col-replies">${postCount}</td>
+        <td class="col-last">
+            <div>${publishedDate}</div>
+        </td>
+    `;
+    return row;
+}
+
+// Keep the community list current from /api/community/stream. Events only carry
+// a thread's title, author and dates, so an updated row keeps its OP and reply
+// cells; a stream that was cut off reloads the whole list when it reconnects.
+function subscribeToCommunityStream() {
+    if (!window.EventSource) {
+        return;
+    }
+    const stream = new EventSource('/api/community/stream');
+    let interrupted = false;
+
+    stream.addEventListener('open', () => {
+        if (interrupted) {
+            interrupted = false;
+            loadPublishedForums();
+        }
+    });
+    stream.addEventListener('error', () => {
+        interrupted = true;
+    });
+
+    const upsert = event => {
+        const forum = JSON.parse(event.data);
+        const tbody = document.getElementById('forums-table-body');
+        if (!tbody) {
+            return;
+        }
+        const existing = tbody.querySelector(`tr[data-id="${forum.id}"]`);
+        if (existing) {
+            existing.querySelector('.col-title a').textContent = forum.title;
+            existing.querySelector('.col-author').textContent = forum.author_username || 'Anonymous';
+            if (forum.published_at) {
+                existing.querySelector('.col-last div').textContent =
+                    new Date(forum.published_at).toLocaleDateString();
+            }
+            return;
+        }
+        if (!tbody.querySelector('tr.thread-row')) {
+            tbody.innerHTML = '';
+        }
+        tbody.appendChild(publishedForumRow(forum));
+        updatePublishedCount(tbody);
+    };
+    stream.addEventListener('published', upsert);
+    stream.addEventListener('updated', upsert);
+    stream.addEventListener('removed', event => {
+        const { id } = JSON.parse(event.data);
+        const row = document.querySelector(`#forums-table-body tr[data-id="${id}"]`);
+        if (row) {
+            row.remove();
+            updatePublishedCount(document.getElementById('forums-table-body'));
+        }
+    });
+}
+
+function updatePublishedCount(tbody) {
+    const count = tbody.querySelectorAll('tr.thread-row').length;
+    const publishedCountEl = document.getElementById('published-count');
+    if (publishedCountEl) {
+        publishedCountEl.textContent = count;
+    }
+    const forumCountEl = document.getElementById('forum-count');
+    if (forumCountEl) {
+        forumCountEl.textContent = `${count} forum${count !== 1 ? 's' : ''}`;
+    }
+}
+
 function initCommunity() {
     const urlParams = new URLSearchParams(window.location.search);
     const q = urlParams.get('q') || '';
@@ -1362,6 +1455,10 @@ function initCommunity() {
         headerSearchInput.value = q;
     }
     loadPublishedForums();
+    // search results are a snapshot; only the full list follows the stream
+    if (!searchTerm) {
+        subscribeToCommunityStream();
+    }
 }
 
 function initViewThread() {
@@ -1387,7 +1484,7 @@ function initViewThread() {
     document.getElementById('thread-title').textContent = forum.title;
     const replyCount = forum.posts ? forum.posts.length - 1 : 0;
     document.getElementById('thread-replies').textContent = replyCount;
-    document.getElementById('thread-views').textContent = Math.floor(Math.random() * 500) + 100;
+    document.getElementById('thread-views').textContent = forum.views || 0;
     
     const postsContainer = document.getElementById('posts-container');
     postsContainer.innerHTML = '';
@@ -1482,6 +1579,11 @@ function initViewThread() {
         breadcrumbSpan.textContent = forum.title;
     }
     */
+    // Published threads arrive rendered by the server; only drafts need the API
+    if (document.getElementById('posts-container').dataset.serverRendered === 'true') {
+        return;
+    }
+
    const threadId = getThreadIdFromPath();
     if (!threadId) {
         document.getElementById('posts-container').innerHTML =
@@ -1507,11 +1609,29 @@ function initViewThread() {
         });
 }
 
+// Posts name their character by character_id and carry only the nickname or
+// avatar they override; the rest comes from the thread's characters snapshots.
+function expandPosts(posts, characters) {
+    const byId = {};
+    (characters || []).forEach(char => { byId[char._id] = char; });
+    return posts.map(post => {
+        const char = byId[post.character_id] || {};
+        return {
+            character_name: char.name || '',
+            character_fandom: char.fandom || '',
+            nickname: char.nickname || '',
+            avatar: char.pic || '',
+            ...post,
+        };
+    });
+}
+
 function renderThread(thread) {
+    thread.posts = expandPosts(thread.posts || [], thread.characters);
     // Update title and counts
     document.getElementById('thread-title').textContent = thread.title || 'Untitled Thread';
     document.getElementById('thread-replies').textContent = thread.posts.length - 1;
-    document.getElementById('thread-views').textContent = Math.floor(Math.random() * 500) + 100;
+    document.getElementById('thread-views').textContent = thread.views || 0;
 
     // Update breadcrumbs last item
     const breadcrumbSpan = document.querySelector('.breadcrumbs span:last-child');
@@ -1710,8 +1830,7 @@ function initCreateForum() {
 }
 
 function initAddCharacter() {
-    fetch('/api/db_characters')
-        .then(res => res.json())
+    fetchJSONOrInitial('/api/db_characters', true)
         .then(data => {
             if (!data.ok) {
                 console.warn('Failed to load db characters');
@@ -0,0 +1,237 @@
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from metrics import TASK_LATENCY, TASK_QUEUE_DEPTH, TASKS_PROCESSED
+
+logger = logging.getLogger(__name__)
+
+# lower runs first
+HIGH_PRIORITY = 1
+DEFAULT_PRIORITY = 5
+LOW_PRIORITY = 9
+
+
+class TaskRunner:
+    """Post-write side effects run off the request thread, with retries.
+
+    Every task is first written to the Mongo `tasks` collection, so it
+    survives a worker restart, then queued in memory for a small thread
+    pool. Workers pick the lowest priority value whose run_at has come,
+    claim the task with find_one_and_update (so a task recovered by two
+    processes still runs once), and delete it when the handler returns.
+    A failing task is retried after backoff * 2**(attempts - 1) seconds
+    until max_attempts, then kept with status "failed".
+
+    Handlers are registered with @runner.task(name) and called with the
+    task's payload as keyword arguments. With workers=0 nothing runs in the
+    background; run_pending() executes whatever is due (tests, the CLI).
+    """
+
+    def __init__(self, get_db, workers=2, max_queue=1000, max_attempts=5, backoff=1.0,
+                 poll_interval=30.0, lease=300.0):
+        self.get_db = get_db
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._handlers = {}
+        self._ready = []      # (priority, seq, task_id)
+        self._delayed = []    # (due monotonic time, seq, priority, task_id)
+        self._queued = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def task(self, name, priority=DEFAULT_PRIORITY):
+        """Register the decorated function as the handler for tasks called name."""
+        def register(func):
+            self._handlers[name] = (func, priority)
+            return func
+        return register
+
+    # -- enqueueing
+
+    def create(self, name, payload=None, priority=None, session=None):
+        """Persist a task without queueing it; pass session to write it in a transaction.
+
+        Call dispatch() with the result once the surrounding writes committed.
+        """
+        if name not in self._handlers:
+            raise KeyError(f"no handler registered for task {name!r}")
+        now = datetime.utcnow()
+        task = {
+            "_id": ObjectId(),
+            "name": name,
+            "payload": payload or {},
+            "priority": self._handlers[name][1] if priority is None else priority,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "run_at": now,
+        }
+        self.get_db().tasks.insert_one(task, session=session)
+        return task
+
+    def dispatch(self, task, delay=0.0):
+        """Queue a persisted task in memory. A full queue leaves it to the recovery poll."""
+        with self._cond:
+            if task["_id"] in self._queued:
+                return
+            if len(self._queued) >= self.max_queue:
+                logger.warning("Task queue full (%d), %s %s waits for the next poll",
+                               self.max_queue, task["name"], task["_id"])
+                return
+            self._queued.add(task["_id"])
+            if delay > 0:
+                heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._seq),
+                                               task["priority"], task["_id"]))
+            else:
+                heapq.heappush(self._ready, (task["priority"], next(self._seq), task["_id"]))
+            TASK_QUEUE_DEPTH.set(len(self._queued))
+            self._cond.notify()
+
+    def enqueue(self, name, payload=None, priority=None):
+        task = self.create(name, payload, priority)
+        self.dispatch(task)
+        return task
+
+    # -- running
+
+    def start(self):
+        """Recover unfinished tasks, then start the worker pool and the recovery poll."""
+        try:
+            self.recover()
+        except Exception:
+            logger.exception("Task recovery failed, the poll will retry it")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"tasks-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        poller = threading.Thread(target=self._poll, name="tasks-poll", daemon=True)
+        poller.start()
+        self._threads.append(poller)
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        """Stop the workers; unfinished tasks stay in Mongo for the next start."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def recover(self):
+        """Release tasks whose claim outlived the lease and queue what is due soon."""
+        db = self.get_db()
+        stale = datetime.utcnow() - timedelta(seconds=self.lease)
+        db.tasks.update_many({"status": "running", "locked_at": {"$lt": stale}},
+                             {"$set": {"status": "pending"}})
+        horizon = datetime.utcnow() + timedelta(seconds=self.poll_interval)
+        with self._cond:
+            room = self.max_queue - len(self._queued)
+        if room <= 0:
+            return
+        cursor = db.tasks.find({"status": "pending", "run_at": {"$lte": horizon}}).sort("priority", 1).limit(room)
+        now = datetime.utcnow()
+        for task in cursor:
+            self.dispatch(task, delay=(task["run_at"] - now).total_seconds())
+
+    def run_pending(self):
+        """Run every queued task that is due on the calling thread; returns how many ran."""
+        ran = 0
+        while True:
+            task_id = self._next(block=False)
+            if task_id is None:
+                return ran
+            self._execute(task_id)
+            ran += 1
+
+    def _next(self, block=True):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, seq, priority, task_id = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, seq, task_id))
+                if self._ready:
+                    _, _, task_id = heapq.heappop(self._ready)
+                    self._queued.discard(task_id)
+                    TASK_QUEUE_DEPTH.set(len(self._queued))
+                    return task_id
+                if not block or self._stop.is_set():
+                    return None
+                self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                task_id = self._next()
+                if task_id is not None:
+                    self._execute(task_id)
+            except Exception:
+                # Mongo failed around the handler (the claim, the delete, the retry
+                # bookkeeping); the task is still in the collection for the recovery poll
+                logger.exception("Task runner could not run a task, leaving it to the recovery poll")
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.recover()
+            except Exception:
+                logger.exception("Task recovery poll failed")
+
+    def _execute(self, task_id):
+        db = self.get_db()
+        task = db.tasks.find_one_and_update(
+            {"_id": task_id, "status": "pending"},
+            {"$set": {"status": "running", "locked_at": datetime.utcnow()}, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if task is None:
+            return  # finished by another process, or its transaction never committed
+        handler = self._handlers.get(task["name"], (None,))[0]
+        try:
+            if handler is None:
+                raise KeyError(f"no handler registered for task {task['name']!r}")
+            handler(**task["payload"])
+        except Exception as exc:
+            self._failed(db, task, exc)
+            return
+        db.tasks.delete_one({"_id": task_id})
+        TASKS_PROCESSED.inc(task=task["name"], outcome="ok")
+        TASK_LATENCY.observe((datetime.utcnow() - task["created_at"]).total_seconds(), task=task["name"])
+
+    def _failed(self, db, task, exc):
+        if task["attempts"] >= self.max_attempts:
+            logger.exception("Task %s %s failed for good after %d attempts",
+                             task["name"], task["_id"], task["attempts"])
+            db.tasks.update_one({"_id": task["_id"]}, {"$set": {"status": "failed", "error": repr(exc)}})
+            TASKS_PROCESSED.inc(task=task["name"], outcome="failed")
+            return
+        delay = self.backoff * 2 ** (task["attempts"] - 1)
+        logger.warning("Task %s %s failed (attempt %d), retrying in %.1fs: %r",
+                       task["name"], task["_id"], task["attempts"], delay, exc)
+        db.tasks.update_one({"_id": task["_id"]}, {"$set": {
+            "status": "pending",
+            "run_at": datetime.utcnow() + timedelta(seconds=delay),
+            "error": repr(exc),
+        }})
+        TASKS_PROCESSED.inc(task=task["name"], outcome="retry")
+        self.dispatch(task, delay=delay)
+
+
+def ensure_task_indexes(db):
+    # the recovery poll: due pending tasks by priority, and expired claims
+    db.tasks.create_index([("status", 1), ("priority", 1), ("run_at", 1)])
@@ -1,9 +1,11 @@
 # tests/test_app.py
+import io
 import json
 import pytest
 import importlib
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 
 # Import the Flask factory and module namespace so we can monkeypatch render_template
 from app import create_app
@@ -20,20 +22,57 @@ class UpdateOneResult:
         self.matched_count = matched_count
         self.modified_count = modified_count
 
+class UpdateManyResult:
+    def __init__(self, matched_count=0, modified_count=0):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+class DeleteResult:
+    def __init__(self, deleted_count=0):
+        self.deleted_count = deleted_count
+
 class FakeCursor:
-    def __init__(self, docs):
+    def __init__(self, docs, project=None):
         self._docs = docs
+        self._project = project or (lambda doc: doc)
+
+    def sort(self, key, direction=1):
+        # missing fields sort lowest, like in Mongo; ties keep insertion order
+        present = [d for d in self._docs if d.get(key) is not None]
+        missing = [d for d in self._docs if d.get(key) is None]
+        present.sort(key=lambda d: d[key], reverse=direction < 0)
+        self._docs = present + missing if direction < 0 else missing + present
+        return self
 
-    def sort(self, *args, **kwargs):
-        # For tests we won't rely on actual sort behaviour; keep order as inserted
+    def limit(self, n):
+        if n:
+            self._docs = self._docs[:n]
         return self
 
     def __iter__(self):
-        return iter(self._docs)
+        return iter([self._project(d) for d in self._docs])
+
+def _command(name):
+    """Publish a pymongo-style command event for every call, like a real driver would."""
+    def decorate(method):
+        def wrapper(self, *args, **kwargs):
+            listener = getattr(self._db, "listener", None)
+            if listener is not None:
+                event = SimpleNamespace(command_name=name, duration_micros=0, command={name: self._name},
+                                        connection_id=("fake", 0), request_id=id(args), database_name="fake")
+                listener.started(event)
+                listener.succeeded(event)
+            if kwargs.get("session") is not None:
+                kwargs["session"].commands.append((name, self._name))
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
 
 class FakeCollection:
-    def __init__(self):
+    def __init__(self, db=None, name=""):
         self._docs = {}
+        self._db = db
+        self._name = name
 
     def _convert_for_return(self, doc):
         """
@@ -62,7 +101,68 @@ class FakeCollection:
         # convert threads list entries if they are ObjectId -> keep as ObjectId (app uses them internally)
         return d
 
-    def find_one(self, query):
+    def _field_values(self, doc, key):
+        # resolve dotted keys like "characters.name" through embedded lists
+        values = [doc]
+        for part in key.split("."):
+            nxt = []
+            for v in values:
+                if isinstance(v, list):
+                    nxt.extend(x.get(part) for x in v if isinstance(x, dict))
+                elif isinstance(v, dict):
+                    nxt.append(v.get(part))
+            values = nxt
+        return values
+
+    def _matches(self, doc, query):
+        import re
+        for k, v in query.items():
+            if k == "$or":
+                if not any(self._matches(doc, sub) for sub in v):
+                    return False
+                continue
+            values = self._field_values(doc, k)
+            actual = values[0] if values else None
+            if isinstance(v, dict) and v and all(op.startswith("$") for op in v):
+                if "$ne" in v and actual == v["$ne"]:
+                    return False
+                if "$in" in v and actual not in v["$in"]:
+                    return False
+                present = k in doc if "." not in k else any(x is not None for x in values)
+                if "$exists" in v and present != bool(v["$exists"]):
+                    return False
+                if "$lt" in v and not (actual is not None and actual < v["$lt"]):
+                    return False
+                if "$lte" in v and not (actual is not None and actual <= v["$lte"]):
+                    return False
+                if "$gt" in v and not (actual is not None and actual > v["$gt"]):
+                    return False
+                if "$regex" in v:
+                    flags = re.I if "i" in v.get("$options", "") else 0
+                    if not any(isinstance(x, str) and re.search(v["$regex"], x, flags) for x in values):
+                        return False
+            elif actual != v:
+                return False
+        return True
+
+    def _project(self, doc, projection):
+        if doc is None or not projection:
+            return doc
+        if not isinstance(projection, dict):
+            projection = {k: 1 for k in projection}
+        fields = {k: v for k, v in projection.items() if not k.endswith(".$")}
+        if not fields:
+            return doc
+        if any(v for k, v in fields.items() if k != "_id") or fields == {"_id": 1}:
+            keep = {k for k, v in fields.items() if v} | ({"_id"} if fields.get("_id", 1) else set())
+            return {k: v for k, v in doc.items() if k in keep}
+        return {k: v for k, v in doc.items() if fields.get(k, 1)}
+
+    @_command("find")
+    def find_one(self, query, projection=None):
+        return self._project(self._find_one(query), projection)
+
+    def _find_one(self, query):
         if not query:
             return None
         # _id support
@@ -83,28 +183,47 @@ class FakeCollection:
             return None
         # naive equality matching
         for d in self._docs.values():
-            match = True
-            for k, v in query.items():
-                if d.get(k) != v:
-                    match = False
-                    break
-            if match:
+            if self._matches(d, query):
                 return self._convert_for_return(d)
         return None
 
-    def insert_one(self, doc):
-        oid = ObjectId()
+    @_command("insert")
+    def insert_one(self, doc, session=None):
+        oid = doc.get("_id") or ObjectId()
         d = dict(doc)
         d["_id"] = oid
         self._docs[str(oid)] = d
         return InsertOneResult(inserted_id=oid)
 
-    def update_one(self, query, update):
+    @_command("delete")
+    def delete_one(self, query, session=None):
+        for key, d in list(self._docs.items()):
+            if self._matches(d, query):
+                del self._docs[key]
+                return DeleteResult(1)
+        return DeleteResult(0)
+
+    @_command("delete")
+    def delete_many(self, query):
+        removed = [key for key, d in self._docs.items() if self._matches(d, query)]
+        for key in removed:
+            del self._docs[key]
+        return DeleteResult(len(removed))
+
+    @_command("update")
+    def update_one(self, query, update, upsert=False, session=None):
+        if upsert and self._find_one(query) is None:
+            d = {k: v for k, v in query.items() if not k.startswith("$")}
+            d.update(update.get("$setOnInsert", {}))
+            d.update(update.get("$set", {}))
+            d.setdefault("_id", ObjectId())
+            self._docs[str(d["_id"])] = d
+            return UpdateOneResult(0, 0)
         doc = None
         if "_id" in query:
             doc = self._docs.get(str(query["_id"]))
         elif "email" in query:
-            doc = self.find_one({"email": query["email"]})
+            doc = self._find_one({"email": query["email"]})
             # find_one returns converted doc; need original in storage
             if doc:
                 doc = self._docs.get(str(doc["_id"]))
@@ -150,28 +269,90 @@ class FakeCollection:
                             removed += 1
                 doc[field] = new
             return UpdateOneResult(1, 1 if removed else 0)
+        if "$inc" in update:
+            for field, val in update["$inc"].items():
+                doc[field] = doc.get(field, 0) + val
+            return UpdateOneResult(1, 1)
         if "$set" in update:
             for field, val in update["$set"].items():
                 doc[field] = val
             return UpdateOneResult(1, 1)
         return UpdateOneResult(1, 0)
 
-    def find(self, query=None):
+    @_command("findAndModify")
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False,
+                            session=None):
+        doc = next((d for d in self._docs.values() if self._matches(d, query)), None)
+        before = dict(doc) if doc else None
+        if doc is None:
+            if not upsert:
+                return None
+            doc = {k: v for k, v in query.items() if not k.startswith("$")}
+            doc.update(update.get("$setOnInsert", {}))
+            doc.setdefault("_id", ObjectId())
+            self._docs[str(doc["_id"])] = doc
+        doc.update(update.get("$set", {}))
+        for field, val in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + val
+        return self._project(dict(doc) if return_document else before, projection)
+
+    @_command("update")
+    def bulk_write(self, requests, ordered=True):
+        # only the UpdateOne({"_id": ...}, {"$inc"/"$set": ...}) form the app sends
+        modified = 0
+        for op in requests:
+            doc = self._docs.get(str(op._filter["_id"]))
+            if doc is None or not self._matches(doc, op._filter):
+                continue
+            for field, val in op._doc.get("$inc", {}).items():
+                doc[field] = doc.get(field, 0) + val
+            doc.update(op._doc.get("$set", {}))
+            modified += 1
+        return SimpleNamespace(modified_count=modified)
+
+    @_command("update")
+    def update_many(self, query, update, array_filters=None):
+        matched = modified = 0
+        for d in self._docs.values():
+            if not self._matches(d, query):
+                continue
+            matched += 1
+            changed = False
+            for field, val in update.get("$set", {}).items():
+                if ".$[" in field:
+                    # "characters.$[c].name" with array_filters=[{"c._id": ...}]
+                    array, rest = field.split(".$[", 1)
+                    name, sub = rest.split("].", 1)
+                    cond = {k[len(name) + 1:]: v for f in array_filters for k, v in f.items()
+                            if k.startswith(name + ".")}
+                    for item in d.get(array, []):
+                        if all(item.get(k) == v for k, v in cond.items()) and item.get(sub) != val:
+                            item[sub] = val
+                            changed = True
+                elif d.get(field) != val:
+                    d[field] = val
+                    changed = True
+            for field in update.get("$unset", {}):
+                if field in d:
+                    del d[field]
+                    changed = True
+            modified += 1 if changed else 0
+        return UpdateManyResult(matched, modified)
+
+    @_command("distinct")
+    def distinct(self, key, query=None):
+        values = []
+        for d in self._docs.values():
+            if self._matches(d, query or {}) and d.get(key) not in values:
+                values.append(d.get(key))
+        return values
+
+    @_command("find")
+    def find(self, query=None, projection=None):
         query = query or {}
         docs = []
         for d in self._docs.values():
-            match = True
-            for k, v in query.items():
-                # support matching ObjectId for user_id
-                if isinstance(v, ObjectId):
-                    if d.get(k) != v:
-                        match = False
-                        break
-                else:
-                    if d.get(k) != v:
-                        match = False
-                        break
-            if match:
+            if self._matches(d, query):
                 # for find results (forums list), convert nested char _id to string as well
                 # clone doc and convert characters[*]['_id'] to str
                 clone = dict(d)
@@ -188,17 +369,67 @@ class FakeCollection:
                             new_chars.append(c)
                     clone["characters"] = new_chars
                 docs.append(clone)
-        return FakeCursor(docs)
+        # like Mongo, sort and limit see the whole document; the projection applies on the way out
+        return FakeCursor(docs, lambda doc: self._project(doc, projection))
+
+class FakeSession:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+        self.transactions = 0
+
+    def __enter__(self):
+        self.client.sessions.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def with_transaction(self, callback):
+        self.transactions += 1
+        return callback(self)
+
+
+class FakeClient:
+    def __init__(self):
+        # "Single" is a standalone server; set "ReplicaSetWithPrimary" to get transactions
+        self.topology_description = SimpleNamespace(topology_type_name="Single")
+        self.sessions = []
+
+    def start_session(self):
+        return FakeSession(self)
+
 
 class FakeDB:
     def __init__(self):
-        self.users = FakeCollection()
-        self.forums = FakeCollection()
+        # set to the app's command listener so requests can count their queries
+        self.listener = None
+        self.client = FakeClient()
+        self.users = FakeCollection(self, "users")
+        self.forums = FakeCollection(self, "forums")
+        self.feed_items = FakeCollection(self, "feed_items")
+        self.slow_queries = FakeCollection(self, "slow_queries")
+        self.tasks = FakeCollection(self, "tasks")
+        self.feed_removals = FakeCollection(self, "feed_removals")
 
     def __getitem__(self, name):
         # mimic client[db_name] returning database-like object
         return self
 
+
+def _feed_user(fake_db, client):
+    """Seed a user with one character and log the test client in as them; returns the user id."""
+    res = fake_db.users.insert_one({
+        "username": "feeder",
+        "email": "feeder@example.com",
+        "password": "pw",
+        "characters": [{"_id": ObjectId(), "name": "A", "nickname": "a", "fandom": "F", "pic": ""}],
+    })
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(res.inserted_id)
+    return res.inserted_id
+
+
 #
 # Pytest fixtures
 #
@@ -225,6 +456,7 @@ def app_and_client(monkeypatch):
 
     app = create_app(testing=True)
     fake_db = FakeDB()
+    fake_db.listener = app.extensions["db_listener"]
     app.db = fake_db
 
     # Create a DummyUser class to be returned by the user loader
@@ -232,6 +464,7 @@ def app_and_client(monkeypatch):
         def __init__(self, doc):
             self._doc = doc or {}
             self.id = str(self._doc.get("_id")) if self._doc.get("_id") else None
+            self.email = self._doc.get("email")
             self.is_authenticated = True if self._doc else False
 
         def get_id(self):
@@ -251,6 +484,11 @@ def app_and_client(monkeypatch):
     client = app.test_client()
     yield app, client, fake_db
 
+
+def run_tasks(app):
+    """Run the background tasks queued so far (tests have no task workers)."""
+    return app.extensions["tasks"].run_pending()
+
 #
 # Tests
 #
@@ -401,9 +639,9 @@ def test_createforum_requires_login_and_inserts_thread(app_and_client):
     created_id = data["id"]
     assert fake_db.forums.find_one({"_id": ObjectId(created_id)}) is not None
 
-    # user's threads got updated
-    user_after = fake_db.users.find_one({"_id": user_oid})
-    assert "threads" in user_after and len(user_after["threads"]) >= 1
+    # the thread belongs to the user through user_id; the user document is untouched
+    assert fake_db.forums.find_one({"_id": ObjectId(created_id)})["user_id"] == user_oid
+    assert fake_db.users.find_one({"_id": user_oid})["threads"] == []
 
 def test_characters_add_and_delete_and_api(app_and_client):
     app, client, fake_db = app_and_client
@@ -485,7 +723,10 @@ def test_api_published_forums_and_community_and_my_forums(app_and_client):
     titles = {f["title"] for f in j["forums"]}
     assert "P1" in titles and "P2" in titles
 
-    # community endpoint should mirror published forums
+    # community endpoint should mirror published forums (served from feed_items)
+    from feed import sync_feed_item
+    for t in (t1, t2):
+        sync_feed_item(fake_db, t.inserted_id, fake_db.forums.find_one({"_id": t.inserted_id}))
     r2 = client.get("/api/community")
     assert r2.status_code == 200
     j2 = r2.get_json()
@@ -1572,7 +1813,7 @@ def test_json_encoding_error_handling(app_and_client):
         pass
 
 def test_addcharacter_get_db_characters_field(app_and_client):
-    """Test that addcharacter GET passes db_characters to template"""
+    """Test that addcharacter GET passes the db characters payload to template"""
     app, client, fake_db = app_and_client
     
     # Create user
@@ -1591,7 +1832,7 @@ def test_addcharacter_get_db_characters_field(app_and_client):
     
     response = client.get("/addcharacter")
     assert response.status_code == 200
-    # The template should receive db_characters as an empty list
+    assert '"initial_data": {"ok": true, "characters": []}' in response.get_data(as_text=True)
 
 def test_createforum_get_json_encode_error(app_and_client):
     """Test createforum GET handles JSON encoding errors"""
@@ -1621,4 +1862,2055 @@ def test_createforum_get_json_encode_error(app_and_client):
     
     # This should still work with the enhanced error handling
     response = client.get("/createforum")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+# Denormalized author_username
+def test_createforum_stores_author_username(app_and_client):
+    """createforum copies the author's username onto the thread"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+
+    payload = {"title": "Named", "status": "published",
+               "posts": [{"characterIndex": 0, "content": "hi"}]}
+    resp = client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    thread = fake_db.forums.find_one({"_id": ObjectId(resp.get_json()["id"])})
+    assert thread["author_username"] == "feeder"
+
+
+def test_listings_read_author_without_user_lookup(app_and_client):
+    """listing endpoints use the stored author_username and never query users"""
+    app, client, fake_db = app_and_client
+
+    thread = {
+        "user_id": ObjectId(),
+        "author_username": "stored-name",
+        "title": "Denorm",
+        "status": "published",
+        "posts": [],
+        "characters": [],
+        "created_at": datetime.utcnow(),
+        "published_at": datetime.utcnow()
+    }
+    res = fake_db.forums.insert_one(thread)
+    from feed import sync_feed_item
+    sync_feed_item(fake_db, res.inserted_id, thread)
+
+    def fail_find_one(*args, **kwargs):
+        raise AssertionError("listing should not look up users")
+
+    fake_db.users.find_one = fail_find_one
+    for url in ("/api/community", "/api/published_forums"):
+        data = client.get(url).get_json()
+        assert data["forums"][0]["author_username"] == "stored-name"
+
+
+def test_username_change_fans_out_to_threads(app_and_client):
+    """renaming a user rewrites author_username on all of their threads"""
+    app, client, fake_db = app_and_client
+
+    res = fake_db.users.insert_one({"username": "old", "email": "r@example.com", "password": "pw",
+                                    "characters": [], "threads": []})
+    uid = res.inserted_id
+    other = ObjectId()
+    for i in range(3):
+        fake_db.forums.insert_one({"user_id": uid, "author_username": "old", "title": f"T{i}",
+                                   "status": "draft", "posts": [], "characters": []})
+    fake_db.forums.insert_one({"user_id": other, "author_username": "someone", "title": "X",
+                               "status": "draft", "posts": [], "characters": []})
+
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(uid)
+    resp = client.post("/profile/username", data={"username": "new"})
+    assert resp.status_code in (302, 303)
+    assert run_tasks(app) == 1
+
+    assert fake_db.users.find_one({"_id": uid})["username"] == "new"
+    names = [d["author_username"] for d in fake_db.forums.find({"user_id": uid})]
+    assert names == ["new", "new", "new"]
+    assert fake_db.forums.find_one({"user_id": other})["author_username"] == "someone"
+
+
+def test_username_change_reaches_the_community_feed(app_and_client):
+    """the feed cards' copy of the author's name follows a rename too"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    payload = {"title": "Signed", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"][0]["author_username"] == "feeder"
+
+    client.post("/profile/username", data={"username": "renamed"})
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"][0]["author_username"] == "renamed"
+    assert client.get("/api/published_forums").get_json()["forums"][0]["author_username"] == "renamed"
+
+
+def test_fan_out_runs_in_batches():
+    """fan-out issues one update_many per batch"""
+    from authors import fan_out_author_username
+
+    db = FakeDB()
+    uid = db.users.insert_one({"username": "new"}).inserted_id
+    for i in range(5):
+        db.forums.insert_one({"user_id": uid, "author_username": "old", "title": str(i)})
+
+    calls = []
+    original = db.forums.update_many
+
+    def counting_update_many(query, update):
+        calls.append(len(query["_id"]["$in"]))
+        return original(query, update)
+
+    db.forums.update_many = counting_update_many
+    assert fan_out_author_username(db, uid, "new", batch_size=2) == 5
+    assert calls == [2, 2, 1]
+
+
+def test_backfill_author_usernames():
+    """backfill stamps author_username onto legacy threads"""
+    from authors import backfill_author_usernames
+
+    db = FakeDB()
+    uid = db.users.insert_one({"username": "legacy"}).inserted_id
+    db.forums.insert_one({"user_id": uid, "title": "old thread"})
+    db.forums.insert_one({"user_id": ObjectId(), "title": "orphan"})
+
+    assert backfill_author_usernames(db) == 2
+    names = sorted(d["author_username"] for d in db.forums.find())
+    assert names == ["Anonymous", "legacy"]
+
+
+# Materialized community feed
+def test_feed_items_follow_publish_edit_unpublish_delete(app_and_client):
+    """feed_items tracks a thread through its lifecycle"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+
+    payload = {"title": "Draft first", "status": "draft",
+               "posts": [{"characterIndex": 0, "content": "one"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"] == []
+
+    payload.update({"id": tid, "status": "published", "title": "Now public",
+                    "posts": [{"characterIndex": 0, "content": "one"}, {"characterIndex": 0, "content": "two"}]})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    run_tasks(app)
+    cards = client.get("/api/community").get_json()["forums"]
+    assert len(cards) == 1
+    assert cards[0]["id"] == tid
+    assert cards[0]["title"] == "Now public"
+    assert cards[0]["post_count"] == 2
+    assert cards[0]["author_username"] == "feeder"
+    assert cards[0]["created_at"] is not None
+
+    payload["status"] = "draft"
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"] == []
+
+    payload["status"] = "published"
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    run_tasks(app)
+    assert client.delete(f"/api/my_forums/{tid}").status_code == 200
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"] == []
+
+
+def test_feed_items_hold_only_card_fields(app_and_client):
+    """feed cards carry no posts, only the fields the feed renders"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+
+    payload = {"title": "Card", "status": "published",
+               "posts": [{"characterIndex": 0, "content": "long body " * 50}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+    card = fake_db.feed_items.find_one({"_id": ObjectId(tid)})
+    assert "posts" not in card
+    assert "user_id" not in card
+    assert card["post_count"] == 1
+
+
+def test_rebuild_feed():
+    """rebuild_feed repopulates cards from published threads only"""
+    from feed import rebuild_feed
+
+    db = FakeDB()
+    db.forums.insert_one({"title": "pub", "status": "published", "posts": [], "published_at": datetime.utcnow()})
+    db.forums.insert_one({"title": "draft", "status": "draft", "posts": []})
+    db.feed_items.insert_one({"title": "stale"})
+
+    assert rebuild_feed(db) == 1
+    assert [c["title"] for c in db.feed_items.find()] == ["pub"]
+
+
+# Mongo command instrumentation
+def test_server_timing_header_reports_db_commands(app_and_client):
+    """each request reports its Mongo command count and time in Server-Timing"""
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({"title": "Timed", "status": "published", "posts": [], "characters": []})
+
+    resp = client.get(f"/api/thread/{res.inserted_id}")
+    header = resp.headers["Server-Timing"]
+    assert 'db;dur=0.0;desc="1 queries"' in header
+    assert "app;dur=" in header
+
+
+def test_db_budget_exceeded_is_logged(app_and_client, caplog):
+    """requests over the query-count budget are logged with their command breakdown"""
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({"title": "Timed", "status": "published", "posts": [], "characters": []})
+
+    app.config["QUERY_BUDGET_COUNT"] = 5
+    client.get(f"/api/thread/{res.inserted_id}")
+    assert "DB budget exceeded" not in caplog.text
+
+    app.config["QUERY_BUDGET_COUNT"] = 0
+    app.extensions["data_cache"].l1.clear()
+    client.get(f"/api/thread/{res.inserted_id}")
+    assert "DB budget exceeded" in caplog.text
+    assert "'find': 1" in caplog.text
+
+
+def test_listener_ignores_commands_outside_requests(app_and_client):
+    """commands issued outside a request (startup, background jobs) are not attributed"""
+    from types import SimpleNamespace
+    app, client, fake_db = app_and_client
+    listener = app.extensions["db_listener"]
+    event = SimpleNamespace(command_name="ping", duration_micros=10)
+    listener.started(event)
+    listener.succeeded(event)
+    listener.failed(event)
+
+
+# Prometheus metrics
+def test_metrics_endpoint_reports_route_latency(app_and_client):
+    """/metrics exposes per-endpoint latency histograms in the Prometheus text format"""
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({"title": "M", "status": "published", "posts": [], "characters": []})
+    client.get(f"/api/thread/{res.inserted_id}")
+    client.get("/api/community")
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    body = resp.get_data(as_text=True)
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_request_duration_seconds_bucket{endpoint="get_thread",method="GET",le="+Inf"}' in body
+    assert 'http_request_duration_seconds_count{endpoint="api_community",method="GET"}' in body
+    assert 'http_requests_total{endpoint="get_thread",method="GET",status="200"}' in body
+    assert 'http_response_size_bytes_count{endpoint="get_thread"}' in body
+
+
+def test_metrics_mongo_listeners_and_cache_counters():
+    """pymongo listeners and cache lookups feed their counters"""
+    from types import SimpleNamespace
+    import metrics
+
+    before = metrics.MONGO_COMMANDS.value(command="find", outcome="ok") or 0
+    metrics.MetricsCommandListener().succeeded(SimpleNamespace(command_name="find", duration_micros=1200))
+    assert metrics.MONGO_COMMANDS.value(command="find", outcome="ok") == before + 1
+
+    pool = metrics.MetricsPoolListener()
+    checked_out = metrics.POOL_CHECKED_OUT.value() or 0
+    pool.connection_checked_out(None)
+    assert metrics.POOL_CHECKED_OUT.value() == checked_out + 1
+    pool.connection_checked_in(None)
+    assert metrics.POOL_CHECKED_OUT.value() == checked_out
+
+    metrics.record_cache_lookup("test", hit=True)
+    metrics.record_cache_lookup("test", hit=False)
+    text = metrics.REGISTRY.render()
+    assert 'cache_requests_total{cache="test",result="hit"}' in text
+    assert 'cache_requests_total{cache="test",result="miss"}' in text
+
+
+def test_metrics_merge_worker_snapshots(tmp_path, monkeypatch):
+    """with METRICS_DIR set, /metrics sums counters and histograms across workers"""
+    import metrics
+
+    registry = metrics.Registry()
+    hits = metrics.Counter("test_hits_total", "hits", ["route"], registry=registry)
+    latency = metrics.Histogram("test_latency_seconds", "latency", buckets=(0.1, 1.0), registry=registry)
+    live = metrics.Gauge("test_live", "live", registry=registry)
+    hits.inc(route="a")
+    latency.observe(0.05)
+    live.set(3)
+    registry.directory = str(tmp_path)
+
+    # a second (now dead) worker's snapshot
+    other = registry.snapshot()
+    (tmp_path / "metrics_999999999.json").write_text(json.dumps(other))
+
+    text = registry.render()
+    assert 'test_hits_total{route="a"} 2.0' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in text
+    assert "test_latency_seconds_count 2" in text
+    # gauges from dead workers are dropped
+    assert "test_live 3.0" in text
+
+
+# Slow-query log
+COLLSCAN_EXPLAIN = {
+    "queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}},
+    "executionStats": {"nReturned": 3, "totalDocsExamined": 5000, "totalKeysExamined": 0,
+                       "executionTimeMillis": 140},
+}
+
+
+def _command_event(name, command, duration_micros, request_id=1):
+    from types import SimpleNamespace
+    return SimpleNamespace(command_name=name, command=command, duration_micros=duration_micros,
+                           connection_id=("localhost", 27017), request_id=request_id,
+                           database_name="forum_db")
+
+
+def test_summarize_plan_collscan_and_ixscan():
+    """explain output is reduced to the scan type and examined/returned counts"""
+    from slowlog import summarize_plan
+
+    plan = summarize_plan(COLLSCAN_EXPLAIN)
+    assert plan["scan"] == "COLLSCAN"
+    assert plan["docs_examined"] == 5000
+    assert plan["returned"] == 3
+
+    ixscan = summarize_plan({
+        "queryPlanner": {"winningPlan": {"queryPlan": {"stage": "FETCH", "inputStage": {
+            "stage": "IXSCAN", "indexName": "status_1_published_at_-1"}}}},
+        "executionStats": {"nReturned": 3, "totalDocsExamined": 3, "totalKeysExamined": 3},
+    })
+    assert ixscan["scan"] == "IXSCAN"
+    assert ixscan["indexes"] == ["status_1_published_at_-1"]
+
+
+def test_slow_query_recorder_logs_and_explains():
+    """only reads over the threshold are logged, with the plan Mongo chose"""
+    from types import SimpleNamespace
+    from slowlog import SlowQueryRecorder
+
+    explained = []
+
+    class FakeAdminDB:
+        def command(self, cmd):
+            explained.append(cmd)
+            return COLLSCAN_EXPLAIN
+
+    db = SimpleNamespace(client={"forum_db": FakeAdminDB()}, slow_queries=FakeCollection())
+    recorder = SlowQueryRecorder(threshold_ms=50, explain_rate=1.0, run_async=False)
+    recorder.db = db
+
+    find = {"find": "forums", "filter": {"status": "published", "title": {"$regex": "x"}},
+            "sort": {"published_at": -1}, "lsid": {"id": "session"}}
+    fast = _command_event("find", find, 10_000, request_id=1)
+    recorder.started(fast)
+    recorder.succeeded(fast)
+    assert list(db.slow_queries.find()) == []
+
+    slow = _command_event("find", find, 150_000, request_id=2)
+    recorder.started(slow)
+    recorder.succeeded(slow)
+    entries = list(db.slow_queries.find())
+    assert len(entries) == 1
+    assert entries[0]["collection"] == "forums"
+    assert entries[0]["duration_ms"] == 150.0
+    assert json.loads(entries[0]["sort"]) == {"published_at": -1}
+    assert entries[0]["plan"]["scan"] == "COLLSCAN"
+    # session fields are not replayed into explain
+    assert explained[0]["explain"] == {"find": "forums", "filter": find["filter"], "sort": find["sort"]}
+    assert explained[0]["verbosity"] == "executionStats"
+
+    # writes are never explained
+    insert = _command_event("insert", {"insert": "forums"}, 500_000, request_id=3)
+    recorder.started(insert)
+    recorder.succeeded(insert)
+    assert len(list(db.slow_queries.find())) == 1
+
+
+def test_admin_slow_queries_endpoint_is_admin_only(app_and_client):
+    """the slow-query dump is only served to ADMIN_EMAILS"""
+    app, client, fake_db = app_and_client
+    fake_db.slow_queries.insert_one({"collection": "forums", "duration_ms": 120.0})
+    res = fake_db.users.insert_one({"username": "boss", "email": "boss@example.com", "password": "pw"})
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(res.inserted_id)
+
+    assert client.get("/admin/slow_queries").status_code == 403
+
+    app.config["ADMIN_EMAILS"] = frozenset({"boss@example.com"})
+    resp = client.get("/admin/slow_queries")
+    assert resp.status_code == 200
+    assert resp.get_json()["entries"][0]["collection"] == "forums"
+
+
+def test_slow_queries_cli(app_and_client):
+    """flask slow-queries prints the log as JSON lines"""
+    app, client, fake_db = app_and_client
+    fake_db.slow_queries.insert_one({"collection": "forums", "duration_ms": 120.0})
+    result = app.test_cli_runner().invoke(args=["slow-queries", "--limit", "5"])
+    assert result.exit_code == 0
+    assert json.loads(result.output.splitlines()[0])["collection"] == "forums"
+
+
+
+# Per-request profiler
+def test_profile_on_admin_request(app_and_client, tmp_path):
+    """admins can profile one request with a header; results are tagged"""
+    import pstats
+    app, client, fake_db = app_and_client
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    app.config["ADMIN_EMAILS"] = frozenset({"admin@example.com"})
+    res = fake_db.users.insert_one({"username": "admin", "email": "admin@example.com", "password": "pw"})
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(res.inserted_id)
+
+    resp = client.get("/api/community", headers={"X-Profile": "1"})
+    profile_name = resp.headers["X-Profile-File"]
+    assert profile_name.endswith(".pstats")
+    pstats.Stats(str(tmp_path / profile_name))
+
+    tags = json.loads((tmp_path / profile_name.replace(".pstats", ".json")).read_text())
+    assert tags["endpoint"] == "api_community"
+    assert tags["user"] == str(res.inserted_id)
+    assert tags["trigger"] == "request"
+    # loading the admin user + the feed query
+    assert tags["db_queries"] == 2
+
+
+def test_profile_flag_ignored_for_non_admins(app_and_client, tmp_path):
+    """the profile flag does nothing for anonymous or non-admin users"""
+    app, client, fake_db = app_and_client
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    resp = client.get("/api/community?__profile=1")
+    assert "X-Profile-File" not in resp.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profile_sampling_one_in_n(app_and_client, tmp_path):
+    """with PROFILE_SAMPLE_EVERY=N every Nth request is profiled"""
+    app, client, fake_db = app_and_client
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    app.config["PROFILE_SAMPLE_EVERY"] = 3
+    for _ in range(6):
+        client.get("/api/community")
+    profiles = sorted(p.name for p in tmp_path.glob("*.pstats"))
+    assert len(profiles) == 2
+    tags = json.loads((tmp_path / profiles[0].replace(".pstats", ".json")).read_text())
+    assert tags["trigger"] == "sample"
+    assert tags["user"] == "anonymous"
+
+
+# Benchmark data generator
+def test_benchmark_datagen_is_deterministic():
+    """the same spec always yields the same documents"""
+    from benchmarks.datagen import DatasetSpec, generate
+
+    spec = DatasetSpec(users=3, characters_per_user=2, threads=20, posts_per_thread=4, published_ratio=0.5)
+    first, second = generate(spec), generate(spec)
+    assert first == second
+    assert len(first["users"]) == 3
+    assert len(first["forums"]) == 20
+    assert all(len(t["posts"]) == 4 for t in first["forums"])
+    published = [t for t in first["forums"] if t["status"] == "published"]
+    assert len(first["feed_items"]) == len(published)
+    assert generate(DatasetSpec(users=3, threads=20, seed=99))["forums"][0]["_id"] != first["forums"][0]["_id"]
+
+
+def test_benchmark_run_in_memory():
+    """the benchmark runner measures every route against the in-memory engine"""
+    from benchmarks.datagen import DatasetSpec
+    from benchmarks.run import run
+
+    report = run(DatasetSpec(users=2, threads=10, posts_per_thread=3), iterations=3, warmup=0)
+    assert report["dataset"]["threads"] == 10
+    for name, result in report["results"].items():
+        assert result["errors"] == 0, name
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+
+
+# Query-count budgets
+# The most Mongo commands each route may issue, whatever the number of threads
+# or posts. Logged-in routes include the load_user lookup. Tighten these when a
+# route gets cheaper; never loosen them to make a test pass.
+QUERY_BUDGETS = {
+    "api_community": 2,
+    "api_published_forums": 1,
+    "get_thread": 1,
+    "viewthread": 2,
+    "my_forums": 2,
+    "api_my_forum": 2,
+    "api_my_characters": 2,
+    "characters": 2,
+    "createforum": 4,
+    "register": 1,
+    "api_my_forum_delete": 3,
+    "forum": 2,
+    "community": 1,
+}
+
+
+@pytest.fixture
+def assert_queries(app_and_client):
+    """Context manager failing the test when requests in the block exceed a query budget."""
+    from contextlib import contextmanager
+    from instrumentation import count_queries
+    app = app_and_client[0]
+
+    @contextmanager
+    def check(budget, exact=False):
+        with count_queries(app) as requests:
+            yield requests
+        assert requests, "no request finished inside the block"
+        for stats in requests:
+            if exact:
+                assert stats.count == budget, f"expected {budget} queries, got {stats.count}: {stats.commands}"
+            else:
+                assert stats.count <= budget, f"budget {budget} exceeded, got {stats.count}: {stats.commands}"
+
+    return check
+
+
+def _seed_threads(fake_db, n):
+    from feed import sync_feed_item
+    uid = fake_db.users.insert_one({
+        "username": "budget", "email": "budget@example.com", "password": "pw",
+        "characters": [{"_id": ObjectId(), "name": "A", "nickname": "a", "fandom": "F", "pic": ""}],
+        "threads": [],
+    }).inserted_id
+    ids = []
+    for i in range(n):
+        other = fake_db.users.insert_one({"username": f"author{i}", "email": f"a{i}@example.com"}).inserted_id
+        thread = {"user_id": other if i % 2 else uid, "author_username": f"author{i}", "title": f"T{i}",
+                  "status": "published", "posts": [{"content": "x"}] * 3, "characters": [],
+                  "created_at": datetime.utcnow(), "updated_at": datetime.utcnow(),
+                  "published_at": datetime.utcnow()}
+        tid = fake_db.forums.insert_one(thread).inserted_id
+        sync_feed_item(fake_db, tid, thread)
+        ids.append(tid)
+    return uid, ids
+
+
+@pytest.mark.parametrize("n_threads", [1, 25])
+@pytest.mark.parametrize("endpoint,url,login", [
+    ("api_community", "/api/community", False),
+    ("api_published_forums", "/api/published_forums?q=T", False),
+    ("get_thread", "/api/thread/{tid}", False),
+    ("viewthread", "/viewthread/{tid}", False),
+    ("my_forums", "/api/my_forums?q=T", True),
+    ("api_my_forum", "/api/my_forums/{tid}", True),
+    ("api_my_characters", "/api/my_characters", True),
+    ("characters", "/characters", True),
+    ("forum", "/forum", True),
+    ("community", "/community", False),
+])
+def test_route_query_budgets(app_and_client, assert_queries, n_threads, endpoint, url, login):
+    """read routes stay within their query budget regardless of data size"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, n_threads)
+    if login:
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(uid)
+
+    with assert_queries(QUERY_BUDGETS[endpoint]) as requests:
+        resp = client.get(url.format(tid=ids[0]))
+    assert resp.status_code == 200
+    assert requests[0].count <= QUERY_BUDGETS[endpoint]
+
+
+def test_get_thread_is_exactly_one_query(app_and_client, assert_queries):
+    """get_thread is a single find_one for anonymous readers"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, 3)
+    with assert_queries(1, exact=True):
+        client.get(f"/api/thread/{ids[0]}")
+
+
+def test_createforum_query_budget(app_and_client, assert_queries):
+    """publishing a thread costs a fixed number of queries, whatever the post count"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, 1)
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(uid)
+
+    for n_posts in (1, 50):
+        payload = {"title": "Budget", "status": "published",
+                   "posts": [{"characterIndex": 0, "content": f"post {i}"} for i in range(n_posts)]}
+        with assert_queries(QUERY_BUDGETS["createforum"]):
+            resp = client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+        assert resp.status_code == 200
+
+
+def test_query_budget_catches_find_one_in_a_loop(app_and_client, assert_queries):
+    """the budget assertion fails when a route starts querying per item"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, 5)
+
+    original_find = fake_db.forums.find
+
+    def find_with_per_doc_lookup(*args, **kwargs):
+        docs = list(original_find(*args, **kwargs))
+        for doc in docs:
+            fake_db.users.find_one({"_id": doc["user_id"]})
+        return FakeCursor(docs)
+
+    fake_db.forums.find = find_with_per_doc_lookup
+    with pytest.raises(AssertionError, match="budget 1 exceeded"):
+        with assert_queries(QUERY_BUDGETS["api_published_forums"]):
+            client.get("/api/published_forums")
+
+
+# Structured logging
+def test_configure_logging_writes_json_lines_off_thread():
+    """records go through the queue and come out as JSON lines with extra fields"""
+    import io
+    import logging
+    from logconfig import configure_logging, stop_listener
+
+    stream = io.StringIO()
+    root = logging.getLogger("logtest")
+    root.propagate = False
+    listener = configure_logging(level="INFO", module_levels={"logtest.quiet": "ERROR"},
+                                 stream=stream, root=root)
+    logging.getLogger("logtest.app").info("saved %s", "thread", extra={"thread_id": "abc"})
+    logging.getLogger("logtest.quiet").warning("filtered by module level")
+    logging.getLogger("logtest.app").debug("below the root level")
+    stop_listener(listener)
+    stop_listener(listener)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert len(lines) == 1
+    assert lines[0]["msg"] == "saved thread"
+    assert lines[0]["level"] == "INFO"
+    assert lines[0]["logger"] == "logtest.app"
+    assert lines[0]["thread_id"] == "abc"
+
+
+def test_debug_sampling_and_request_fields(app_and_client):
+    """debug records are sampled; records logged in a request carry its path"""
+    import io
+    import logging
+    from logconfig import configure_logging, stop_listener
+
+    app, client, fake_db = app_and_client
+    stream = io.StringIO()
+    root = logging.getLogger("sampletest")
+    root.propagate = False
+    listener = configure_logging(level="DEBUG", debug_sample_rate=0.0, stream=stream, root=root)
+    with app.test_request_context("/api/community"):
+        root.debug("dropped by sampling")
+        root.error("kept")
+    stop_listener(listener)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [l["msg"] for l in lines] == ["kept"]
+    assert lines[0]["path"] == "/api/community"
+
+
+def test_parse_log_levels():
+    from logconfig import parse_levels
+    assert parse_levels("app=debug, slowlog=WARNING,,bad") == {"app": "DEBUG", "slowlog": "WARNING"}
+    assert parse_levels(None) == {}
+
+
+# Server-rendered threads
+@pytest.fixture
+def real_templates(monkeypatch):
+    """Render the actual Jinja templates instead of the fake placeholder."""
+    import flask
+    monkeypatch.setattr(app_module, "render_template", flask.render_template)
+
+
+def test_viewthread_renders_published_thread_server_side(app_and_client, real_templates, assert_queries):
+    """published threads are rendered into the page and the fragment is cached"""
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({
+        "user_id": ObjectId(), "title": "Rendered <Thread>", "status": "published",
+        "posts": [{"floor": 1, "nickname": "Nick", "avatar": "/a.png", "content": "line one\n<b>line two</b>"},
+                  {"floor": 2, "nickname": "Other", "avatar": "", "content": "reply"}],
+        "characters": [], "created_at": datetime(2025, 5, 1, 12, 30), "updated_at": datetime(2025, 5, 1, 12, 30),
+    })
+
+    with assert_queries(2, exact=True):
+        html = client.get(f"/viewthread/{res.inserted_id}").get_data(as_text=True)
+    assert 'data-server-rendered="true"' in html
+    assert "Rendered &lt;Thread&gt;" in html
+    assert "line one<br>&lt;b&gt;line two&lt;/b&gt;" in html
+    assert "Original Poster" in html
+    assert "2025-05-01 12:30" in html
+    assert '<span id="thread-replies">1</span>' in html
+
+    # cached fragment: only the small status/updated_at lookup
+    with assert_queries(1, exact=True):
+        again = client.get(f"/viewthread/{res.inserted_id}").get_data(as_text=True)
+    assert '<span id="thread-views">1</span>' in html
+    assert '<span id="thread-views">2</span>' in again
+    assert again.replace(">2<", ">1<", 1) == html
+
+
+def test_viewthread_cache_invalidated_on_save(app_and_client, real_templates):
+    """saving a thread through createforum re-renders it"""
+    app, client, fake_db = app_and_client
+    uid = _feed_user(fake_db, client)
+
+    payload = {"title": "Cached", "status": "published", "posts": [{"characterIndex": 0, "content": "first"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    assert "first" in client.get(f"/viewthread/{tid}").get_data(as_text=True)
+
+    payload.update({"id": tid, "posts": [{"characterIndex": 0, "content": "edited"}]})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    html = client.get(f"/viewthread/{tid}").get_data(as_text=True)
+    assert "edited" in html and "first" not in html
+
+
+def test_viewthread_drafts_fall_back_to_client_rendering(app_and_client, real_templates):
+    """drafts and bad ids get the empty shell that loads from the JSON API"""
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({"user_id": ObjectId(), "title": "Secret", "status": "draft",
+                                     "posts": [{"content": "hidden"}]})
+    for url in (f"/viewthread/{res.inserted_id}", "/viewthread/not-an-id"):
+        html = client.get(url).get_data(as_text=True)
+        assert "data-server-rendered" not in html
+        assert "hidden" not in html
+        assert "Loading forum content..." in html
+
+
+def test_lru_cache_evicts_least_recently_used():
+    from cache import LRUCache
+    cache = LRUCache(maxsize=2, name="test")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.pop("a") == 1
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+# Inlined first-page data
+def _initial_data(html):
+    import re
+    match = re.search(r'<script type="application/json" id="initial-data">(.*?)</script>', html, re.S)
+    assert match, "no initial-data tag in page"
+    return json.loads(match.group(1))
+
+
+@pytest.mark.parametrize("page,api,login", [
+    ("/forum", "/api/my_forums", True),
+    ("/community", "/api/published_forums", False),
+    ("/addcharacter", "/api/db_characters", True),
+])
+def test_pages_inline_their_first_api_response(app_and_client, real_templates, page, api, login):
+    """the inlined payload is exactly what the page would otherwise fetch"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, 3)
+    if login:
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(uid)
+
+    html = client.get(page).get_data(as_text=True)
+    assert _initial_data(html) == client.get(api).get_json()
+
+
+def test_inlined_data_cannot_close_the_script_tag(app_and_client, real_templates):
+    """titles are escaped so user content cannot break out of the JSON tag"""
+    app, client, fake_db = app_and_client
+    fake_db.forums.insert_one({
+        "user_id": ObjectId(), "title": "</script><script>alert(1)</script>", "status": "published",
+        "posts": [], "characters": [], "created_at": datetime.utcnow(), "published_at": datetime.utcnow(),
+    })
+
+    html = client.get("/community").get_data(as_text=True)
+    assert "<script>alert(1)" not in html
+    assert _initial_data(html)["forums"][0]["title"] == "</script><script>alert(1)</script>"
+
+
+# Admission control
+def test_expensive_routes_shed_while_cheap_routes_served(app_and_client):
+    """a saturated limiter answers weighted routes with a fast 503 and leaves the rest alone"""
+    app, client, fake_db = app_and_client
+    uid, ids = _seed_threads(fake_db, 2)
+    app.config["ADMISSION_QUEUE_MS"] = 10
+    limiter = app.extensions["admission"]
+
+    assert client.get("/api/community").status_code == 200
+    assert limiter.in_use == 0
+
+    assert limiter.acquire(limiter.capacity, timeout=0)
+    try:
+        shed = client.get("/api/community")
+        assert shed.status_code == 503
+        assert shed.headers["Retry-After"] == "1"
+        assert shed.get_json()["ok"] is False
+        assert client.get("/api/published_forums?q=T").status_code == 503
+        assert client.get(f"/api/thread/{ids[0]}").status_code == 200
+    finally:
+        limiter.release(limiter.capacity)
+
+    assert client.get("/api/community").status_code == 200
+    assert 'admission_rejected_total{endpoint="api_community"}' in client.get("/metrics").get_data(as_text=True)
+
+
+def test_weighted_limiter_waits_until_deadline():
+    """a waiting request starts when units free up in time and is refused otherwise"""
+    import threading
+    from admission import WeightedLimiter, parse_weights
+    limiter = WeightedLimiter(4)
+    assert limiter.acquire(3, timeout=0)
+    assert limiter.acquire(1, timeout=0)
+    assert not limiter.acquire(2, timeout=0.01)
+
+    threading.Timer(0.02, limiter.release, args=(3,)).start()
+    assert limiter.acquire(2, timeout=1)
+    assert limiter.in_use == 3
+    # heavier than the whole limit: runs alone rather than never
+    limiter.release(1)
+    limiter.release(2)
+    assert limiter.acquire(10, timeout=0)
+    assert limiter.in_use == 4
+
+    assert parse_weights("api_community=4, my_forums=2,bad") == {"api_community": 4, "my_forums": 2}
+
+
+# Mongo time budgets
+def test_requests_run_under_their_endpoint_deadline(app_and_client, monkeypatch):
+    """every command runs inside a pymongo.timeout() of the endpoint's budget, reported in Server-Timing"""
+    from pymongo import _csot
+    app, client, fake_db = app_and_client
+    res = fake_db.forums.insert_one({"title": "Timed", "status": "published", "posts": [], "characters": []})
+    seen = []
+    real_find = fake_db.forums.find
+    monkeypatch.setattr(fake_db.forums, "find", lambda *a, **kw: seen.append(_csot.get_timeout()) or real_find(*a, **kw))
+
+    resp = client.get("/api/published_forums?q=Timed")
+    assert seen == [1.0]
+    assert "db-budget;dur=1000" in resp.headers["Server-Timing"]
+    assert _csot.get_timeout() is None
+
+    app.config["QUERY_TIMEOUT_MS"] = 0
+    resp = client.get(f"/api/thread/{res.inserted_id}")
+    assert "db-budget" not in resp.headers["Server-Timing"]
+
+
+def test_writes_run_without_a_deadline(app_and_client, monkeypatch):
+    """a slow upload cannot use up the time its insert needs: POSTs get no deadline"""
+    from pymongo import _csot
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    app.config["QUERY_TIMEOUT_MS"] = 1
+    seen = []
+    real_insert = fake_db.forums.insert_one
+    monkeypatch.setattr(fake_db.forums, "insert_one",
+                        lambda *a, **kw: seen.append(_csot.get_timeout()) or real_insert(*a, **kw))
+
+    payload = {"title": "Slow", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    resp = client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    assert resp.status_code == 200
+    assert seen == [None]
+    assert "db-budget" not in resp.headers["Server-Timing"]
+
+
+def test_execution_timeout_becomes_504(app_and_client, monkeypatch, caplog):
+    """a query killed by maxTimeMS answers with a JSON 504 instead of a 500"""
+    from pymongo.errors import ExecutionTimeout
+    app, client, fake_db = app_and_client
+
+    def slow_find(*args, **kwargs):
+        raise ExecutionTimeout("operation exceeded time limit", 50)
+
+    monkeypatch.setattr(fake_db.forums, "find", slow_find)
+    resp = client.get("/api/published_forums?q=(a+)+$")
+    assert resp.status_code == 504
+    assert resp.get_json()["ok"] is False
+    assert "Mongo time budget of 1000.0ms exhausted" in caplog.text
+
+
+# Thread view counter
+def test_views_are_batched_and_flushed_with_one_bulk_write(app_and_client, assert_queries):
+    """views cost no write per read; one unordered bulk $inc per flush"""
+    app, client, fake_db = app_and_client
+    counter = app.extensions["view_counter"]
+    uid, ids = _seed_threads(fake_db, 2)
+
+    with assert_queries(QUERY_BUDGETS["viewthread"]):
+        for _ in range(3):
+            client.get(f"/viewthread/{ids[0]}")
+        client.get(f"/viewthread/{ids[1]}")
+    assert "views" not in fake_db.forums._docs[str(ids[0])]
+    assert client.get(f"/api/thread/{ids[0]}").get_json()["thread"]["views"] == 3
+
+    calls = []
+    real_bulk_write = fake_db.forums.bulk_write
+
+    def recording_bulk_write(ops, ordered=True):
+        calls.append((len(ops), ordered))
+        return real_bulk_write(ops, ordered)
+    fake_db.forums.bulk_write = recording_bulk_write
+    assert counter.flush(fake_db) == 2
+    assert calls == [(2, False)]
+    assert counter.flush(fake_db) == 0
+
+    assert fake_db.forums._docs[str(ids[0])]["views"] == 3
+    client.get(f"/viewthread/{ids[0]}")
+    assert client.get(f"/api/thread/{ids[0]}").get_json()["thread"]["views"] == 4
+
+
+def test_view_counter_keeps_counts_on_failed_flush_and_flushes_on_stop():
+    """a failed flush is retried later and stop() writes what is still pending"""
+    from viewcounts import ViewCounter
+    db = FakeDB()
+    tid = db.forums.insert_one({"title": "Hot", "status": "published"}).inserted_id
+    counter = ViewCounter(flush_interval=3600)
+    counter.record(tid)
+    counter.record(tid)
+
+    def broken(ops, ordered=True):
+        raise RuntimeError("primary stepped down")
+    real_bulk_write, db.forums.bulk_write = db.forums.bulk_write, broken
+    assert counter.flush(db) == 0
+    assert counter.pending(tid) == 2
+
+    db.forums.bulk_write = real_bulk_write
+    counter.start(db)
+    counter.stop()
+    counter.stop()
+    assert db.forums._docs[str(tid)]["views"] == 2
+    assert counter.pending(tid) == 0
+
+
+# Trending feed
+def test_trending_feed_reads_precomputed_ranks(app_and_client, assert_queries):
+    """rank_feed scores cards from recency, posts and views; the API only sorts by the score"""
+    from feed import rank_feed, sync_feed_item
+    app, client, fake_db = app_and_client
+    now = datetime(2025, 6, 1, 12, 0)
+
+    def publish(title, hours_ago, posts, views):
+        thread = {"title": title, "status": "published", "posts": [{"content": "x"}] * posts,
+                  "characters": [], "views": views, "published_at": now - timedelta(hours=hours_ago)}
+        tid = fake_db.forums.insert_one(thread).inserted_id
+        sync_feed_item(fake_db, tid, thread)
+
+    publish("old and busy", 24 * 14, 50, 5000)
+    publish("fresh and quiet", 1, 1, 0)
+    publish("fresh and busy", 3, 20, 800)
+    publish("day old", 24, 20, 800)
+
+    assert rank_feed(fake_db, now=now, batch_size=3) == 4
+    with assert_queries(QUERY_BUDGETS["api_community"]):
+        resp = client.get("/api/community?sort=trending")
+    titles = [f["title"] for f in resp.get_json()["forums"]]
+    assert titles == ["fresh and busy", "day old", "fresh and quiet", "old and busy"]
+
+    recent = [f["title"] for f in client.get("/api/community").get_json()["forums"]]
+    assert recent[0] == "fresh and quiet"
+    assert client.get("/api/community?sort=bogus").status_code == 400
+
+
+def test_trending_score_decays_with_age():
+    from feed import trending_score
+    assert trending_score(10, 100, 0) > trending_score(10, 100, 24) > trending_score(10, 100, 48)
+    assert trending_score(10, 100, 24) == pytest.approx(trending_score(10, 100, 0) / 2)
+    assert trending_score(10, 500, 5) > trending_score(10, 50, 5)
+
+
+# Write-path round trips
+def test_register_is_one_round_trip(app_and_client, assert_queries):
+    """register upserts and reads the new user back in a single findAndModify"""
+    app, client, fake_db = app_and_client
+    form = {"username": "once", "email": "once@example.com", "password": "pw", "confirm-password": "pw"}
+
+    with assert_queries(QUERY_BUDGETS["register"], exact=True) as requests:
+        resp = client.post("/register", data=form)
+    assert resp.status_code == 302 and resp.headers["Location"].endswith("/profile")
+    assert requests[0].commands == {"findAndModify": 1}
+
+    # same email again: the existing user comes back untouched, no second account
+    resp = client.post("/register", data={**form, "username": "twice", "password": "x", "confirm-password": "x"})
+    assert resp.headers["Location"].endswith("/register")
+    users = list(fake_db.users.find({"email": "once@example.com"}))
+    assert len(users) == 1 and users[0]["username"] == "once"
+
+
+def test_thread_writes_share_one_transaction_on_a_replica_set(app_and_client, assert_queries):
+    """creating and deleting a thread commit the thread write and its feed task together"""
+    app, client, fake_db = app_and_client
+    fake_db.client.topology_description.topology_type_name = "ReplicaSetWithPrimary"
+    uid = _feed_user(fake_db, client)
+
+    with assert_queries(QUERY_BUDGETS["createforum"]):
+        resp = client.post("/createforum", json={
+            "title": "Atomic", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]})
+    tid = resp.get_json()["id"]
+    session = fake_db.client.sessions[-1]
+    assert session.transactions == 1
+    assert session.commands == [("insert", "forums"), ("insert", "tasks")]
+
+    with assert_queries(QUERY_BUDGETS["api_my_forum_delete"]):
+        assert client.delete(f"/api/my_forums/{tid}").get_json()["ok"] is True
+    session = fake_db.client.sessions[-1]
+    assert session.transactions == 1
+    assert session.commands == [("delete", "forums"), ("insert", "tasks")]
+    run_tasks(app)
+    assert fake_db.feed_items.find_one({"_id": ObjectId(tid)}) is None
+
+    # a thread that isn't yours: nothing else is written
+    assert client.delete(f"/api/my_forums/{ObjectId()}").status_code == 404
+    assert fake_db.client.sessions[-1].commands == [("delete", "forums")]
+
+
+def test_thread_writes_without_transactions_on_a_standalone_server(app_and_client):
+    """a standalone server has no transactions; the writes still all happen"""
+    app, client, fake_db = app_and_client
+    uid = _feed_user(fake_db, client)
+
+    tid = client.post("/createforum", json={
+        "title": "Solo", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}).get_json()["id"]
+    assert fake_db.client.sessions == []
+    assert fake_db.forums.find_one({"_id": ObjectId(tid)})["user_id"] == uid
+    run_tasks(app)
+    assert fake_db.feed_items.find_one({"_id": ObjectId(tid)}) is not None
+
+
+# users.threads removal
+def test_thread_writes_leave_the_user_document_alone(app_and_client, assert_queries):
+    """creating and deleting threads no longer touches users; the listing finds them by user_id"""
+    app, client, fake_db = app_and_client
+    uid = _feed_user(fake_db, client)
+
+    with assert_queries(QUERY_BUDGETS["createforum"]) as requests:
+        tid = client.post("/createforum", json={
+            "title": "Mine", "posts": [{"characterIndex": 0, "content": "hi"}]}).get_json()["id"]
+    # load_user, the character lookup, the thread and its feed task
+    assert requests[0].commands == {"find": 2, "insert": 2}
+    assert "threads" not in fake_db.users._docs[str(uid)]
+    assert [f["id"] for f in client.get("/api/my_forums").get_json()["forums"]] == [tid]
+
+
+def test_drop_user_threads_migration(app_and_client):
+    from migrations import drop_user_threads
+    app, client, fake_db = app_and_client
+    old = fake_db.users.insert_one({"username": "old", "email": "old@example.com", "threads": [ObjectId()]})
+    new = fake_db.users.insert_one({"username": "new", "email": "new@example.com"})
+
+    result = app.test_cli_runner().invoke(args=["drop-user-threads"])
+    assert "Cleared threads from 1 users." in result.output
+    assert "threads" not in fake_db.users._docs[str(old.inserted_id)]
+    assert fake_db.users._docs[str(new.inserted_id)]["username"] == "new"
+    assert drop_user_threads(fake_db) == 0
+
+
+# Lightweight User
+def test_load_user_fetches_only_identity_fields():
+    """load_user projects to id/username/email; characters and threads load on first use"""
+    import sys
+    from models import User
+    app = create_app(testing=True)
+    app.db = FakeDB()
+    uid = app.db.users.insert_one({
+        "username": "slim", "email": "slim@example.com", "password": "secret",
+        "characters": [{"_id": ObjectId(), "name": "Big", "bio": "x" * 10000}],
+    }).inserted_id
+    older = app.db.forums.insert_one({"user_id": uid, "updated_at": datetime(2025, 1, 1)}).inserted_id
+    newer = app.db.forums.insert_one({"user_id": uid, "updated_at": datetime(2025, 2, 1)}).inserted_id
+
+    fetched = []
+    real_find_one = app.db.users.find_one
+    app.db.users.find_one = lambda q, projection=None: fetched.append(projection) or real_find_one(q, projection)
+
+    user = app.login_manager._user_callback(str(uid))
+    assert fetched == [User.USER_FIELDS]
+    assert (user.id, user.username, user.email) == (str(uid), "slim", "slim@example.com")
+    assert not hasattr(user, "__dict__") and not hasattr(user, "password")
+    assert sys.getsizeof(user) < 100
+
+    with app.app_context():
+        assert user.characters[0]["name"] == "Big"
+        assert user.characters is user.characters
+        assert user.threads == [newer, older]
+    assert fetched == [User.USER_FIELDS, {"characters": 1}]
+
+    assert user.is_authenticated and user.is_active and not user.is_anonymous
+    assert user.get_id() == str(uid) and user == User({"_id": uid})
+
+
+
+# Background tasks
+def _runner(db, **kwargs):
+    from tasks import TaskRunner
+    return TaskRunner(lambda: db, workers=0, **kwargs)
+
+
+def test_task_runner_runs_by_priority_and_deletes_finished_tasks():
+    db = FakeDB()
+    runner = _runner(db)
+    ran = []
+    runner.task("low", priority=9)(lambda n: ran.append(("low", n)))
+    runner.task("high", priority=1)(lambda n: ran.append(("high", n)))
+
+    runner.enqueue("low", {"n": 1})
+    runner.enqueue("high", {"n": 2})
+    runner.enqueue("low", {"n": 3}, priority=0)
+    assert len(db.tasks._docs) == 3
+
+    assert runner.run_pending() == 3
+    assert ran == [("low", 3), ("high", 2), ("low", 1)]
+    assert db.tasks._docs == {}
+    with pytest.raises(KeyError):
+        runner.enqueue("unknown")
+
+
+def test_task_runner_retries_with_backoff_then_gives_up():
+    import time
+    db = FakeDB()
+    runner = _runner(db, max_attempts=3, backoff=0.02)
+    calls = []
+
+    @runner.task("flaky")
+    def flaky():
+        calls.append(time.monotonic())
+        raise RuntimeError("downstream unavailable")
+
+    task = runner.enqueue("flaky")
+    assert runner.run_pending() == 1
+    stored = db.tasks.find_one({"_id": task["_id"]})
+    assert (stored["status"], stored["attempts"]) == ("pending", 1)
+    assert "downstream unavailable" in stored["error"]
+    assert runner.run_pending() == 0  # not due yet
+
+    time.sleep(0.03)
+    assert runner.run_pending() == 1
+    time.sleep(0.05)
+    assert runner.run_pending() == 1
+    assert len(calls) == 3 and calls[2] - calls[1] >= 0.04
+    assert db.tasks.find_one({"_id": task["_id"]})["status"] == "failed"
+    assert runner.run_pending() == 0
+
+    from metrics import REGISTRY
+    text = REGISTRY.render()
+    assert 'tasks_processed_total{task="flaky",outcome="retry"} 2' in text
+    assert 'tasks_processed_total{task="flaky",outcome="failed"} 1' in text
+
+
+def test_tasks_survive_a_restart():
+    """tasks persisted by one runner are recovered by the next, including abandoned claims"""
+    from datetime import timedelta
+    db = FakeDB()
+    first = _runner(db)
+    first.task("job")(lambda n: None)
+    queued = first.create("job", {"n": 1})
+    claimed = first.create("job", {"n": 2})
+    db.tasks._docs[str(claimed["_id"])].update(status="running", locked_at=datetime.utcnow() - timedelta(hours=1))
+
+    second = _runner(db, lease=60)
+    done = []
+    second.task("job")(lambda n: done.append(n))
+    second.recover()
+    assert second.run_pending() == 2
+    assert sorted(done) == [1, 2]
+    assert db.tasks._docs == {}
+    assert queued["_id"] not in second._queued
+
+
+def test_task_workers_run_in_the_background():
+    import threading
+    from tasks import TaskRunner
+    db = FakeDB()
+    runner = TaskRunner(lambda: db, workers=2, poll_interval=3600)
+    done = threading.Event()
+    runner.task("ping")(lambda: done.set())
+    runner.start()
+    try:
+        runner.enqueue("ping")
+        assert done.wait(2)
+    finally:
+        runner.stop()
+
+
+def test_worker_boot_starts_background_work_when_mongo_is_not_ready(boot_app, monkeypatch):
+    """a failed ping or index build at boot still starts the task runner and view flusher"""
+    import time
+    from pymongo.errors import ServerSelectionTimeoutError
+    boot, db = boot_app
+
+    def mongo_down(*args, **kwargs):
+        raise ServerSelectionTimeoutError("no primary")
+
+    monkeypatch.setattr(app_module, "ensure_indexes", mongo_down)
+    tid = db.forums.insert_one({"title": "Queued", "status": "published", "posts": [],
+                                "characters": [], "user_id": ObjectId()}).inserted_id
+    db.tasks.insert_one({"_id": ObjectId(), "name": "feed.sync", "payload": {"thread_id": tid},
+                         "priority": 0, "status": "pending", "attempts": 0,
+                         "created_at": datetime.utcnow(), "run_at": datetime.utcnow()})
+
+    app = boot(CACHE_WARMUP_SECONDS=0)
+    assert app.extensions["view_counter"]._thread is not None
+    deadline = time.monotonic() + 5
+    while db.tasks.find_one({}) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert db.feed_items.find_one({"_id": tid}) is not None
+
+
+def test_cli_commands_do_not_start_background_work(boot_app):
+    """`flask rank-feed` and friends build the app without task workers, ranker or warm-up"""
+    import click
+    boot, db = boot_app
+    with click.Context(click.Group("flask"), info_name="flask"):
+        app = boot()
+    assert app.extensions["tasks"]._threads == []
+    assert app.extensions["view_counter"]._thread is None
+    assert app.extensions["cache_warmer"]._thread is None
+
+
+def test_task_workers_survive_mongo_errors():
+    """a failed claim leaves the task to the recovery poll; the worker thread goes on"""
+    import threading
+    import time
+    from pymongo.errors import AutoReconnect
+    from tasks import TaskRunner
+    db = FakeDB()
+    runner = TaskRunner(lambda: db, workers=1, poll_interval=3600)
+    ran, second = [], threading.Event()
+    runner.task("job")(lambda n: ran.append(n) or (n == 2 and second.set()))
+    real_claim = db.tasks.find_one_and_update
+    failures = [AutoReconnect("primary stepped down")]
+
+    def flaky_claim(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return real_claim(*args, **kwargs)
+
+    db.tasks.find_one_and_update = flaky_claim
+    runner.start()
+    try:
+        first = runner.enqueue("job", {"n": 1})
+        runner.enqueue("job", {"n": 2})
+        assert second.wait(2)
+        assert ran == [2]
+        assert db.tasks._docs[str(first["_id"])]["status"] == "pending"
+        runner.recover()
+        deadline = time.monotonic() + 2
+        while ran == [2] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ran == [2, 1]
+    finally:
+        runner.stop()
+
+
+@pytest.fixture
+def boot_app(monkeypatch):
+    """Build the app as a worker does (testing=False) over an in-memory mongomock server.
+
+    Returns (boot, db): seed db, then call boot(**env) for the app. Its
+    background threads are stopped after the test.
+    """
+    import os
+    import mongomock
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(app_module, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setenv("SECRET_KEY", os.getenv("SECRET_KEY") or "test-secret-key-for-ci")
+    monkeypatch.setenv("DB_NAME", "boot_db")
+    monkeypatch.setenv("TRENDING_INTERVAL_SECONDS", "0")
+    db = client["boot_db"]
+    db.create_collection("slow_queries")    # mongomock cannot make the capped one
+    booted = []
+
+    def boot(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        booted.append(create_app())
+        return booted[-1]
+
+    yield boot, db
+    for app in booted:
+        app.extensions["tasks"].stop()
+        app.extensions["view_counter"].stop()
+
+
+def test_worker_boot_runs_recovered_tasks(boot_app):
+    """tasks left pending by a previous worker run once the new one is up, not fail for want of a handler"""
+    import time
+    boot, db = boot_app
+    tid = db.forums.insert_one({"title": "Left over", "status": "published", "posts": [],
+                                "characters": [], "user_id": ObjectId()}).inserted_id
+    db.tasks.insert_one({"_id": ObjectId(), "name": "feed.sync", "payload": {"thread_id": tid},
+                         "priority": 0, "status": "pending", "attempts": 4,
+                         "created_at": datetime.utcnow(), "run_at": datetime.utcnow()})
+
+    boot(CACHE_WARMUP_SECONDS=0, TASK_MAX_ATTEMPTS=5)
+    deadline = time.monotonic() + 5
+    while db.tasks.find_one({"status": {"$ne": "failed"}}) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert db.tasks.find_one({}) is None    # done tasks are deleted
+    assert db.feed_items.find_one({"_id": tid})["title"] == "Left over"
+
+
+# Live community feed
+def _drain(subscription):
+    events = []
+    while (event := subscription.get(0)) is not None:
+        events.append(event)
+    return events
+
+
+def test_live_feed_polls_once_for_every_subscriber(app_and_client):
+    """all streams of a worker share one poll of forums and feed_removals"""
+    app, client, fake_db = app_and_client
+    live_feed = app.extensions["live_feed"]
+    subscriptions = [live_feed.subscribe() for _ in range(3)]
+    _feed_user(fake_db, client)
+
+    payload = {"title": "Live", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+    commands = []
+    fake_db.listener = SimpleNamespace(started=lambda e: commands.append(e.command), succeeded=lambda e: None)
+    assert live_feed.poll_once() == 1
+    assert commands == [{"find": "forums"}, {"find": "feed_removals"}]
+    for subscription in subscriptions:
+        [event] = _drain(subscription)
+        assert event["type"] == "published"
+        assert event["id"] == tid
+        assert event["title"] == "Live"
+        assert event["author_username"] == "feeder"
+        assert "posts" not in event
+
+    # the overlap window re-reads the thread but does not repeat it
+    assert live_feed.poll_once() == 0
+
+    payload.update({"id": tid, "title": "Live, edited"})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    live_feed.poll_once()
+    for subscription in subscriptions:
+        assert [e["type"] for e in _drain(subscription)] == ["updated"]
+
+    client.delete(f"/api/my_forums/{tid}")
+    run_tasks(app)
+    assert fake_db.feed_removals.find_one({"thread_id": ObjectId(tid)}) is not None
+    live_feed.poll_once()
+    assert _drain(subscriptions[1]) == [{"type": "removed", "id": tid}]
+
+
+def test_live_feed_poll_keeps_drafts_private(app_and_client):
+    """the poller reports a thread leaving the feed, never a draft that was not in it"""
+    app, client, fake_db = app_and_client
+    live_feed = app.extensions["live_feed"]
+    subscription = live_feed.subscribe()
+    _feed_user(fake_db, client)
+
+    def save(**fields):
+        payload = {"title": "T", "posts": [{"characterIndex": 0, "content": "hi"}], **fields}
+        return client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+
+    draft = save(status="draft")
+    save(id=draft, status="draft", title="Still a draft")
+    client.delete(f"/api/my_forums/{draft}")
+    run_tasks(app)
+    assert live_feed.poll_once() == 0
+    assert fake_db.feed_removals.find_one({}) is None
+
+    # unpublished or deleted: reported through the tombstone feed.sync leaves with the card
+    unpublished, deleted = save(status="published"), save(status="published")
+    run_tasks(app)
+    live_feed.poll_once()
+    _drain(subscription)
+    save(id=unpublished, status="draft")
+    client.delete(f"/api/my_forums/{deleted}")
+    live_feed.poll_once()
+    assert _drain(subscription) == []
+    run_tasks(app)
+    live_feed.poll_once()
+    assert sorted(e["id"] for e in _drain(subscription) if e["type"] == "removed") == sorted([unpublished, deleted])
+
+
+def test_live_feed_change_events():
+    from livefeed import change_event
+    tid = ObjectId()
+    doc = {"_id": tid, "title": "T", "status": "published", "author_username": "a",
+           "published_at": datetime(2025, 1, 1), "updated_at": datetime(2025, 1, 2)}
+    draft = dict(doc, status="draft")
+
+    def change(op, full=None, updated=None, coll="forums"):
+        return {"operationType": op, "ns": {"db": "forums_db", "coll": coll}, "documentKey": {"_id": tid},
+                "fullDocument": full, "updateDescription": {"updatedFields": updated or {}}}
+
+    assert change_event(change("insert", doc))["type"] == "published"
+    assert change_event(change("insert", draft)) is None
+    assert change_event(change("update", doc, {"updated_at": 1}))["type"] == "updated"
+    assert change_event(change("update", doc, {"status": "published"}))["type"] == "published"
+    assert change_event(change("update", draft, {"status": "draft"})) is None
+    assert change_event(change("update", draft, {"updated_at": 1})) is None
+    assert change_event(change("update", None, {"updated_at": 1})) is None
+    assert change_event(change("delete")) is None
+    # removals, of published threads only, come from the tombstones
+    tombstone = {"_id": ObjectId(), "thread_id": tid, "at": datetime(2025, 1, 3)}
+    assert change_event(change("insert", tombstone, coll="feed_removals")) == {"type": "removed", "id": str(tid)}
+    assert change_event(change("delete", coll="feed_removals")) is None
+    assert change_event(change("update", doc))["updated_at"] == "2025-01-02T00:00:00"
+
+
+def test_community_stream_sends_events_and_keepalives(app_and_client):
+    app, client, fake_db = app_and_client
+    live_feed = app.extensions["live_feed"]
+    app.config["LIVE_FEED_HEARTBEAT_SECONDS"] = 0.01
+
+    resp = client.get("/api/community/stream")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/event-stream"
+    assert resp.headers["Cache-Control"] == "no-cache"
+    chunks = iter(resp.response)
+    assert next(chunks) == b"retry: 5000\n\n"
+    assert next(chunks) == b": keep-alive\n\n"
+
+    live_feed.publish({"type": "removed", "id": "abc"})
+    assert next(chunks) == b'event: removed\ndata: {"type":"removed","id":"abc"}\n\n'
+    assert len(live_feed._subscribers) == 1
+    resp.close()
+    assert live_feed._subscribers == set()
+
+
+def test_community_stream_limits_connections_and_drops_slow_clients(app_and_client):
+    from livefeed import LiveFeed
+    app, client, fake_db = app_and_client
+    app.config["LIVE_FEED_HEARTBEAT_SECONDS"] = 0.01
+    live_feed = app.extensions["live_feed"]
+    held = [live_feed.subscribe() for _ in range(live_feed.max_subscribers)]
+    resp = client.get("/api/community/stream")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "30"
+
+    slow = LiveFeed(lambda: None, queue_size=2, autostart=False)
+    lagging, keeping_up = slow.subscribe(), slow.subscribe()
+    for n in range(3):
+        slow.publish({"type": "updated", "id": str(n)})
+        keeping_up.get(0)
+    assert lagging.closed and not keeping_up.closed
+    assert slow._subscribers == {keeping_up}
+    assert list(slow.stream(lagging)) == ["retry: 5000\n\n"]
+
+
+# Character snapshots
+def test_createforum_posts_reference_character_snapshots(app_and_client, real_templates):
+    """posts keep a character_id and their overrides; pages and the API expand them back"""
+    app, client, fake_db = app_and_client
+    char_id = ObjectId()
+    uid = fake_db.users.insert_one({
+        "username": "snap", "email": "snap@example.com", "password": "pw",
+        "characters": [{"_id": char_id, "name": "Hero", "nickname": "H", "fandom": "F", "pic": "/h.png"}],
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(uid)
+
+    payload = {"title": "Snapshots", "status": "published", "posts": [
+        {"characterIndex": 0, "nickname": "H", "avatar": "/h.png", "content": "plain"},
+        {"characterIndex": 0, "nickname": "Masked H", "avatar": "/h.png", "content": "disguised"},
+    ]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    thread = fake_db.forums.find_one({"_id": ObjectId(tid)})
+    assert thread["posts"] == [
+        {"characterIndex": 0, "character_id": str(char_id), "content": "plain", "floor": 1},
+        {"characterIndex": 0, "character_id": str(char_id), "nickname": "Masked H", "content": "disguised",
+         "floor": 2},
+    ]
+    assert thread["characters"][0]["name"] == "Hero"
+
+    html = client.get(f"/viewthread/{tid}").get_data(as_text=True)
+    assert '<div class="user-name">H</div>' in html
+    assert '<div class="user-name">Masked H</div>' in html
+    assert html.count('src="/h.png"') == 2
+
+    api = client.get(f"/api/thread/{tid}").get_json()["thread"]
+    assert api["posts"] == thread["posts"]
+    assert api["characters"][0]["pic"] == "/h.png"
+
+
+def test_character_edit_leaves_existing_posts_as_written(app_and_client, real_templates):
+    """a thread keeps the nickname and avatar its posts were written with"""
+    app, client, fake_db = app_and_client
+    char_id = ObjectId()
+    uid = fake_db.users.insert_one({
+        "username": "snap", "email": "snap@example.com", "password": "pw",
+        "characters": [{"_id": char_id, "name": "Hero", "nickname": "H", "fandom": "F", "pic": "/h.png"}],
+    }).inserted_id
+    with client.session_transaction() as sess:
+        sess["_user_id"] = str(uid)
+    payload = {"title": "Snapshots", "status": "published", "posts": [
+        {"characterIndex": 0, "nickname": "H", "avatar": "/h.png", "content": "plain"},
+    ]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    before = fake_db.forums.find_one({"_id": ObjectId(tid)})
+
+    client.post("/addcharacter", data={"id": str(char_id), "name": "Hero", "nickname": "New H",
+                                       "fandom": "F", "pic": "/new.png"})
+    run_tasks(app)
+
+    thread = fake_db.forums.find_one({"_id": ObjectId(tid)})
+    assert thread["posts"] == before["posts"]
+    assert thread["characters"] == before["characters"]
+    html = client.get(f"/viewthread/{tid}").get_data(as_text=True)
+    assert '<div class="user-name">H</div>' in html
+    assert 'src="/h.png"' in html and "New H" not in html
+
+
+def test_compact_thread_posts_migration_saves_storage():
+    """legacy posts lose their copied character fields but render the same"""
+    from migrations import compact_thread_posts
+    from snapshots import expand_posts
+    db = FakeDB()
+    chars = [{"_id": str(ObjectId()), "name": f"Character {n}", "nickname": f"nick{n}",
+              "fandom": "A Rather Long Fandom Name", "pic": f"/static/uploads/avatar-{n}.png"} for n in range(2)]
+    legacy = [{"characterIndex": n % 2, "character_id": chars[n % 2]["_id"], "character_name": chars[n % 2]["name"],
+               "character_fandom": chars[n % 2]["fandom"], "nickname": chars[n % 2]["nickname"],
+               "avatar": chars[n % 2]["pic"], "content": f"line {n}", "floor": n + 1} for n in range(1000)]
+    legacy[7]["nickname"] = "Someone else"
+    saved_at = datetime(2025, 1, 1)
+    tid = db.forums.insert_one({"title": "Log", "posts": legacy, "characters": chars, "updated_at": saved_at}).inserted_id
+    busy = db.forums.insert_one({"title": "Busy", "posts": legacy[:2], "characters": chars,
+                                 "updated_at": saved_at}).inserted_id
+    real_find = db.forums.find
+
+    def find_then_save(*args, **kwargs):
+        cursor = real_find(*args, **kwargs)
+        db.forums._docs[str(busy)]["updated_at"] = datetime(2025, 1, 2)   # edited mid-migration
+        return cursor
+    db.forums.find = find_then_save
+
+    changed, before, after = compact_thread_posts(db, batch_size=1)
+    assert changed == 2
+    assert after < before / 2
+    posts = db.forums.find_one({"_id": tid})["posts"]
+    assert "character_name" not in posts[0]
+    assert posts[7]["nickname"] == "Someone else"
+    assert expand_posts(posts, chars) == legacy
+    assert "character_name" in db.forums.find_one({"_id": busy})["posts"][0]
+
+    db.forums.find = real_find
+    assert compact_thread_posts(db)[0] == 1
+
+
+# Streaming thread ingestion
+class CountingStream(io.BytesIO):
+    """A request body that records how much of it the app read."""
+
+    def __init__(self, body):
+        super().__init__(body)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def _post_stream(client, body):
+    stream = CountingStream(body)
+    resp = client.post("/createforum", input_stream=stream, content_length=len(body),
+                       content_type="application/json")
+    return resp, stream
+
+
+def test_read_json_object_across_chunk_boundaries(monkeypatch):
+    """values split anywhere between chunks (strings, numbers, UTF-8 bytes) decode like json.loads"""
+    import ingest
+    from ingest import read_json_object
+    monkeypatch.setattr(ingest, "CHUNK_SIZE", 3)
+    doc = {"title": "Über ✓ \"quoted\"", "posts": [{"content": "héllo\nthere", "floor": 12345},
+                                                   {"content": "x" * 40, "n": -1.5e3}, 7, None, True],
+           "id": None, "n": 1234567}
+    items = []
+    fields, count = read_json_object(CountingStream(json.dumps(doc, ensure_ascii=False).encode()), "posts",
+                                     lambda i, v: items.append(v), 10**6, 10, 1000)
+    assert items == doc["posts"] and count == 5
+    assert fields == {k: v for k, v in doc.items() if k != "posts"}
+
+    for bad in (b'{"posts": [1,,2]}', b'{"posts": 1}', b'[1]', b'{"a": 1} x', b'{"a": tru}', b'{"a": "x'):
+        with pytest.raises(ingest.PayloadError) as exc:
+            read_json_object(CountingStream(bad), "posts", lambda i, v: None, 10**6, 10, 1000)
+        assert exc.value.status == 400
+
+
+def test_read_json_object_numbers_split_at_any_offset(monkeypatch):
+    """a number cut at its ".", "e" or sign by a chunk boundary still decodes whole"""
+    import ingest
+    from ingest import read_json_object
+    body = '{"posts": [-35000000000.0, 1e5, 2.5E-3, 10], "n": 6.02e+23}'
+    for size in range(1, len(body) + 1):
+        monkeypatch.setattr(ingest, "CHUNK_SIZE", size)
+        items = []
+        fields, _ = read_json_object(CountingStream(body.encode()), "posts", lambda i, v: items.append(v),
+                                     10**6, 10, 1000)
+        assert items == [-35000000000.0, 1e5, 2.5e-3, 10], size
+        assert fields == {"n": 6.02e+23}, size
+
+
+def test_createforum_rejects_bad_posts_before_reading_the_rest(app_and_client):
+    """an invalid post stops the upload at the chunk it arrived in"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    posts = [{"characterIndex": 0, "content": "fine"}, {"characterIndex": 9, "content": "bad"}]
+    posts += [{"characterIndex": 0, "content": "filler " * 100}] * 1500
+    body = json.dumps({"title": "Huge", "posts": posts}).encode()
+
+    resp, stream = _post_stream(client, body)
+    assert resp.status_code == 400
+    assert "Character index out of range in post 2" in resp.get_json()["error"]
+    assert stream.bytes_read < len(body) / 10
+    assert fake_db.forums._docs == {}
+
+
+def test_createforum_enforces_size_limits(app_and_client):
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    app.config.update(THREAD_MAX_BYTES=100_000, THREAD_MAX_POSTS=3, POST_MAX_CHARS=50)
+
+    body = json.dumps({"title": "Big", "posts": [{"characterIndex": 0, "content": "x"}] * 5000}).encode()
+    resp, stream = _post_stream(client, body)
+    assert resp.status_code == 413
+    assert stream.bytes_read == 0
+
+    body = json.dumps({"title": "Many", "posts": [{"characterIndex": 0, "content": "x"}] * 4}).encode()
+    resp, _ = _post_stream(client, body)
+    assert resp.status_code == 413
+    assert "At most 3 posts" in resp.get_json()["error"]
+
+    body = json.dumps({"title": "Long", "posts": [{"characterIndex": 0, "content": "y" * 51}]}).encode()
+    resp, _ = _post_stream(client, body)
+    assert resp.status_code == 400
+    assert "longer than 50 characters" in resp.get_json()["error"]
+
+    body = json.dumps({"title": "Ok", "posts": [{"characterIndex": 0, "content": "y" * 50}] * 3}).encode()
+    resp, _ = _post_stream(client, body)
+    assert resp.status_code == 200
+    assert len(fake_db.forums.find_one({"title": "Ok"})["posts"]) == 3
+
+
+# Shared HTTP cache
+class VarnishStandIn:
+    """A caching proxy in front of the test client, standing in for Varnish with xkey.
+
+    Keeps responses marked public for their max-age, indexed by their
+    Surrogate-Key header, and listens on a real local port for
+    `PURGE` requests carrying the keys to evict.
+    """
+
+    def __init__(self, client):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.client = client
+        self.store = {}
+        self.purged = []
+        self.backend_fetches = 0
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PURGE(self):
+                standin.purge(self.headers.get("Surrogate-Key", "").split())
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def get(self, path):
+        entry = self.store.get(path)
+        if entry is not None:
+            return entry["body"]
+        self.backend_fetches += 1
+        resp = self.client.get(path)
+        directives = [d.strip() for d in resp.headers.get("Cache-Control", "").split(",")]
+        if "public" in directives:
+            self.store[path] = {"body": resp.get_json(), "keys": set(resp.headers["Surrogate-Key"].split())}
+        return resp.get_json()
+
+    def purge(self, keys):
+        self.purged.append(keys)
+        self.store = {path: e for path, e in self.store.items() if not e["keys"] & set(keys)}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def varnish(app_and_client):
+    app, client, fake_db = app_and_client
+    standin = VarnishStandIn(client)
+    app.extensions["surrogate_purger"].urls = [standin.url]
+    yield standin
+    standin.close()
+
+
+def test_public_reads_carry_cache_headers(app_and_client):
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    payload = {"title": "Public", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+
+    policy = "public, max-age=30, stale-while-revalidate=60"
+    for path, key in ((f"/api/thread/{tid}", f"thread-{tid}"), ("/api/community", "community"),
+                      ("/api/published_forums", "published-forums")):
+        resp = client.get(path)
+        assert resp.headers["Cache-Control"] == policy
+        assert resp.headers["Surrogate-Key"] == key
+
+    payload.update({"id": tid, "status": "draft"})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    resp = client.get(f"/api/thread/{tid}")
+    assert resp.status_code == 200
+    assert "Cache-Control" not in resp.headers and "Surrogate-Key" not in resp.headers
+    assert "Cache-Control" not in client.get("/api/community?sort=bogus").headers
+
+    app.config["HTTP_CACHE_MAX_AGE"] = 0
+    assert "Cache-Control" not in client.get("/api/community").headers
+
+
+def test_thread_changes_purge_the_proxy_by_surrogate_key(app_and_client, varnish):
+    """the proxy absorbs repeat reads until an edit or delete purges what it showed"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    payload = {"title": "Before", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+    assert varnish.purged == [[f"thread-{tid}", "community", "published-forums"]]
+
+    for _ in range(3):
+        assert varnish.get("/api/community")["forums"][0]["title"] == "Before"
+        assert varnish.get(f"/api/thread/{tid}")["thread"]["title"] == "Before"
+    assert varnish.backend_fetches == 2
+
+    payload.update({"id": tid, "title": "After"})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    assert varnish.get("/api/community")["forums"][0]["title"] == "Before"    # purged once the task ran
+    run_tasks(app)
+    assert varnish.get("/api/community")["forums"][0]["title"] == "After"
+    assert varnish.get(f"/api/thread/{tid}")["thread"]["title"] == "After"
+
+    client.delete(f"/api/my_forums/{tid}")
+    run_tasks(app)
+    assert varnish.get("/api/community")["forums"] == []
+    assert varnish.store.keys() == {"/api/community"}
+
+
+def test_draft_saves_leave_the_public_listings_cached(app_and_client, varnish):
+    """only a save that writes or drops a feed card purges the listings"""
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    payload = {"title": "Draft", "status": "draft", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    payload["id"] = tid
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    varnish.get("/api/community")
+    run_tasks(app)
+    assert varnish.purged == [[f"thread-{tid}"], [f"thread-{tid}"]]
+    assert "/api/community" in varnish.store
+
+    varnish.purged.clear()
+    for status in ("published", "draft", "draft"):
+        payload["status"] = status
+        client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+        run_tasks(app)
+    listings = [f"thread-{tid}", "community", "published-forums"]
+    assert varnish.purged == [listings, listings, [f"thread-{tid}"]]
+
+
+def test_failed_purge_retries_the_feed_task(app_and_client, varnish):
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    varnish.close()
+    payload = {"title": "Unreachable", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    run_tasks(app)
+    [task] = fake_db.tasks._docs.values()
+    assert task["name"] == "feed.sync"
+    assert task["status"] == "pending" and task["attempts"] == 1
+
+
+# Two-tier data cache
+class RedisStandIn:
+    """Just enough of a Redis server, over RESP on a local port, for the shared cache."""
+
+    def __init__(self):
+        import socketserver
+        import threading
+        import time
+        self.data = {}
+        self.expires = {}
+        self.commands = []
+        self.lock = threading.Lock()
+        standin = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    args = []
+                    for _ in range(int(line[1:])):
+                        size = int(self.rfile.readline()[1:])
+                        args.append(self.rfile.read(size + 2)[:-2])
+                    with standin.lock:
+                        reply = standin.run(args, time.monotonic())
+                    self.wfile.write(reply)
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"redis://127.0.0.1:{self.server.server_address[1]}/0"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def run(self, args, now):
+        name, args = args[0].decode().upper(), args[1:]
+        self.commands.append(name)
+        for key in [k for k, at in self.expires.items() if at <= now]:
+            self.data.pop(key, None)
+            del self.expires[key]
+
+        def bulk(value):
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "GET":
+            return bulk(self.data.get(args[0]))
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+            if "NX" in options and key in self.data:
+                return bulk(None)
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if "PX" in options:
+                self.expires[key] = now + int(options[options.index("PX") + 1]) / 1000
+            return b"+OK\r\n"
+        if name == "DEL":
+            removed = sum(self.data.pop(key, None) is not None for key in args)
+            return b":%d\r\n" % removed
+        if name == "SADD":
+            members = self.data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            return b":%d\r\n" % added
+        if name == "SMEMBERS":
+            members = self.data.get(args[0], set())
+            return b"*%d\r\n" % len(members) + b"".join(bulk(m) for m in members)
+        if name == "PEXPIRE":
+            if args[0] not in self.data:
+                return b":0\r\n"
+            self.expires[args[0]] = now + int(args[1]) / 1000
+            return b":1\r\n"
+        return b"-ERR unknown command '%s'\r\n" % name.encode()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def redis_standin():
+    standin = RedisStandIn()
+    yield standin
+    standin.close()
+
+
+def _tiered(url, **kwargs):
+    from cache import LRUCache, TieredCache
+    from resp import RespClient
+    return TieredCache(LRUCache(100, name="test"), RespClient(url) if url else None, **kwargs)
+
+
+def test_resp_client_talks_to_the_standin(redis_standin):
+    from resp import RespClient, RespError
+    client = RespClient(redis_standin.url)
+    assert client.execute("PING") == b"PONG"
+    assert client.pipeline([("SET", "k", "v", "PX", 1000), ("GET", "k"), ("GET", "nope")]) == [b"OK", b"v", None]
+    assert client.execute("SADD", "s", "a", "b") == 2
+    assert sorted(client.execute("SMEMBERS", "s")) == [b"a", b"b"]
+    with pytest.raises(RespError):
+        client.execute("FLY")
+    assert client.execute("DEL", "k", "s") == 2
+
+
+def test_tiered_cache_shares_values_across_workers(redis_standin):
+    """a second worker is served from L2; tags invalidate L2 at once and other L1s within l1_ttl"""
+    import time
+    first, second = _tiered(redis_standin.url, l1_ttl=0.2), _tiered(redis_standin.url, l1_ttl=0.2)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {"title": "T", "at": datetime(2025, 1, 1), "id": ObjectId("0123456789ab0123456789ab")}
+
+    value = first.get_or_load("thread:1", load, 60, ["thread-1"])
+    assert second.get_or_load("thread:1", load, 60, ["thread-1"]) == value
+    assert len(loads) == 1
+
+    first.invalidate("thread-1")
+    assert first.get_or_load("thread:1", load, 60, ["thread-1"]) == value
+    assert len(loads) == 2      # this worker and L2 were cleared
+    assert second.get_or_load("thread:1", load, 60, ["thread-1"]) == value
+    assert len(loads) == 2      # the other worker's L1 still held it
+    first.invalidate("thread-1")
+    time.sleep(0.25)
+    second.get_or_load("thread:1", load, 60, ["thread-1"])
+    assert len(loads) == 3
+
+    # per-key ttl: gone from both tiers once it passes
+    first.get_or_load("short", lambda: "x", 0.05)
+    time.sleep(0.1)
+    assert first.get_or_load("short", lambda: "y", 0.05) == "y"
+    assert first.get_or_load("none", lambda: None, 60) is None
+    assert b"cache:none" not in redis_standin.data
+
+
+def test_tiered_cache_coalesces_concurrent_misses(redis_standin):
+    """a stampede on one key runs one load, within a process and across processes"""
+    import threading
+    import time
+    workers = [_tiered(redis_standin.url), _tiered(redis_standin.url)]
+    loads = []
+
+    def slow_load():
+        loads.append(1)
+        time.sleep(0.2)
+        return ["feed"]
+
+    results = []
+    threads = [threading.Thread(target=lambda w=w: results.append(w.get_or_load("community:recent", slow_load, 60)))
+               for w in workers for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [["feed"]] * 16
+    assert len(loads) == 1
+
+
+def test_tiered_cache_works_without_l2(caplog):
+    """no shared layer, or an unreachable one, leaves the L1 cache working"""
+    import socket
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    for cache in (_tiered(None), _tiered(f"redis://127.0.0.1:{port}")):
+        assert cache.get_or_load("k", lambda: 1, 60, ["t"]) == 1
+        assert cache.get_or_load("k", lambda: 2, 60, ["t"]) == 1
+        cache.invalidate("t")
+        assert cache.get_or_load("k", lambda: 3, 60, ["t"]) == 3
+    assert caplog.text.count("Shared cache unavailable") == 1
+
+
+def test_feed_and_thread_reads_go_through_the_data_cache(app_and_client, redis_standin, assert_queries):
+    from resp import RespClient
+    app, client, fake_db = app_and_client
+    app.extensions["data_cache"].l2 = RespClient(redis_standin.url)
+    _feed_user(fake_db, client)
+    payload = {"title": "Cached", "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+    tid = client.post("/createforum", data=json.dumps(payload), content_type="application/json").get_json()["id"]
+    run_tasks(app)
+
+    for path in ("/api/community", "/api/published_forums", f"/api/thread/{tid}"):
+        client.get(path)
+        with assert_queries(0, exact=True):
+            assert client.get(path).status_code == 200
+    assert b"cache:community:recent" in redis_standin.data
+
+    payload.update({"id": tid, "title": "Edited"})
+    client.post("/createforum", data=json.dumps(payload), content_type="application/json")
+    assert client.get(f"/api/thread/{tid}").get_json()["thread"]["title"] == "Edited"
+    run_tasks(app)
+    assert client.get("/api/community").get_json()["forums"][0]["title"] == "Edited"
+    assert client.get("/api/published_forums").get_json()["forums"][0]["title"] == "Edited"
+
+    # a rename fans out in the background and drops the author's cached threads
+    client.post("/profile/username", data={"username": "renamed"})
+    run_tasks(app)
+    assert f"thread:{tid}" not in app.extensions["data_cache"].l1
+    assert f"cache:thread:{tid}".encode() not in redis_standin.data
+
+
+# Cache warm-up
+def test_cache_warmup_fills_feed_and_top_threads(app_and_client, assert_queries, redis_standin):
+    from resp import RespClient
+    app, client, fake_db = app_and_client
+    _feed_user(fake_db, client)
+    ids = []
+    for title in ("Quiet", "Popular"):
+        payload = {"title": title, "status": "published", "posts": [{"characterIndex": 0, "content": "hi"}]}
+        ids.append(client.post("/createforum", data=json.dumps(payload),
+                               content_type="application/json").get_json()["id"])
+    run_tasks(app)
+    quiet, popular = ids
+    fake_db.feed_items.update_one({"_id": ObjectId(popular)}, {"$set": {"trending_score": 5.0}})
+    with client.session_transaction() as sess:
+        sess.clear()
+    app.config["CACHE_WARMUP_THREADS"] = 1
+    data_cache = app.extensions["data_cache"]
+    assert app.extensions["cache_warmer"].run() == {"warm_feed": 0, "warm_top_threads": 1}
+    assert not data_cache.l1._data      # L1 alone would have let them expire within seconds
+
+    data_cache.l2 = RespClient(redis_standin.url)
+    assert app.extensions["cache_warmer"].run() == {"warm_feed": 3, "warm_top_threads": 1}
+    data_cache.l1.clear()               # a worker starting after L1's TTL
+
+    for path in ("/community", "/api/community", "/api/community?sort=trending", "/api/published_forums",
+                 f"/api/thread/{popular}"):
+        with assert_queries(0, exact=True):
+            assert client.get(path).status_code == 200
+    with assert_queries(1, exact=True):     # the status/updated_at check; the posts come rendered
+        assert b"hi" in client.get(f"/viewthread/{popular}").data
+    with assert_queries(1, exact=True):
+        client.get(f"/api/thread/{quiet}")
+
+
+def test_worker_boot_warms_the_caches(boot_app, redis_standin):
+    """a worker started for real runs every warm-up step on its own thread, into the shared cache"""
+    from feed import sync_feed_item
+    boot, db = boot_app
+    thread = {"title": "Warm", "status": "published", "posts": [], "characters": [], "user_id": ObjectId(),
+              "published_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+    tid = db.forums.insert_one(thread).inserted_id
+    sync_feed_item(db, tid, thread)
+
+    app = boot(CACHE_WARMUP_SECONDS=5, CACHE_REDIS_URL=redis_standin.url)
+    app.extensions["cache_warmer"]._thread.join(5)
+    assert {b"cache:published-forums", b"cache:community:recent", b"cache:community:trending",
+            f"cache:thread:{tid}".encode()} <= set(redis_standin.data)
+
+
+def test_cache_warmup_keeps_to_its_budget(caplog):
+    import logging
+    import time
+    from warmup import CacheWarmer
+    warmer = CacheWarmer(budget=0.1)
+    ran = []
+
+    @warmer.add
+    def broken(deadline):
+        raise RuntimeError("no database")
+
+    @warmer.add
+    def slow(deadline):
+        while time.monotonic() < deadline:
+            time.sleep(0.01)
+        ran.append("slow")
+        return 2
+
+    @warmer.add
+    def never(deadline):
+        ran.append("never")
+        return 1
+
+    with caplog.at_level(logging.INFO, logger="warmup"):
+        assert warmer.run() == {"broken": 0, "slow": 2}
+    assert ran == ["slow"]
+    assert "Cache warm-up step broken failed" in caplog.text
+    assert "skipped ['never']" in caplog.text
@@ -0,0 +1,23 @@
+# topologies whose servers accept multi-document transactions
+TRANSACTIONAL_TOPOLOGIES = {"ReplicaSetWithPrimary", "Sharded", "LoadBalanced"}
+
+
+def supports_transactions(client):
+    """True when client is connected to a replica set or mongos (no round trip: uses the topology)."""
+    return client.topology_description.topology_type_name in TRANSACTIONAL_TOPOLOGIES
+
+
+def write_together(db, writes):
+    """Run writes(session), a function issuing related writes, so they land together.
+
+    On a replica set or mongos this is one transaction; with_transaction
+    retries writes on transient errors, so it must be safe to run twice. A
+    standalone server has no transactions, so writes(None) runs the writes
+    in order on the driver's implicit sessions, without atomicity.
+    Returns what writes returns.
+    """
+    client = db.client
+    if not supports_transactions(client):
+        return writes(None)
+    with client.start_session() as session:
+        return session.with_transaction(writes)
@@ -0,0 +1,83 @@
+import atexit
+import logging
+import threading
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """Write-behind thread view counts.
+
+    Views are added up in process memory and written every flush_interval
+    seconds as one unordered bulk_write of $inc updates on forums.views, so a
+    hot thread costs one write per interval instead of one per read. The
+    count shown is the stored value plus whatever this process has not
+    flushed yet. Pending counts are flushed on interpreter exit, which a
+    gunicorn worker reaches on a graceful shutdown. on_flush, if given, is
+    called with the ids of the threads each successful flush wrote.
+    """
+
+    def __init__(self, flush_interval=10.0, on_flush=None):
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._db = None
+
+    def record(self, thread_id):
+        with self._lock:
+            self._pending[thread_id] = self._pending.get(thread_id, 0) + 1
+
+    def pending(self, thread_id):
+        with self._lock:
+            return self._pending.get(thread_id, 0)
+
+    def count(self, thread_id, stored):
+        """Views for display: the stored count plus this process's unflushed delta."""
+        return (stored or 0) + self.pending(thread_id)
+
+    def flush(self, db=None):
+        """Write the pending deltas; returns the number of threads updated."""
+        db = db if db is not None else self._db
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            result = db.forums.bulk_write(
+                [UpdateOne({"_id": thread_id}, {"$inc": {"views": n}}) for thread_id, n in pending.items()],
+                ordered=False,
+            )
+        except Exception:
+            logger.exception("Failed to flush %d view counts, keeping them for the next flush", len(pending))
+            with self._lock:
+                for thread_id, n in pending.items():
+                    self._pending[thread_id] = self._pending.get(thread_id, 0) + n
+            return 0
+        if self.on_flush is not None:
+            self.on_flush(list(pending))
+        return result.modified_count
+
+    def start(self, db):
+        """Flush to db in the background every flush_interval seconds, and at exit."""
+        self._db = db
+        self._thread = threading.Thread(target=self._run, name="view-counter", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and write what is still pending; safe to call more than once."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._db is not None:
+            self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,56 @@
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """Fills a new worker's caches on a background thread before visitors ask.
+
+    Steps (added with add(), which also works as a decorator) run in the
+    order they were added. Each is called with the deadline, a
+    time.monotonic() value, and returns how many entries it cached, so a
+    step looping over many items can stop early. Steps left when the budget
+    (seconds) is spent are skipped. Failures are logged and the next step
+    runs: a cold cache is only slower, never wrong.
+    """
+
+    def __init__(self, budget=10.0):
+        self.budget = budget
+        self._steps = []
+        self._thread = None
+        self._stopping = False
+
+    def add(self, step):
+        self._steps.append((step.__name__, step))
+        return step
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="cache-warmup", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(self.budget)
+            self._thread = None
+
+    def run(self):
+        """Run the steps; returns {step name: entries cached} for the ones that ran."""
+        started = time.monotonic()
+        deadline = started + self.budget
+        warmed = {}
+        for name, step in self._steps:
+            if self._stopping or time.monotonic() >= deadline:
+                logger.info("Cache warm-up out of time, skipped %s", [n for n, _ in self._steps if n not in warmed])
+                break
+            try:
+                warmed[name] = step(deadline)
+            except Exception:
+                logger.exception("Cache warm-up step %s failed", name)
+                warmed[name] = 0
+        logger.info("Cache warm-up done in %.2fs: %s", time.monotonic() - started, warmed)
+        return warmed